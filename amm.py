@@ -1,7 +1,22 @@
+import math
 from decimal import Decimal
 
+DEFAULT_LIQUIDITY = 1000.0  # sqrt(k) рынка, если при создании события ликвидность не задана
+MIN_LIQUIDITY, MAX_LIQUIDITY = 10.0, 10_000_000.0
+
+
+def initial_reserves(liquidity: float = DEFAULT_LIQUIDITY, yes_price: float = 0.5):
+    """
+    Стартовые резервы (yes, no) рынка с sqrt(k) = liquidity и ценой ДА = no / (yes + no) = yes_price.
+    При 0.5 — прежние liquidity/liquidity (1000/1000, k = 1e6).
+    """
+    if liquidity <= 0 or not 0 < yes_price < 1:
+        raise ValueError("liquidity must be positive and yes_price in (0, 1)")
+    ratio = math.sqrt(yes_price / (1 - yes_price))
+    return liquidity / ratio, liquidity * ratio
+
 class PredictionMarketAMM:
-    def __init__(self, yes_reserve: float = 1000.0, no_reserve: float = 1000.0):
+    def __init__(self, yes_reserve: float = DEFAULT_LIQUIDITY, no_reserve: float = DEFAULT_LIQUIDITY):
         self.yes_reserve = Decimal(str(yes_reserve))
         self.no_reserve = Decimal(str(no_reserve))
         self.constant_product = self.yes_reserve * self.no_reserve
@@ -22,25 +37,42 @@ class PredictionMarketAMM:
         return float(self.yes_reserve / total)
 
     def buy_shares(self, share_type: str, amount: float):
+        """
+        Покупка на сумму a — та же модель, что в rpc_trade_buy и проигрывании истории: пул чеканит
+        a полных комплектов (ДА+НЕТ), НЕТ-часть остаётся в пуле (no + a), ДА выдаётся до yes = k / no;
+        трейдер получает yes + a - yes'. Симметрично для НЕТ. sell_shares — обратный ход.
+        Возвращает (доли, новая цена купленной стороны).
+        """
         amt = Decimal(str(amount))
+        if share_type not in ("yes", "no") or amt <= 0:
+            return 0.0, 0.0
+        same, other = (self.yes_reserve, self.no_reserve) if share_type == "yes" else (self.no_reserve, self.yes_reserve)
+        new_other = other + amt
+        new_same = self.constant_product / new_other
+        shares = same + amt - new_same
         if share_type == "yes":
-            new_yes = self.yes_reserve + amt
-            new_no = self.constant_product / new_yes
-            if new_no > self.no_reserve:
-                return 0.0, self.calculate_yes_price()
-            shares = self.no_reserve - new_no
-            self.yes_reserve, self.no_reserve = new_yes, new_no
-            self.constant_product = self.yes_reserve * self.no_reserve
+            self.yes_reserve, self.no_reserve = new_same, new_other
             return float(shares), self.calculate_yes_price()
+        self.no_reserve, self.yes_reserve = new_same, new_other
+        return float(shares), self.calculate_no_price()
 
-        if share_type == "no":
-            new_no = self.no_reserve + amt
-            new_yes = self.constant_product / new_no
-            if new_yes > self.yes_reserve:
-                return 0.0, self.calculate_no_price()
-            shares = self.yes_reserve - new_yes
-            self.no_reserve, self.yes_reserve = new_no, new_yes
-            self.constant_product = self.yes_reserve * self.no_reserve
-            return float(shares), self.calculate_no_price()
-
-        return 0.0, 0.0
+    def sell_shares(self, share_type: str, shares: float):
+        """
+        Продажа долей пулу — та же формула, что в rpc_trade_sell (sql/008).
+        Проданные доли добавляются в свой пул, пул погашает a полных комплектов (ДА+НЕТ) за a:
+        (yes + s - a) * (no - a) = k для ДА, симметрично для НЕТ. Цена ДА = no / (yes + no) падает
+        при продаже ДА. Продажа всех долей покупки возвращает её сумму и резервы.
+        Возвращает (выручка, новая цена проданной стороны).
+        """
+        s = Decimal(str(shares))
+        if share_type not in ("yes", "no") or s <= 0:
+            return 0.0, 0.0
+        same, other = (self.yes_reserve, self.no_reserve) if share_type == "yes" else (self.no_reserve, self.yes_reserve)
+        # меньший корень a^2 - (same + s + other) * a + s * other = 0, без вычитания близких чисел
+        big = same + s + other
+        amount = 2 * s * other / (big + (big * big - 4 * s * other).sqrt())
+        if share_type == "yes":
+            self.yes_reserve, self.no_reserve = same + s - amount, other - amount
+            return float(amount), self.calculate_yes_price()
+        self.no_reserve, self.yes_reserve = same + s - amount, other - amount
+        return float(amount), self.calculate_no_price()
@@ -8,6 +8,7 @@ from urllib.parse import parse_qsl
 from functools import wraps
 from collections import deque, defaultdict
 
+import numpy as np
 import requests
 from flask import (
     Flask, request, render_template_string, jsonify, Response,
@@ -15,8 +16,27 @@ from flask import (
 )
 
 from database import db  # Supabase client под капотом
-
-app = Flask(__name__)
+from static_bundle import bundle, Asset, IMMUTABLE_CACHE
+import httpcache
+from pricehub import hub, SSE_MAX_TOPICS
+import eventbus
+from eventbus import bus
+import idempotency
+from idempotency import buy_results
+from batching import TradeBatcher
+from updates import UpdateDeduper, ChatOrderedExecutor, update_chat_id
+import positions as positions_engine
+from pagination import encode_cursor, decode_cursor
+import bulkinput
+from scheduler import ExpiryScheduler, parse_ts
+from feed import EventFeed, FEED_PAGE_MAX, ORDERS as FEED_ORDERS, decode_feed_cursor
+from search import SearchIndex, SEARCH_LIMIT_MAX
+from marketstore import MarketStore
+from lmsr import LmsrBook, LMSR_DEFAULT_B, share_deltas
+from amm import DEFAULT_LIQUIDITY, MIN_LIQUIDITY, MAX_LIQUIDITY
+
+app = Flask(__name__, static_folder=None)  # статика отдаётся через /assets/ с хэшем в имени
+httpcache.init_app(app)  # gzip для крупных JSON-ответов
 
 # --- ENV ---
 TOKEN = os.getenv("BOT_TOKEN")
@@ -26,6 +46,8 @@ TELEGRAM_SECRET_TOKEN = os.getenv("TELEGRAM_SECRET_TOKEN", "change-me")
 ADMIN_BASIC_USER = os.getenv("ADMIN_BASIC_USER", "admin")
 ADMIN_BASIC_PASS = os.getenv("ADMIN_BASIC_PASS", "admin")
 WEBAPP_SIGNING_SECRET = os.getenv("WEBAPP_SIGNING_SECRET")  # обязателен
+TELEGRAM_API = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")  # подмена для локального стенда
+TELEGRAM_MODE = (os.getenv("TELEGRAM_MODE") or "webhook").lower()  # webhook | polling
 
 # ---------- Admin auth ----------
 def _check_auth(u, p):
@@ -45,7 +67,7 @@ def requires_auth(fn):
 
 # ---------- Utils ----------
 def send_message(chat_id, text, reply_markup=None):
-    url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API}/bot{TOKEN}/sendMessage"
     data = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
     if reply_markup:
         data["reply_markup"] = json.dumps(reply_markup)
@@ -61,25 +83,25 @@ def notify_admin(text: str):
         send_message(ADMIN_ID, text)
 
 def ensure_webhook():
+    if TELEGRAM_MODE == "polling":
+        print("[setWebhook] skipped: long polling mode")
+        return
     if not (BASE_URL and TOKEN):
         print("[setWebhook] skipped: BASE_URL or TOKEN missing")
         return
+    url = f"{BASE_URL}/webhook"
+    # всегда, даже если URL не менялся: getWebhookInfo не показывает secret_token,
+    # и новый TELEGRAM_SECRET_TOKEN иначе не дошёл бы до Telegram. Вызов один — из мастера gunicorn
     try:
         resp = requests.post(
-            f"https://api.telegram.org/bot{TOKEN}/setWebhook",
-            json={"url": f"{BASE_URL}/webhook", "secret_token": TELEGRAM_SECRET_TOKEN},
+            f"{TELEGRAM_API}/bot{TOKEN}/setWebhook",
+            json={"url": url, "secret_token": TELEGRAM_SECRET_TOKEN},
             timeout=10,
         )
         print(f"[setWebhook] {resp.status_code} {resp.text}")
     except Exception as e:
         print(f"[setWebhook] error: {e}")
 
-@app.before_request
-def _init_once():
-    if not getattr(app, "_init_done", False):
-        ensure_webhook()
-        app._init_done = True
-
 def make_sig(chat_id: int) -> str:
     if not WEBAPP_SIGNING_SECRET:
         return ""
@@ -180,6 +202,35 @@ def _format_end_short(end_iso: str) -> str:
             return f"{d}.{m}.{y[2:]}"
         return s
 
+# ---------- Static assets (content-hash, immutable) ----------
+def _asset_response(asset: Asset, cache_control: str):
+    headers = {"Cache-Control": cache_control, "ETag": f'"{asset.etag}"', "Vary": "Accept-Encoding"}
+    if request.if_none_match.contains(asset.etag):
+        return Response(status=304, headers=headers)
+    body, encoding = asset.negotiate(request.headers.get("Accept-Encoding", ""))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype=asset.mimetype, headers=headers)
+
+@app.get("/assets/<path:name>")
+def static_asset(name):
+    asset = bundle.lookup(name)
+    if not asset:
+        return "not found", 404
+    return _asset_response(asset, IMMUTABLE_CACHE)
+
+_shell_cache = {}
+
+def _mini_app_shell() -> Asset:
+    v = bundle.version
+    shell = _shell_cache.get(v)
+    if shell is None:
+        html = render_template_string(MINI_APP_HTML, asset=bundle.url)
+        shell = Asset("mini-app.html", html.encode("utf-8"))
+        _shell_cache.clear()
+        _shell_cache[v] = shell
+    return shell
+
 # ---------- Health / Legal ----------
 @app.get("/health")
 def health():
@@ -204,17 +255,15 @@ LEGAL_HTML = """
 def legal():
     return Response(LEGAL_HTML, mimetype="text/html")
 
-# ---------- Telegram webhook ----------
-@app.post("/webhook")
-def telegram_webhook():
-    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
-    if TELEGRAM_SECRET_TOKEN and secret != TELEGRAM_SECRET_TOKEN:
-        return "forbidden", 403
+# ---------- Telegram updates ----------
+update_dedup = UpdateDeduper()
+update_executor = ChatOrderedExecutor(name="tg-updates")
 
-    update = request.get_json(force=True, silent=True) or {}
+def handle_update(update: dict, public_host: str):
+    """Логика бота для одного апдейта (общая для webhook и long polling)."""
     message = update.get("message")
     if not message:
-        return "ok"
+        return
 
     chat_id = message["chat"]["id"]
     text = (message.get("text") or "").strip()
@@ -234,8 +283,8 @@ def telegram_webhook():
                 sig = make_sig(chat_id)
                 if not sig:
                     send_message(chat_id, "Сервис временно недоступен. Повторите позже.")
-                    return "ok"
-                web_app_url = f"https://{request.host}/mini-app?chat_id={chat_id}&sig={sig}&v={int(time.time())}"
+                    return
+                web_app_url = f"https://{public_host}/mini-app?chat_id={chat_id}&sig={sig}&v={bundle.version}"
                 kb = {"inline_keyboard": [[{"text": "Открыть Mini App", "web_app": {"url": web_app_url}}]]}
                 send_message(chat_id, "Приложение готово.\nОткрывайте:", kb)
             elif status == "pending":
@@ -246,7 +295,7 @@ def telegram_webhook():
                 send_message(chat_id, "❌ Заявка отклонена.\nОтправьте новый логин одним сообщением для повторной подачи.")
             else:
                 send_message(chat_id, "Напишите ваш логин одним сообщением для регистрации.")
-        return "ok"
+        return
 
     # логин без команды
     if not text.startswith("/"):
@@ -264,32 +313,67 @@ def telegram_webhook():
                 send_message(chat_id, "⏳ Заявка уже на рассмотрении.\nОжидайте ответа администратора.")
             elif status == "banned":
                 send_message(chat_id, "⛔ Доступ запрещён.")
-        return "ok"
-
-    return "ok"
-
-# ---------- Mini App HTML (как в твоём коммите — без изменений) ----------
-MINI_APP_HTML = """
-  U — мини‑приложение
+        return
 
-U
+@app.post("/webhook")
+def telegram_webhook():
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+    if TELEGRAM_SECRET_TOKEN and secret != TELEGRAM_SECRET_TOKEN:
+        return "forbidden", 403
 
-—
+    update = request.get_json(force=True, silent=True) or {}
+    if update_dedup.is_duplicate(update.get("update_id")):
+        return "ok"
+    # подтверждаем сразу, обработка (БД, sendMessage) — в пуле с порядком по chat_id
+    if not update_executor.submit(update_chat_id(update), handle_update, update, request.host):
+        # очередь чата забита: не 2xx — Telegram доставит апдейт повторно, порядок сохранится
+        update_dedup.forget(update.get("update_id"))
+        return "busy", 503
+    return "ok"
 
-Баланс: —
+# ---------- Mini App: статичная оболочка (данные грузятся через /api/mini-app/bootstrap) ----------
+MINI_APP_HTML = """<!doctype html>
+<html lang="ru">
+<head>
+  <meta charset="utf-8"/>
+  <meta name="viewport" content="width=device-width, initial-scale=1"/>
+  <title>U — мини‑приложение</title>
+  <link rel="stylesheet" href="{{ asset('mini-app.css') }}"/>
+  <script src="https://telegram.org/js/telegram-web-app.js"></script>
+  <script src="{{ asset('mini-app.js') }}" defer></script>
+</head>
+<body>
+<div class="top">
+  <img id="avatar" alt="U"/>
+  <div>
+    <div id="login">—</div>
+    <div>Баланс: <span id="balance">—</span></div>
+  </div>
+</div>
 
 <h2>Активные ставки ▾</h2>
-<label><input type="checkbox"/> только закладки</label>
+<label><input type="checkbox" id="bm-active"/> только закладки</label>
 <div id="active">Загрузка...</div>
 
 <h2>Мероприятия ▾</h2>
-<label><input type="checkbox"/> только закладки</label>
+<div>
+  <button data-sort="trending">В тренде</button> <button data-sort="ending">Скоро финал</button>
+  <button data-sort="new">Новые</button>
+  <select id="ev-tag"><option value="">все темы</option></select>
+  <input id="ev-search" type="search" placeholder="Поиск" autocomplete="off"/>
+</div>
+<label><input type="checkbox" id="bm-events"/> только закладки</label>
 <div id="events"> </div>
+<button id="events-more" class="hidden">Ещё</button>
 
 <h2>Прошедшие ставки (архив) ▾</h2>
-<label><input type="checkbox"/> только закладки</label>
+<label><input type="checkbox" id="bm-archive"/> только закладки</label>
 <div id="archive">Загрузка...</div>
 
+<h2>История сделок ▾</h2>
+<div id="trades">Загрузка...</div>
+<button id="trades-more" class="hidden">Ещё</button>
+
 <h2>Таблица лидеров ▸</h2>
 <button data-period="week">Неделя</button> <button data-period="month">Месяц</button>
 <div id="leaders">—</div>
@@ -297,11 +381,16 @@ U
 <p><a href="/legal" target="_blank" rel="noopener">Правила и политика конфиденциальности</a></p>
 
 <!-- Покупка -->
-<h3>Покупка</h3>
-<p>Укажите сумму, не выше вашего баланса.</p>
-<label>Сумма (кредиты):</label>
-<input type="number" step="0.01"/>
-<button>Купить</button> <button>Отмена</button>
+<div id="buy" class="hidden">
+  <h3>Покупка</h3>
+  <div id="buy-title" class="muted"></div>
+  <p>Укажите сумму, не выше вашего баланса.</p>
+  <label>Сумма (кредиты):</label>
+  <input type="number" step="0.01" id="buy-amount"/>
+  <button id="buy-ok">Купить</button> <button id="buy-cancel">Отмена</button>
+</div>
+</body>
+</html>
 """
 
 # ---------- Rate limiting ----------
@@ -365,38 +454,126 @@ def mini_app():
     if user.get("status") == "banned":
         return Response("### Доступ запрещён", mimetype="text/html")
 
-    events = db.get_published_events()
+    # Оболочка одинакова для всех пользователей: кэшируется клиентом и ревалидируется по ETag
+    return _asset_response(_mini_app_shell(), "no-cache")
+
+# Рынки в памяти процесса: цены считаются из них, а не из строк БД на каждый запрос
+market_store = MarketStore(db.get_markets_for_events, db.get_markets_by_ids)
+bus.subscribe(eventbus.TRADE_EXECUTED, market_store.apply_trade)
+bus.subscribe(eventbus.MARKET_RESOLVED, market_store.apply_resolution)
+bus.subscribe(eventbus.EVENT_CLOSED, market_store.apply_closed)
+
+def _event_volume_buckets(event_uuids):
+    """Часовые корзины объёма всех вариантов события — затравка «тренда» ленты."""
+    return {
+        uuid: [b for st in states for b in st.stats.window.buckets()]
+        for uuid, states in market_store.for_events(event_uuids).items()
+    }
+
+# Лента: ранжирующие индексы событий в памяти (feed.py); страница — срез индекса, а не весь каталог
+event_feed = EventFeed(db.get_published_events, db.get_published_events, _event_volume_buckets)
+bus.subscribe(eventbus.TRADE_EXECUTED, event_feed.apply_trade)
+bus.subscribe(eventbus.EVENT_CREATED, event_feed.apply_created)
+bus.subscribe(eventbus.EVENT_CLOSED, event_feed.apply_closed)
+
+# Поиск: инвертированный индекс по всем событиям (search.py) — и для Mini App, и для админки
+search_index = SearchIndex(db.iter_event_pages, db.get_events_by_uuids)
+bus.subscribe(eventbus.EVENT_CREATED, search_index.apply_created)
+bus.subscribe(eventbus.EVENT_CLOSED, search_index.apply_closed)
+
+MARKET_FIELDS = ["option_index", "yes_price", "volume", "resolved", "winner_side", "volume_24h", "traders"]
+FEED_FIRST_PAGE = 20
+
+def _events_payload(events):
+    markets_by_event = market_store.for_events([e["event_uuid"] for e in events])
+    now = time.time()
+    out = []
     for e in events:
         end_iso = str(e.get("end_date", ""))
-        e["end_short"] = _format_end_short(end_iso)
-
-        mk = db.get_markets_for_event(e["event_uuid"])
-        markets = {}
-        event_total_volume = 0.0
-        for m in mk:
-            yes = float(m["total_yes_reserve"])
-            no = float(m["total_no_reserve"])
-            total = yes + no
-            yp = (no / total) if total > 0 else 0.5
-            volume = max(0.0, total - 2000.0)
+        rows = []
+        event_total_volume = event_volume_24h = 0.0
+        for m in markets_by_event.get(e["event_uuid"], []):
+            # объём — из счётчиков market_stats (sql/009), а не из отклонения резервов от стартовых
+            volume, volume_24h = m.stats.volume, m.stats.volume_24h(now)
             event_total_volume += volume
-            markets[m["option_index"]] = {
-                "yes_price": yp,
-                "volume": volume,
-                "end_short": e["end_short"],
-                "resolved": bool(m.get("resolved")) if isinstance(m, dict) else False,
-                "winner_side": m.get("winner_side") if isinstance(m, dict) else None,
-            }
-        e["markets"] = markets
-        e["tags"] = e.get("tags") or []
-        try:
-            dt = datetime.fromisoformat(end_iso.replace(" ", "T"))
-            e["end_ts"] = int(dt.replace(tzinfo=timezone.utc).timestamp())
-        except Exception:
-            e["end_ts"] = 0
-        e["total_volume"] = event_total_volume
+            event_volume_24h += volume_24h
+            rows.append([m.option_index, round(m.yes_price, 4), round(volume, 2), m.resolved, m.winner,
+                         round(volume_24h, 2), m.stats.traders])
+        end_ts = int(parse_ts(end_iso) or 0)
+        out.append({
+            "event_uuid": e["event_uuid"],
+            "name": e.get("name"),
+            "description": e.get("description"),
+            "options": [o.get("text") if isinstance(o, dict) else str(o) for o in (e.get("options") or [])],
+            "end_short": _format_end_short(end_iso),
+            "end_ts": end_ts,
+            "tags": e.get("tags") or [],
+            "total_volume": round(event_total_volume, 2),
+            "volume_24h": round(event_volume_24h, 2),
+            "markets": rows,
+        })
+    return out
+
+@app.get("/api/mini-app/bootstrap")
+def api_mini_app_bootstrap():
+    chat_id, err = auth_chat_id_from_request()
+    if err:
+        return jsonify(success=False, error=err), 403
+    u = db.get_user(chat_id)
+    if not u or u.get("status") != "approved":
+        return jsonify(success=False, error="not_approved"), 403
+    # первый экран ленты; остальное — /api/events по курсору
+    events, next_cursor = event_feed.page("trending", limit=FEED_FIRST_PAGE)
+    return jsonify(
+        success=True, v=bundle.version, market_fields=MARKET_FIELDS, events=_events_payload(events),
+        sort="trending", next_cursor=next_cursor, tags=event_feed.tags(),
+    )
+
+@app.get("/api/events")
+def api_events():
+    """
+    Страница ленты: sort=trending|ending|new, tag, limit, cursor (next_cursor прошлой страницы).
+    ids=uuid,uuid — конкретные открытые события (закладки), без пагинации.
+    """
+    chat_id, err = auth_chat_id_from_request()
+    if err:
+        return jsonify(success=False, error=err), 403
+    u = db.get_user(chat_id)
+    if not u or u.get("status") != "approved":
+        return jsonify(success=False, error="not_approved"), 403
+
+    ids = [x.strip() for x in (request.args.get("ids") or "").split(",") if x.strip()]
+    if ids:
+        events = event_feed.get_many(ids[:FEED_PAGE_MAX])
+        return jsonify(success=True, market_fields=MARKET_FIELDS, events=_events_payload(events), next_cursor=None)
+
+    sort = (request.args.get("sort") or "trending").lower()
+    if sort not in FEED_ORDERS:
+        return jsonify(success=False, error="bad_sort"), 400
+    limit = max(1, min(request.args.get("limit", FEED_FIRST_PAGE, type=int), FEED_PAGE_MAX))
+    raw_cursor = request.args.get("cursor")
+    cursor = decode_feed_cursor(raw_cursor, sort)
+    if raw_cursor and cursor is None:
+        return jsonify(success=False, error="bad_cursor"), 400
+    events, next_cursor = event_feed.page(sort, request.args.get("tag"), limit, cursor)
+    return jsonify(success=True, market_fields=MARKET_FIELDS, events=_events_payload(events), next_cursor=next_cursor)
+
+@app.get("/api/events/search")
+def api_events_search():
+    """Поиск открытых событий: q — слова (каждое как префикс, все обязательны), limit."""
+    chat_id, err = auth_chat_id_from_request()
+    if err:
+        return jsonify(success=False, error=err), 403
+    u = db.get_user(chat_id)
+    if not u or u.get("status") != "approved":
+        return jsonify(success=False, error="not_approved"), 403
 
-    return render_template_string(MINI_APP_HTML, events=events, enumerate=enumerate)
+    q = (request.args.get("q") or "").strip()
+    limit = max(1, min(request.args.get("limit", FEED_FIRST_PAGE, type=int), SEARCH_LIMIT_MAX))
+    uuids = search_index.search(q, limit=limit) if q else []
+    # строки — из ленты: там уже есть всё для карточек, отдельного запроса в БД нет
+    events = event_feed.get_many(uuids)
+    return jsonify(success=True, market_fields=MARKET_FIELDS, events=_events_payload(events), next_cursor=None)
 
 @app.get("/api/me")
 def api_me():
@@ -409,54 +586,141 @@ def api_me():
     if u.get("status") != "approved":
         return jsonify(success=False, error="not_approved"), 403
 
-    positions = db.get_user_positions(chat_id)
-    archive = db.get_user_archive(chat_id)
+    def build():
+        # позиции — /api/me/positions, история сделок — /api/me/archive (обе постранично)
+        return jsonify(
+            success=True,
+            user={"chat_id": chat_id, "balance": float(u.get("balance", 0)), "login": u.get("login")},
+        )
+
+    return httpcache.conditional(("me", chat_id, u.get("balance"), u.get("login")), build)
+
+def _trade_buy_single(market_id: int, o: dict):
+    """Одиночный ордер батчера: с ключом идемпотентности — через rpc_trade_idempotent."""
+    if o.get("idem_key"):
+        return db.trade_idempotent("buy", o["chat_id"], market_id, o["side"], o["amount"],
+                                   o["idem_key"], o["request_hash"])
+    return db.trade_buy(o["chat_id"], market_id, o["side"], o["amount"])
+
+trade_batcher = TradeBatcher(execute_single=_trade_buy_single, execute_batch=db.trade_buy_batch)
+
+@app.get("/api/me/positions")
+def api_me_positions():
+    """Портфель: позиции с названием события, вариантом, текущей ценой, оценкой и P&L (постранично)."""
+    chat_id, err = auth_chat_id_from_request()
+    if err:
+        return jsonify(success=False, error=err), 403
+    u = db.get_user(chat_id)
+    if not u or u.get("status") != "approved":
+        return jsonify(success=False, error="not_approved"), 403
 
+    limit = max(1, min(request.args.get("limit", 50, type=int), positions_engine.POSITIONS_PAGE_MAX))
+    offset = max(0, request.args.get("offset", 0, type=int))
+    rows = db.get_user_position_rows(chat_id, limit=limit + 1, offset=offset)
+    markets = market_store.get_many({r["market_id"] for r in rows[:limit]})
+    items, has_more, totals = positions_engine.portfolio_page(rows, limit, markets)
     return jsonify(
         success=True,
-        user={"chat_id": chat_id, "balance": float(u.get("balance", 0)), "login": u.get("login")},
-        positions=positions,
-        archive=archive,
+        positions=items,
+        page_totals=totals,
+        next_offset=offset + limit if has_more else None,
     )
 
-@app.post("/api/market/buy")
-def api_market_buy():
+ARCHIVE_PAGE_MAX = 200
+
+def _archive_item(row: dict) -> dict:
+    pm = row.get("prediction_markets") or {}
+    return {
+        "id": row["id"],
+        "market_id": row.get("market_id"),
+        "event_uuid": pm.get("event_uuid"),
+        "option_index": pm.get("option_index"),
+        "order_type": row.get("order_type"),
+        "amount": float(row.get("amount") or 0),
+        "price": float(row.get("price") or 0),
+        "shares": float(row.get("shares") or 0),
+        "created_at": row.get("created_at"),
+    }
+
+@app.get("/api/me/archive")
+def api_me_archive():
+    """
+    История сделок, keyset-пагинация по (created_at, id):
+      ?cursor=<next_cursor> — следующая (более старая) страница;
+      ?since=<latest_cursor> — только сделки новее курсора (догрузка без перечитывания);
+      ?market_id= / ?event_uuid= — фильтры.
+    """
     chat_id, err = auth_chat_id_from_request()
     if err:
         return jsonify(success=False, error=err), 403
-    if not _check_rate(chat_id):
-        return jsonify(success=False, error="rate_limited"), 429
+    u = db.get_user(chat_id)
+    if not u or u.get("status") != "approved":
+        return jsonify(success=False, error="not_approved"), 403
 
-    payload = request.get_json(silent=True) or {}
-    try:
-        event_uuid = str(payload.get("event_uuid"))
-        option_index = int(payload.get("option_index"))
-        side = str(payload.get("side")).lower()
-        amount = float(payload.get("amount"))
-        if side not in ("yes", "no"):
-            raise ValueError
-        if not (0 < amount <= 1_000_000):
-            raise ValueError
-    except Exception:
-        return jsonify(success=False, error="bad_payload"), 400
+    limit = max(1, min(request.args.get("limit", 50, type=int), ARCHIVE_PAGE_MAX))
+    raw_cursor = request.args.get("cursor")
+    raw_since = request.args.get("since")
+    cursor = decode_cursor(raw_cursor)
+    since = decode_cursor(raw_since)
+    if (raw_cursor and not cursor) or (raw_since and not since):
+        return jsonify(success=False, error="bad_cursor"), 400
+    if cursor and since:
+        return jsonify(success=False, error="cursor_and_since"), 400
+
+    rows = db.get_user_archive_page(
+        chat_id, limit=limit + 1, cursor=cursor, since=since,
+        market_id=request.args.get("market_id", type=int),
+        event_uuid=(request.args.get("event_uuid") or "").strip() or None,
+    )
+    has_more = len(rows) > limit
+    items = [_archive_item(r) for r in rows[:limit]]
+
+    if since:
+        # по возрастанию: последний элемент — новый latest_cursor
+        newest = items[-1] if items else None
+        next_cursor = None
+        latest = encode_cursor(newest["created_at"], newest["id"]) if newest else raw_since
+    else:
+        last = items[-1] if items else None
+        next_cursor = encode_cursor(last["created_at"], last["id"]) if has_more and last else None
+        latest = encode_cursor(items[0]["created_at"], items[0]["id"]) if items and not cursor else None
+    return jsonify(success=True, items=items, next_cursor=next_cursor, latest_cursor=latest, has_more=has_more)
 
+def _execute_buy(chat_id: int, event_uuid: str, option_index: int, side: str, amount: float, idem=None):
+    """
+    Сделка через RPC. idem — (ключ, хэш запроса): ключ пишется в транзакции сделки (sql/012).
+    Возвращает (тело ответа, HTTP-статус, повтор ли это сохранённой сделки).
+    """
     # Получить market_id и вызвать RPC
-    market_id = db.get_market_id(event_uuid, option_index)
-    if not market_id:
-        return jsonify(success=False, error="market_not_found"), 404
+    market = market_store.by_key(event_uuid, option_index)
+    if not market:
+        return {"success": False, "error": "market_not_found"}, 404, False
+    if market.closed or market.resolved:
+        return {"success": False, "error": "market_closed"}, 409, False
+    market_id = market.id
+    key, req_hash = idem or (None, None)
 
     try:
-        rr = (
-            db.client.rpc(
-                "rpc_trade_buy",
-                {"p_chat_id": chat_id, "p_market_id": market_id, "p_side": side, "p_amount": amount},
-            )
-            .execute()
-            .data or []
-        )
-        if not rr:
-            return jsonify(success=False, error="rpc_failed"), 400
-        row = rr[0]
+        if market.book is not None:
+            # LMSR: все варианты события оцениваются совместно, сделка меняет книгу события
+            row = (db.trade_idempotent("buy_lmsr", chat_id, market_id, side, amount, key, req_hash) if key
+                   else db.trade_buy_lmsr(chat_id, market_id, side, amount))
+        elif trade_batcher.enabled:
+            # горячий рынок: ордера за окно в несколько мс уходят одним rpc_trade_buy_batch
+            order = {"chat_id": chat_id, "side": side, "amount": amount}
+            if key:
+                order.update(idem_key=key, request_hash=req_hash)
+            row = trade_batcher.submit(market_id, order)
+        elif key:
+            row = db.trade_idempotent("buy", chat_id, market_id, side, amount, key, req_hash)
+        else:
+            row = db.trade_buy(chat_id, market_id, side, amount)
+        if not row:
+            return {"success": False, "error": "rpc_failed"}, 400, False
+        replayed = bool(row.get("replayed"))
+        if "success" in row:
+            # ответ целиком, сохранённый до sql/012
+            return {k: v for k, v in row.items() if k != "replayed"}, 200, True
         result = {
             "got_shares": float(row["got_shares"]),
             "trade_price": float(row["trade_price"]),
@@ -466,32 +730,304 @@ def api_market_buy():
             "yes_reserve": float(row["yes_reserve"]),
             "no_reserve": float(row["no_reserve"]),
         }
+        if row.get("lmsr_q") is not None:
+            result["lmsr_q"] = [float(x) for x in row["lmsr_q"]]
+    except TimeoutError as e:
+        # лидер пакета не ответил вовремя, но сделка могла пройти: исход неизвестен, не 500
+        print("[api_market_buy] trade timeout:", e)
+        return {"success": False, "error": "trade_pending"}, 504, False
     except Exception as e:
+        msg = str(e)
+        if "market_closed" in msg:
+            # end_date наступил между проверкой и RPC — сработал триггер sql/006
+            return {"success": False, "error": "market_closed"}, 409, False
+        if "idempotency_key_reused" in msg:
+            return {"success": False, "error": "idempotency_key_reused"}, 422, False
+        if "in_progress" in msg:
+            return {"success": False, "error": "in_progress"}, 409, False
         print("[api_market_buy] rpc error:", e)
-        return jsonify(success=False, error="rpc_error"), 500
-
-    return jsonify(
-        success=True,
-        trade={
+        return {"success": False, "error": "rpc_error"}, 500, False
+
+    if not replayed:
+        bus.publish(eventbus.TRADE_EXECUTED, {
+            "event_uuid": event_uuid, "option_index": option_index, "market_id": market_id,
+            "chat_id": chat_id, "side": side, "amount": amount, **result,
+            # триггер неттинга (sql/008) мог погасить пары ДА+НЕТ после расчёта new_balance — перечитываем
+            "new_balance": None,
+        })
+
+    # new_balance не отдаём: RPC считает его до неттинга (sql/008), актуальный баланс — /api/me
+    return {
+        "success": True,
+        "trade": {
             "got_shares": result["got_shares"],
             "trade_price": result["trade_price"],
+        },
+        "market": {
+            "yes_price": result["yes_price"],
+            "no_price": result["no_price"],
+            "yes_reserve": result["yes_reserve"],
+            "no_reserve": result["no_reserve"],
+        },
+    }, 200, replayed
+
+def _replay_buy(body: dict):
+    resp = jsonify(body)
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+def _execute_sell(chat_id: int, event_uuid: str, option_index: int, side: str, shares: float, idem=None):
+    """Продажа долей через rpc_trade_sell. idem и результат — как у _execute_buy."""
+    market = market_store.by_key(event_uuid, option_index)
+    if not market:
+        return {"success": False, "error": "market_not_found"}, 404, False
+    if market.closed or market.resolved:
+        return {"success": False, "error": "market_closed"}, 409, False
+    market_id = market.id
+    key, req_hash = idem or (None, None)
+
+    try:
+        # мимо батчера: продажи редки, а RPC сам блокирует рынок (или книгу LMSR-события)
+        row = (db.trade_idempotent("sell", chat_id, market_id, side, shares, key, req_hash) if key
+               else db.trade_sell(chat_id, market_id, side, shares))
+        if not row:
+            return {"success": False, "error": "rpc_failed"}, 400, False
+        replayed = bool(row.get("replayed"))
+        if "success" in row:
+            return {k: v for k, v in row.items() if k != "replayed"}, 200, True
+        result = {
+            "got_amount": float(row["got_amount"]),
+            "trade_price": float(row["trade_price"]),
+            "new_balance": float(row["new_balance"]),
+            "yes_price": float(row["yes_price"]),
+            "no_price": float(row["no_price"]),
+            "yes_reserve": float(row["yes_reserve"]),
+            "no_reserve": float(row["no_reserve"]),
+        }
+        if row.get("lmsr_q") is not None:
+            result["lmsr_q"] = [float(x) for x in row["lmsr_q"]]
+    except Exception as e:
+        msg = str(e)
+        if "market_closed" in msg:
+            return {"success": False, "error": "market_closed"}, 409, False
+        if "insufficient_shares" in msg:
+            return {"success": False, "error": "insufficient_shares"}, 400, False
+        if "idempotency_key_reused" in msg:
+            return {"success": False, "error": "idempotency_key_reused"}, 422, False
+        if "in_progress" in msg:
+            return {"success": False, "error": "in_progress"}, 409, False
+        print("[api_market_sell] rpc error:", e)
+        return {"success": False, "error": "rpc_error"}, 500, False
+
+    if not replayed:
+        bus.publish(eventbus.TRADE_EXECUTED, {
+            "event_uuid": event_uuid, "option_index": option_index, "market_id": market_id,
+            "chat_id": chat_id, "side": side, "shares": shares, "sell": True, **result,
+        })
+
+    return {
+        "success": True,
+        "trade": {
+            "sold_shares": shares,
+            "got_amount": result["got_amount"],
+            "trade_price": result["trade_price"],
             "new_balance": result["new_balance"],
         },
-        market={
+        "market": {
             "yes_price": result["yes_price"],
             "no_price": result["no_price"],
             "yes_reserve": result["yes_reserve"],
             "no_reserve": result["no_reserve"],
         },
+    }, 200, replayed
+
+def _parse_trade(payload: dict, qty_field: str):
+    """(event_uuid, option_index, side, количество) или ValueError."""
+    event_uuid = str(payload.get("event_uuid"))
+    option_index = int(payload.get("option_index"))
+    side = str(payload.get("side")).lower()
+    qty = float(payload.get(qty_field))
+    if side not in ("yes", "no"):
+        raise ValueError
+    if not (0 < qty <= 1_000_000):
+        raise ValueError
+    return event_uuid, option_index, side, qty
+
+def _request_hash(kind: str, event_uuid: str, option_index: int, side: str, qty: float) -> str:
+    """Отпечаток тела сделки: тот же ключ с другим телом — ошибка, а не чужой результат."""
+    raw = json.dumps([kind, event_uuid, option_index, side, qty], separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def _replay_cached(cached, req_hash: str):
+    stored_hash, body = cached
+    if stored_hash != req_hash:
+        return jsonify(success=False, error="idempotency_key_reused"), 422
+    return _replay_buy(body)
+
+def _idempotent_trade(chat_id: int, payload: dict, req_hash: str, execute):
+    """
+    Сделка с необязательным Idempotency-Key: execute(idem) -> (тело, статус, повтор).
+    Ключи покупок и продаж общие — один ключ не может дать две разные сделки.
+    Ключ пишется в транзакции сделки (sql/012): после 500 повтор либо исполнит сделку
+    (транзакция откатилась), либо вернёт её настоящий результат (закоммитилась).
+    """
+    raw_key = request.headers.get("Idempotency-Key") or payload.get("idempotency_key")
+    idem_key = idempotency.normalize_key(raw_key)
+    if raw_key and not idem_key:
+        return jsonify(success=False, error="bad_idempotency_key"), 400
+    if not idem_key:
+        if not _check_rate(chat_id):
+            return jsonify(success=False, error="rate_limited"), 429
+        body, status, _ = execute(None)
+        return jsonify(body), status
+
+    # Повтор с тем же ключом в этом воркере: отдаём сохранённый результат, RPC не вызываем
+    cache_key = (chat_id, idem_key)
+    cached = buy_results.get(cache_key)
+    if cached is not None:
+        return _replay_cached(cached, req_hash)
+    owner, inflight = buy_results.begin(cache_key)
+    if not owner:
+        inflight.wait(15)
+        cached = buy_results.get(cache_key)
+        if cached is not None:
+            return _replay_cached(cached, req_hash)
+        return jsonify(success=False, error="in_progress"), 409
+    try:
+        if not _check_rate(chat_id):
+            return jsonify(success=False, error="rate_limited"), 429
+        body, status, replayed = execute((idem_key, req_hash))
+        if status != 200:
+            return jsonify(body), status
+        buy_results.put(cache_key, (req_hash, body))
+        return _replay_buy(body) if replayed else (jsonify(body), status)
+    finally:
+        buy_results.finish(cache_key)
+
+@app.post("/api/market/buy")
+def api_market_buy():
+    chat_id, err = auth_chat_id_from_request()
+    if err:
+        return jsonify(success=False, error=err), 403
+
+    payload = request.get_json(silent=True) or {}
+    try:
+        event_uuid, option_index, side, amount = _parse_trade(payload, "amount")
+    except Exception:
+        return jsonify(success=False, error="bad_payload"), 400
+    return _idempotent_trade(
+        chat_id, payload, _request_hash("buy", event_uuid, option_index, side, amount),
+        lambda idem: _execute_buy(chat_id, event_uuid, option_index, side, amount, idem),
+    )
+
+@app.post("/api/market/sell")
+def api_market_sell():
+    """Продажа shares долей своей позиции обратно рынку; тело — как у /api/market/buy, shares вместо amount."""
+    chat_id, err = auth_chat_id_from_request()
+    if err:
+        return jsonify(success=False, error=err), 403
+
+    payload = request.get_json(silent=True) or {}
+    try:
+        event_uuid, option_index, side, shares = _parse_trade(payload, "shares")
+    except Exception:
+        return jsonify(success=False, error="bad_payload"), 400
+    return _idempotent_trade(
+        chat_id, payload, _request_hash("sell", event_uuid, option_index, side, shares),
+        lambda idem: _execute_sell(chat_id, event_uuid, option_index, side, shares, idem),
     )
 
+# ---------- Live prices (SSE) ----------
+@bus.on(eventbus.TRADE_EXECUTED)
+def _push_trade_price(d):
+    if d.get("lmsr_q"):
+        # LMSR: сделка по одному варианту двигает цены всех вариантов события
+        for st in market_store.for_events([d["event_uuid"]])[d["event_uuid"]]:
+            hub.publish(d["event_uuid"], st.id, {"e": d["event_uuid"], "i": st.option_index, "p": st.yes_price})
+        return
+    hub.publish(d["event_uuid"], d["market_id"], {
+        "e": d["event_uuid"], "i": d["option_index"],
+        "y": d["yes_reserve"], "n": d["no_reserve"], "p": d["yes_price"],
+    })
+
+@bus.on(eventbus.MARKET_RESOLVED)
+def _push_resolution(d):
+    hub.publish(d["event_uuid"], d["market_id"], {"e": d["event_uuid"], "i": d["option_index"], "r": True, "w": d["winner_side"]})
+
+# ---------- Автозакрытие событий по end_date ----------
+EXPIRY_NOTIFY_ADMIN = os.getenv("EXPIRY_NOTIFY_ADMIN", "1") != "0"
+expiry = ExpiryScheduler(db.get_open_event_deadlines, db.close_expired_events)
+
+@expiry.on_closed
+def _on_event_closed(row):
+    bus.publish(eventbus.EVENT_CLOSED, {"event_uuid": row["event_uuid"]})
+    if EXPIRY_NOTIFY_ADMIN:
+        notify_admin(f"Приём ставок закрыт: {row.get('name')}\nПодвести итоги: {BASE_URL}/admin/events?q={row['event_uuid']}")
+
+@bus.on(eventbus.EVENT_CREATED)
+def _schedule_created_event(d):
+    expiry.schedule(d["event_uuid"], parse_ts(d.get("end_date")))
+
+SSE_TICK = 0.5          # коалесцируем обновления в пределах тика
+SSE_HEARTBEAT = 15      # комментарий-пинг, чтобы прокси не рвали соединение
+SSE_MAX_LIFETIME = 300  # потом EventSource переподключается сам, а поток воркера освобождается
+
+@app.get("/api/stream/prices")
+def api_stream_prices():
+    chat_id, err = auth_chat_id_from_request()
+    if err:
+        return jsonify(success=False, error=err), 403
+    topics = [t.strip() for t in (request.args.get("events") or "").split(",") if t.strip()]
+    if not topics:
+        return jsonify(success=False, error="no_events"), 400
+    bus.start()  # слушаем сделки соседних воркеров
+    sub = hub.subscribe(topics)
+    if sub is None:
+        return jsonify(success=False, error="too_many_streams"), 503
+
+    def gen():
+        try:
+            yield "retry: 3000\n\n"
+            started = time.monotonic()
+            while time.monotonic() - started < SSE_MAX_LIFETIME:
+                if not sub.wait(SSE_HEARTBEAT):
+                    yield ": hb\n\n"
+                    continue
+                time.sleep(SSE_TICK)  # даём пачке обновлений накопиться
+                items = sub.drain()
+                if items:
+                    yield f"event: prices\ndata: {json.dumps(items, separators=(',', ':'))}\n\n"
+        finally:
+            hub.unsubscribe(sub)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(gen()), mimetype="text/event-stream", headers=headers)
+
+@app.get("/api/prices")
+def api_prices():
+    """Короткий опрос вместо SSE (лимит потоков воркера исчерпан): цены рынков в формате событий потока."""
+    chat_id, err = auth_chat_id_from_request()
+    if err:
+        return jsonify(success=False, error=err), 403
+    topics = [t.strip() for t in (request.args.get("events") or "").split(",") if t.strip()][:SSE_MAX_TOPICS]
+    if not topics:
+        return jsonify(success=False, error="no_events"), 400
+    states = [st for sts in market_store.for_events(topics).values() for st in sts]
+
+    def build():
+        items = [{"e": st.event_uuid, "i": st.option_index, "p": st.yes_price, "r": st.resolved, "w": st.winner}
+                 for st in states]
+        return jsonify(success=True, items=items)
+
+    return httpcache.conditional(("prices", tuple(st.version() for st in states)), build)
+
 @app.get("/api/userpic")
 def api_userpic():
     chat_id, err = auth_chat_id_from_request()
     if err:
         return "bad_auth", 403
     try:
-        url = f"https://api.telegram.org/bot{TOKEN}/getUserProfilePhotos"
+        url = f"{TELEGRAM_API}/bot{TOKEN}/getUserProfilePhotos"
         r = requests.get(url, params={"user_id": chat_id, "limit": 1}, timeout=10)
         data = r.json()
         photos = (data or {}).get("result", {}).get("photos", [])
@@ -501,11 +1037,11 @@ def api_userpic():
         if not sizes:
             return Response(status=204)
         file_id = sizes[-1]["file_id"]
-        r2 = requests.get(f"https://api.telegram.org/bot{TOKEN}/getFile", params={"file_id": file_id}, timeout=10)
+        r2 = requests.get(f"{TELEGRAM_API}/bot{TOKEN}/getFile", params={"file_id": file_id}, timeout=10)
         fp = r2.json().get("result", {}).get("file_path")
         if not fp:
             return Response(status=204)
-        furl = f"https://api.telegram.org/file/bot{TOKEN}/{fp}"
+        furl = f"{TELEGRAM_API}/file/bot{TOKEN}/{fp}"
         fr = requests.get(furl, timeout=10, stream=True)
         headers = {"Content-Type": fr.headers.get("Content-Type", "image/jpeg"), "Cache-Control": "public, max-age=3600"}
         return Response(stream_with_context(fr.iter_content(chunk_size=4096)), headers=headers, status=200)
@@ -537,19 +1073,22 @@ def api_leaderboard():
         start, end = db.week_current_bounds()
         label = _label_ru(start, end, "За неделю")
 
-    # НИЧЕГО не меняем в формате ответа
-    items_week = db.get_leaderboard_week(start, limit=50) if hasattr(db, "get_leaderboard_week") else []
-    items_month = db.get_leaderboard_month(start, limit=50) if hasattr(db, "get_leaderboard_month") else []
-    items = items_week if period == "week" else items_month
+    def build():
+        # НИЧЕГО не меняем в формате ответа
+        items_week = db.get_leaderboard_week(start, limit=50) if hasattr(db, "get_leaderboard_week") else []
+        items_month = db.get_leaderboard_month(start, limit=50) if hasattr(db, "get_leaderboard_month") else []
+        items = items_week if period == "week" else items_month
+        return jsonify(success=True, week={"start": start, "end": end, "label": label}, items=items)
 
-    return jsonify(success=True, week={"start": start, "end": end, "label": label}, items=items)
+    return httpcache.conditional(("leaderboard", period, start, db.ledger_high_water()), build)
 
 # ---------- Market history (для графиков в MiniApp) ----------
 @app.get("/api/market/history")
 def api_market_history():
     """
     Точки истории цены ДА для конкретного рынка (event_uuid + option_index),
-    расчёт по market_orders с проигрыванием AMM (x*y=k) от стартовых резервов 1000/1000.
+    расчёт по market_orders (покупки и продажи) с проигрыванием AMM (x*y=k) от стартовых резервов рынка:
+    сделки до начала диапазона сворачиваются в резервы, точки строятся только по сделкам окна.
     """
     event_uuid = request.args.get("event_uuid", type=str)
     option_index = request.args.get("option_index", type=int)
@@ -557,21 +1096,13 @@ def api_market_history():
     if not event_uuid or option_index is None:
         return jsonify(success=False, error="bad_params"), 400
     try:
-        m = (
-            db.client.table("prediction_markets")
-            .select("id, constant_product, created_at")
-            .eq("event_uuid", event_uuid)
-            .eq("option_index", option_index)
-            .single()
-            .execute()
-        ).data
+        m = market_store.by_key(event_uuid, option_index)
         if not m:
             return jsonify(success=False, error="market_not_found"), 404
 
-        market_id = int(m["id"])
-        k = float(m.get("constant_product") or 1_000_000.0)
-        y = (k ** 0.5)
-        n = (k ** 0.5)
+        market_id = m.id
+        k = m.k or 1_000_000.0
+        y0, n0 = m.initial if m.initial[0] > 0 else (k ** 0.5, k ** 0.5)
         now = datetime.now(timezone.utc)
         dt_map = {
             "1h": now - timedelta(hours=1),
@@ -582,35 +1113,75 @@ def api_market_history():
             "all": None,
         }
         since = dt_map.get(rng, now - timedelta(days=1))
-        q = (
-            db.client.table("market_orders")
-            .select("order_type, amount, created_at")
-            .eq("market_id", market_id)
-            .order("created_at", desc=False)
+
+        # Версия данных — текущие резервы рынка; окно диапазона сдвигается поминутно
+        etag_parts = (
+            "history", m.version(), rng, int(now.timestamp()) // 60 if since else 0,
         )
-        if since:
-            q = q.gte("created_at", since.isoformat())
-        orders = q.execute().data or []
 
-        points = []
-        if since:
-            points.append({"ts": since.isoformat(), "yes_price": n/(y+n) if (y+n)>0 else 0.5})
-        else:
-            points.append({"ts": (m.get("created_at") or datetime.now(timezone.utc).isoformat()), "yes_price": n/(y+n) if (y+n)>0 else 0.5})
-
-        for o in orders:
-            side = o["order_type"]
-            amt = float(o["amount"])
-            if side in ("yes","buy_yes"):
-                n = n + amt
-                y = k / n
-            else:
+        def build():
+            def step(y, n, o):
+                amt = float(o["amount"])
+                side = o["order_type"]
+                if side in ("yes", "buy_yes"):
+                    n = n + amt
+                    return k / n, n
+                if side == "sell_yes":
+                    # продажа на выручку amt — обратный ход покупки (PredictionMarketAMM.sell_shares)
+                    n = n - amt
+                    return k / n, n
+                if side == "sell_no":
+                    y = y - amt
+                    return y, k / y
                 y = y + amt
-                n = k / y
-            price_yes = n/(y+n) if (y+n)>0 else 0.5
-            points.append({"ts": o["created_at"], "yes_price": price_yes})
+                return y, k / y
+
+            # резервы на начало окна — все сделки до since, иначе окно стартовало бы с начальной цены
+            y, n = y0, n0
+            since_iso = since.isoformat() if since else None
+            if since:
+                for page in db.iter_market_orders([market_id], before_iso=since_iso):
+                    for o in page:
+                        y, n = step(y, n, o)
+
+            points = [{"ts": since_iso or m.created_at or now.isoformat(),
+                       "yes_price": n/(y+n) if (y+n)>0 else 0.5}]
+            for page in db.iter_market_orders([market_id], since_iso=since_iso):
+                for o in page:
+                    y, n = step(y, n, o)
+                    points.append({"ts": o["created_at"], "yes_price": n/(y+n) if (y+n)>0 else 0.5})
+
+            return jsonify(success=True, points=points)
+
+        def build_lmsr():
+            # цена варианта зависит от сделок по всем вариантам события: книга на начало окна
+            # собирается одной суммой сделок до since, точки — векторно только по сделкам окна
+            by_market = {st.id: st.option_index for st in market_store.for_events([event_uuid])[event_uuid]}
+            outcomes = len(m.book.q)
+
+            def deltas(rows):
+                shares = np.array([float(o.get("shares") or 0) for o in rows])
+                sell = np.array([o["order_type"].startswith("sell_") for o in rows], dtype=bool)
+                return share_deltas(
+                    outcomes,
+                    [by_market[o["market_id"]] for o in rows],
+                    [o["order_type"].endswith("yes") for o in rows],
+                    np.where(sell, -shares, shares),
+                )
 
-        return jsonify(success=True, points=points)
+            book = LmsrBook(m.book.b, (0.0,) * outcomes)
+            since_iso = since.isoformat() if since else None
+            if since:
+                for page in db.iter_market_orders(by_market, before_iso=since_iso):
+                    book.apply_deltas(deltas(page))
+            window = [o for page in db.iter_market_orders(by_market, since_iso=since_iso) for o in page]
+            points = [{"ts": since_iso or m.created_at or now.isoformat(), "yes_price": book.price(option_index)}]
+            if window:
+                path = book.price_path(option_index, deltas(window))
+                points += [{"ts": o["created_at"], "yes_price": float(p)} for o, p in zip(window, path)]
+            return jsonify(success=True, points=points)
+
+        return httpcache.conditional(etag_parts, build_lmsr if m.book is not None else build)
     except Exception as e:
         print("[api_market_history] error:", e)
         return jsonify(success=False, error="server_error"), 500
@@ -634,7 +1205,8 @@ ADMIN_EVENTS_HTML = """
       <b>Название</b> {{ev.name}} |
       <b>Дедлайн</b> {{ev.end_date}} |
       <b>Опубл.</b> {{'да' if ev.is_published else 'нет'}} |
-      <b>Рынков</b> {{ev.markets_count}}
+      <b>Рынков</b> {{ev.markets_count}} |
+      <b>Объём</b> {{'%.2f'|format(ev.volume)}} (24ч {{'%.2f'|format(ev.volume_24h)}})
     </summary>
     <div style="margin:6px 0">{{ev.description}}</div>
     <button onclick="resolveEvent('{{ev.event_uuid}}')">Закрыть событие</button>
@@ -656,7 +1228,8 @@ ADMIN_EVENTS_HTML = """
       <b>Название</b> {{ev.name}} |
       <b>Дедлайн</b> {{ev.end_date}} |
       <b>Опубл.</b> {{'да' if ev.is_published else 'нет'}} |
-      <b>Рынков</b> {{ev.markets_count}}
+      <b>Рынков</b> {{ev.markets_count}} |
+      <b>Объём</b> {{'%.2f'|format(ev.volume)}} (24ч {{'%.2f'|format(ev.volume_24h)}})
     </summary>
     <div style="margin:6px 0">{{ev.description}}</div>
     <button onclick="resolveEvent('{{ev.event_uuid}}')">Закрыть событие</button>
@@ -690,7 +1263,9 @@ async function resolveEvent(event_uuid) {
         <b>${label}</b>:
         <label><input type="radio" name="w_${idx}" value="yes" ${cur==='yes'?'checked':''}/> ДА</label>
         <label><input type="radio" name="w_${idx}" value="no"  ${cur==='no'?'checked':''}/> НЕТ</label>
-        <small>${m.resolved ? '(уже закрыт)' : ''}</small>
+        <small>объём ${(m.volume||0).toFixed(2)} (24ч ${(m.volume_24h||0).toFixed(2)}) · сделок ${m.orders||0}
+          · трейдеров ${m.traders||0} · на руках ДА ${(m.open_yes||0).toFixed(2)} / НЕТ ${(m.open_no||0).toFixed(2)}
+          ${m.resolved ? '(уже закрыт)' : ''}</small>
       </div>`;
   });
   form.innerHTML += '<button type="submit">Резолв</button>';
@@ -731,57 +1306,48 @@ def admin_home():
 """
     )
 
+ADMIN_SEARCH_LIMIT = 200
+
 @app.get("/admin/events")
 @requires_auth
 def admin_events():
-    q = (request.args.get("q") or "").strip().lower()
+    q = (request.args.get("q") or "").strip()
+    select = "event_uuid,name,description,options,end_date,is_published,is_closed,created_at,tags"
     try:
-        evs = (
-            db.client.table("events")
-            .select("event_uuid,name,description,options,end_date,is_published,created_at,tags")
-            .order("created_at", desc=True)
-            .execute()
-            .data or []
-        )
+        if q:
+            # поиск по индексу (search.py) — все события, включая черновики и закрытые; порядок — релевантность
+            uuids = search_index.search(q, limit=ADMIN_SEARCH_LIMIT, published_only=False, open_only=False)
+            rows = db.get_events_by_uuids(uuids, select=select)
+            if rows is None:
+                raise RuntimeError("events fetch failed")
+            by_uuid = {r["event_uuid"]: r for r in rows}
+            evs = [by_uuid[u] for u in uuids if u in by_uuid]
+        else:
+            evs = (
+                db.client.table("events")
+                .select(select)
+                .order("created_at", desc=True)
+                .execute()
+                .data or []
+            )
     except Exception as e:
         print("[/admin/events] fetch error:", e)
         evs = []
 
-    now = datetime.now(timezone.utc)
-
-    def match(e):
-        if not q:
-            return True
-        return any([
-            q in str(e.get("event_uuid","")).lower(),
-            q in str(e.get("name","")).lower(),
-            q in ",".join([str(t).lower() for t in (e.get("tags") or [])])
-        ])
-
-    filt = [e for e in evs if match(e)]
-    uuids = [e["event_uuid"] for e in filt]
-    pm_map = {}
-    if uuids:
-        try:
-            pms = (
-                db.client.table("prediction_markets")
-                .select("event_uuid,id")
-                .in_("event_uuid", uuids)
-                .execute()
-                .data or []
-            )
-            from collections import Counter
-            pm_map = dict(Counter([p["event_uuid"] for p in pms]))
-        except Exception:
-            pm_map = {}
+    markets = market_store.for_events([e["event_uuid"] for e in evs])
+    now = time.time()
 
     def enrich(e):
+        ms = markets.get(e["event_uuid"], [])
         e2 = dict(e)
-        e2["markets_count"] = pm_map.get(e["event_uuid"], 0)
+        e2["markets_count"] = len(ms)
+        e2["volume"] = sum(m.stats.volume for m in ms)
+        e2["volume_24h"] = sum(m.stats.volume_24h(now) for m in ms)
         return e2
 
-    active = [enrich(e) for e in filt if e.get("end_date") and datetime.fromisoformat(str(e["end_date"]).replace(" ","T")) > now]
-    past   = [enrich(e) for e in filt if e.get("end_date") and datetime.fromisoformat(str(e["end_date"]).replace(" ","T")) <= now]
+    # is_closed ставит планировщик (scheduler.py) в момент end_date — даты на чтении не разбираем
+    active = [enrich(e) for e in evs if not e.get("is_closed")]
+    past   = [enrich(e) for e in evs if e.get("is_closed")]
 
     return render_template_string(ADMIN_EVENTS_HTML, active=active, past=past, q=q)
 
@@ -792,27 +1358,24 @@ def api_admin_event_markets():
     if not evu:
         return jsonify({"error": "no_event_uuid"}), 400
     try:
-        ev = (
-            db.client.table("events")
-            .select("options")
-            .eq("event_uuid", evu)
-            .single()
-            .execute()
-            .data or {}
-        )
-        opts = []
-        for o in (ev.get("options") or []):
-            opts.append(o.get("text") if isinstance(o, dict) else str(o))
+        states = market_store.for_events([evu])[evu]
+
+        def build():
+            ev = (
+                db.client.table("events")
+                .select("options")
+                .eq("event_uuid", evu)
+                .single()
+                .execute()
+                .data or {}
+            )
+            opts = []
+            for o in (ev.get("options") or []):
+                opts.append(o.get("text") if isinstance(o, dict) else str(o))
+            return jsonify({"options": opts, "markets": [st.as_dict() for st in states]})
 
-        pms = (
-            db.client.table("prediction_markets")
-            .select("id, option_index, total_yes_reserve, total_no_reserve, resolved, winner_side")
-            .eq("event_uuid", evu)
-            .order("option_index", desc=False)
-            .execute()
-            .data or []
-        )
-        return jsonify({"options": opts, "markets": pms})
+        version = tuple(st.version() for st in states)
+        return httpcache.conditional(("event_markets", evu, version), build)
     except Exception as e:
         print("[/api/admin/event_markets] error:", e)
         return jsonify({"options": [], "markets": []}), 200
@@ -828,7 +1391,7 @@ def admin_events_resolve():
     try:
         ev = (
             db.client.table("events")
-            .select("end_date")
+            .select("is_closed")
             .eq("event_uuid", evu)
             .single()
             .execute()
@@ -836,8 +1399,15 @@ def admin_events_resolve():
         )
         if not ev:
             return jsonify(success=False, error="event_not_found"), 404
-        end_dt = datetime.fromisoformat(str(ev["end_date"]).replace(" ","T"))
-        now = datetime.now(timezone.utc)
+        expired = bool(ev.get("is_closed"))
+
+        states = market_store.for_events([evu])[evu]
+        if states and states[0].book is not None:
+            # LMSR: ровно один вариант может выиграть «ДА», иначе выплаты превысят b * ln N
+            yes_total = sum(1 for st in states if st.resolved and st.winner == "yes")
+            yes_total += sum(1 for w in winners.values() if str(w).lower() == "yes")
+            if yes_total > 1:
+                return jsonify(success=False, error="lmsr_single_winner"), 400
 
         pms = (
             db.client.table("prediction_markets")
@@ -858,7 +1428,7 @@ def admin_events_resolve():
             if w not in ("yes","no"):
                 continue
             try:
-                if now < end_dt:
+                if not expired:
                     rr = (
                         db.client.rpc("rpc_resolve_market_force", {"p_market_id": int(m["id"]), "p_winner": w})
                         .execute().data or []
@@ -871,6 +1441,9 @@ def admin_events_resolve():
                 if rr:
                     closed += 1
                     payout_total += float(rr[0].get("total_payout") or 0)
+                    bus.publish(eventbus.MARKET_RESOLVED, {
+                        "event_uuid": evu, "option_index": idx, "market_id": int(m["id"]), "winner_side": w,
+                    })
             except Exception as e:
                 print("[resolve_one] error:", e)
                 continue
@@ -910,6 +1483,15 @@ Admin · Новое событие  <a href="/admin">← Админ</a>
     <label><input type="checkbox" name="publish" value="1"/> Опубликовать сразу</label><br/>
     <label><input type="checkbox" name="double_outcome" value="1"/> Двойной исход (ДА/НЕТ)</label>
   </div>
+  <div style="margin-top:6px">
+    <label>Ценообразование</label><br/>
+    <label><input type="radio" name="pricing" value="cpmm" checked/> Отдельный рынок x*y=k на каждый вариант</label>
+    <input type="number" name="liquidity" step="1" min="{{min_liq}}" max="{{max_liq}}" placeholder="ликвидность, {{default_liq}}" style="width:140px"/>
+    <input type="number" name="initial_prob" step="1" min="1" max="99" placeholder="старт ДА, % (50)" title="только для двойного исхода: НЕТ стартует с 100 − p" style="width:120px"/><br/>
+    <small>Ликвидность — sqrt(k): чем больше, тем меньше сдвигает цену крупная ставка (подбор — simulate.py).</small><br/>
+    <label><input type="radio" name="pricing" value="lmsr"/> LMSR: общая цена вариантов (сумма цен = 100%)</label>
+    <input type="number" name="lmsr_b" step="1" min="1" placeholder="ликвидность b, {{default_b}}" style="width:140px"/>
+  </div>
   <div style="margin-top:8px">
     <button type="submit">Создать</button>
     <a href="/admin/events" style="margin-left:8px">Отмена</a>
@@ -920,7 +1502,10 @@ Admin · Новое событие  <a href="/admin">← Админ</a>
 @app.get("/admin/events/new")
 @requires_auth
 def admin_events_new():
-    return render_template_string(ADMIN_EVENTS_NEW_HTML)
+    return render_template_string(
+        ADMIN_EVENTS_NEW_HTML, default_b=int(LMSR_DEFAULT_B),
+        default_liq=int(DEFAULT_LIQUIDITY), min_liq=int(MIN_LIQUIDITY), max_liq=int(MAX_LIQUIDITY),
+    )
 
 @app.post("/admin/events/create")
 @requires_auth
@@ -932,6 +1517,21 @@ def admin_events_create():
     tags_raw = (request.form.get("tags") or "").strip()
     publish = bool(request.form.get("publish"))
     double_outcome = bool(request.form.get("double_outcome"))
+    lmsr_b = liquidity = initial_prob = None
+    if request.form.get("pricing") == "lmsr":
+        lmsr_b = request.form.get("lmsr_b", type=float) or LMSR_DEFAULT_B
+        if lmsr_b <= 0:
+            return redirect(url_for("admin_events_new"))
+    else:
+        liquidity = request.form.get("liquidity", type=float) or DEFAULT_LIQUIDITY
+        if not (MIN_LIQUIDITY <= liquidity <= MAX_LIQUIDITY):
+            return redirect(url_for("admin_events_new"))
+        prob_pct = request.form.get("initial_prob", type=float)
+        if prob_pct is not None:
+            # одна вероятность задаёт только пару ДА/НЕТ; у N вариантов сумма стартовых цен ушла бы от 100%
+            if not double_outcome or not (1 <= prob_pct <= 99):
+                return redirect(url_for("admin_events_new"))
+            initial_prob = prob_pct / 100.0
 
     if not name or not description or not end_date:
         return redirect(url_for("admin_events_new"))
@@ -949,7 +1549,7 @@ def admin_events_create():
     except Exception:
         creator_id = None
 
-    ok, err = db.create_event_with_markets(
+    event_uuid, err = db.create_event_with_markets(
         name=name,
         description=description,
         options=options,
@@ -958,10 +1558,14 @@ def admin_events_create():
         publish=publish,
         creator_id=creator_id,
         double_outcome=double_outcome,
+        lmsr_b=lmsr_b,
+        liquidity=liquidity,
+        initial_prob=initial_prob,
     )
-    if not ok:
+    if not event_uuid:
         print("[/admin/events/create] error:", err)
         return redirect(url_for("admin_events_new"))
+    bus.publish(eventbus.EVENT_CREATED, {"event_uuid": event_uuid, "is_published": publish, "end_date": end_date})
 
     return redirect(url_for("admin_events"))
 
@@ -970,6 +1574,7 @@ ADMIN_USERS_HTML = """
 Admin · Пользователи  <a href="/admin">← Админ</a>
 
 <h1>Пользователи</h1>
+{% if msg %}<div style="margin:8px 0;color:#b00">{{msg}}</div>{% endif %}
 
 <form method="get" action="/admin/users" style="margin:8px 0">
   <input type="hidden" name="status" value="{{status}}"/>
@@ -990,8 +1595,22 @@ Admin · Пользователи  <a href="/admin">← Админ</a>
   {% endfor %}
 </div>
 
+<form id="bulk" method="post" action="/admin/users/bulk/action" style="margin:8px 0">
+  Отмеченные:
+  {% if status=='pending' %}
+    <button name="action" value="approve">Одобрить</button>
+    <button name="action" value="reject">Отклонить</button>
+  {% elif status=='approved' %}
+    <button name="action" value="ban">Забанить</button>
+  {% elif status=='banned' %}
+    <button name="action" value="unban">Разбанить</button>
+  {% endif %}
+  &nbsp; <a href="/admin/users/bulk">Массовые действия по списку / CSV</a>
+</form>
+
 <table border="1" cellspacing="0" cellpadding="6">
   <tr>
+    <th><input type="checkbox" onclick="document.querySelectorAll('input[name=chat_id][form=bulk]').forEach(c => c.checked = this.checked)"/></th>
     <th>chat_id</th>
     <th>логин</th>
     <th>username</th>
@@ -1001,6 +1620,7 @@ Admin · Пользователи  <a href="/admin">← Админ</a>
   </tr>
   {% for u in users %}
     <tr>
+      <td><input type="checkbox" name="chat_id" value="{{u.chat_id}}" form="bulk"/></td>
       <td>{{u.chat_id}}</td>
       <td>{{u.login}}</td>
       <td>{{u.username or '—'}}</td>
@@ -1024,7 +1644,9 @@ Admin · Пользователи  <a href="/admin">← Админ</a>
           <div style="margin:6px 0">
             <form method="post" action="/admin/users/balance">
               <input type="hidden" name="chat_id" value="{{u.chat_id}}"/>
+              <input type="hidden" name="expected" value="{{u.balance if u.balance is not none else 0}}"/>
               <input type="number" name="balance" step="0.01" placeholder="Новый баланс" />
+              или <input type="number" name="delta" step="0.01" placeholder="± к балансу" />
               <button type="submit">Сохранить</button>
             </form>
           </div>
@@ -1042,7 +1664,7 @@ Admin · Пользователи  <a href="/admin">← Админ</a>
     </tr>
   {% endfor %}
   {% if not users %}
-    <tr><td colspan="6">Нет пользователей</td></tr>
+    <tr><td colspan="7">Нет пользователей</td></tr>
   {% endif %}
 </table>
 """
@@ -1064,7 +1686,8 @@ def admin_users():
         except Exception:
             ledger_map[u["chat_id"]] = []
 
-    return render_template_string(ADMIN_USERS_HTML, status=status, q=q, sort=sort, users=users, ledger_map=ledger_map)
+    return render_template_string(ADMIN_USERS_HTML, status=status, q=q, sort=sort, users=users, ledger_map=ledger_map,
+                                  msg=BALANCE_ERRORS.get(request.args.get("err") or ""))
 
 @app.post("/admin/users/action")
 @requires_auth
@@ -1086,18 +1709,134 @@ def admin_users_action():
         print("[/admin/users/action] error:", e)
     return redirect(url_for("admin_users", status=request.args.get("status","pending")))
 
+BALANCE_ERRORS = {
+    "balance_changed": "Баланс изменился, пока открыта страница (сделка?) — проверьте и повторите.",
+    "negative_balance": "Баланс не может стать отрицательным.",
+    "not_found": "Пользователь не найден.",
+    "rpc_failed": "Ошибка базы — баланс не изменён.",
+}
+
 @app.post("/admin/users/balance")
 @requires_auth
 def admin_users_balance():
+    """Новый баланс — compare-and-set от баланса, показанного в форме; «±» — дельта, без сверки."""
     chat_id = request.form.get("chat_id", type=int)
     new_balance = request.form.get("balance", type=float)
-    if not chat_id or new_balance is None:
-        return redirect(url_for("admin_users", status=request.args.get("status","approved")))
+    delta = request.form.get("delta", type=float)
+    status = request.args.get("status", "approved")
+    if not chat_id or (new_balance is None and not delta):
+        return redirect(url_for("admin_users", status=status))
     try:
-        db.admin_set_balance_via_ledger(chat_id, new_balance)
+        if new_balance is not None:
+            res = db.admin_set_balance_via_ledger(chat_id, new_balance, expected=request.form.get("expected", type=float))
+        else:
+            res = db.adjust_balance(chat_id, delta, mode="delta", reason="admin_adjust")
     except Exception as e:
         print("[/admin/users/balance] error:", e)
-    return redirect(url_for("admin_users", status=request.args.get("status","approved")))
+        res = {"ok": False, "error": "rpc_failed"}
+    if not res.get("ok"):
+        return redirect(url_for("admin_users", status=status, err=res.get("error")))
+    return redirect(url_for("admin_users", status=status))
+
+# ---------- Admin: массовые действия (список chat_id / CSV) ----------
+ADMIN_USERS_BULK_HTML = """
+Admin · Массовые действия  <a href="/admin/users">← Пользователи</a>
+
+<h1>Массовые действия</h1>
+
+<h3>Статус</h3>
+<form method="post" action="/admin/users/bulk/action" enctype="multipart/form-data">
+  <textarea name="chat_ids" rows="6" cols="40" placeholder="chat_id через пробел, запятую или по строкам"></textarea><br/>
+  или CSV (chat_id в первой колонке): <input type="file" name="csv" accept=".csv,.txt"/><br/>
+  <select name="action">
+    <option value="approve">Одобрить</option>
+    <option value="reject">Отклонить</option>
+    <option value="ban">Забанить</option>
+    <option value="unban">Разбанить</option>
+  </select>
+  <button type="submit">Применить</button>
+</form>
+
+<h3>Баланс (через ledger)</h3>
+<form method="post" action="/admin/users/bulk/balance" enctype="multipart/form-data">
+  <textarea name="rows" rows="6" cols="40" placeholder="chat_id,сумма — по строке на пользователя"></textarea><br/>
+  или CSV (chat_id,сумма): <input type="file" name="csv" accept=".csv,.txt"/><br/>
+  <label><input type="radio" name="mode" value="delta" checked/> прибавить сумму</label>
+  <label><input type="radio" name="mode" value="set"/> установить баланс</label><br/>
+  <input type="text" name="reason" placeholder="причина (в ledger)" maxlength="64"/>
+  <button type="submit">Применить</button>
+</form>
+"""
+
+ADMIN_USERS_BULK_RESULT_HTML = """
+Admin · Массовые действия  <a href="/admin/users/bulk">← Назад</a>  <a href="/admin/users">Пользователи</a>
+
+<h1>{{title}}</h1>
+<p>Успешно: {{ok_count}} · ошибок: {{rows|length - ok_count}}</p>
+
+<table border="1" cellspacing="0" cellpadding="6">
+  <tr><th>chat_id</th><th>результат</th>{% for c in columns %}<th>{{c}}</th>{% endfor %}</tr>
+  {% for r in rows %}
+    <tr>
+      <td>{{r.chat_id if r.chat_id is not none else r.input}}</td>
+      <td>{% if r.ok %}ok{% else %}<b>{{r.error}}</b>{% endif %}</td>
+      {% for c in columns %}<td>{{'—' if r.get(c) is none else r.get(c)}}</td>{% endfor %}
+    </tr>
+  {% endfor %}
+  {% if not rows %}<tr><td colspan="{{columns|length + 2}}">Пустой список</td></tr>{% endif %}
+</table>
+"""
+
+BULK_UPLOAD_MAX_BYTES = 1024 * 1024
+
+def _bulk_upload_text() -> str:
+    f = request.files.get("csv")
+    if not f:
+        return ""
+    return f.read(BULK_UPLOAD_MAX_BYTES).decode("utf-8-sig", errors="replace")
+
+def _bulk_report(title: str, results, errors, columns):
+    # ошибки разбора — в начале отчёта, чтобы не потерялись среди сотен ok
+    rows = [dict(e, chat_id=None, ok=False) for e in errors] + [dict(r) for r in results]
+    ok_count = sum(1 for r in rows if r.get("ok"))
+    if request.args.get("format") == "json":
+        return jsonify(success=True, ok=ok_count, failed=len(rows) - ok_count, results=rows)
+    return render_template_string(ADMIN_USERS_BULK_RESULT_HTML, title=title, rows=rows, ok_count=ok_count, columns=columns)
+
+@app.get("/admin/users/bulk")
+@requires_auth
+def admin_users_bulk():
+    return render_template_string(ADMIN_USERS_BULK_HTML)
+
+@app.post("/admin/users/bulk/action")
+@requires_auth
+def admin_users_bulk_action():
+    action = (request.form.get("action") or "").lower()
+    if action not in ("approve", "reject", "ban", "unban"):
+        return redirect(url_for("admin_users_bulk"))
+    ids, errors = bulkinput.parse_chat_ids(
+        request.form.get("chat_ids"),
+        request.form.getlist("chat_id"),  # чекбоксы со страницы /admin/users
+        bulkinput.first_column(_bulk_upload_text()),
+    )
+    results = db.bulk_set_status(ids, action)
+    return _bulk_report(f"Статус: {action}", results, errors, ["old_status", "new_status"])
+
+@app.post("/admin/users/bulk/balance")
+@requires_auth
+def admin_users_bulk_balance():
+    mode = request.form.get("mode") or "delta"
+    if mode not in ("delta", "set"):
+        return redirect(url_for("admin_users_bulk"))
+    reason = (request.form.get("reason") or "").strip()[:64] or "admin_bulk_adjust"
+    text = "\n".join(t for t in (request.form.get("rows"), _bulk_upload_text()) if t)
+    items, errors = bulkinput.parse_amount_rows(text)
+    results = db.bulk_adjust_balance(items, mode=mode, reason=reason)
+    return _bulk_report(f"Баланс: {'прибавить' if mode == 'delta' else 'установить'}", results, errors,
+                        ["old_balance", "new_balance", "delta"])
 
 if __name__ == "__main__":
+    # под gunicorn это делает gunicorn.conf.py (when_ready) — один раз на деплой, а не на воркер
+    ensure_webhook()
+    expiry.start()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", "10000")))
@@ -0,0 +1,93 @@
+import os
+import threading
+
+TRADE_BATCH_WINDOW_MS = float(os.getenv("TRADE_BATCH_WINDOW_MS", "0"))  # 0 — батчинг выключен
+TRADE_BATCH_MAX = int(os.getenv("TRADE_BATCH_MAX", "50"))
+WAIT_TIMEOUT = 30
+
+
+class _Order:
+    __slots__ = ("payload", "done", "result", "error")
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Batch:
+    __slots__ = ("orders", "full")
+
+    def __init__(self):
+        self.orders = []
+        self.full = threading.Event()
+
+
+class TradeBatcher:
+    """
+    Микро-батчинг покупок по market_id. Первый запрос к рынку становится «лидером»:
+    ждёт окно (несколько мс) или заполнения пакета, затем одним вызовом execute_batch
+    исполняет все накопленные ордера по порядку и раздаёт результаты ожидающим.
+    Отдельного потока нет — работу делает поток лидера.
+    """
+
+    def __init__(self, execute_single, execute_batch,
+                 window_ms: float = TRADE_BATCH_WINDOW_MS, max_batch: int = TRADE_BATCH_MAX):
+        self.execute_single = execute_single
+        self.execute_batch = execute_batch
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def submit(self, market_id: int, payload: dict):
+        """Блокирует до исполнения ордера; возвращает строку результата или None, ошибки пробрасывает."""
+        order = _Order(payload)
+        with self._lock:
+            batch = self._open.get(market_id)
+            leader = batch is None
+            if leader:
+                batch = self._open[market_id] = _Batch()
+            batch.orders.append(order)
+            if len(batch.orders) >= self.max_batch:
+                self._open.pop(market_id, None)
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(market_id) is batch:
+                    del self._open[market_id]
+            self._run(market_id, batch.orders)
+        elif not order.done.wait(WAIT_TIMEOUT):
+            raise TimeoutError("batch execution timed out")
+
+        if order.error is not None:
+            raise order.error
+        return order.result
+
+    def _run(self, market_id: int, orders):
+        try:
+            if len(orders) == 1:
+                results = [self.execute_single(market_id, orders[0].payload)]
+            else:
+                results = list(self.execute_batch(market_id, [o.payload for o in orders]))
+            if len(results) != len(orders):
+                # без сопоставления ордер ↔ строка ответа нельзя никому отдать чужой результат
+                raise RuntimeError(f"batch_result_mismatch: {len(results)} results for {len(orders)} orders")
+            for o, res in zip(orders, results):
+                if isinstance(res, Exception):
+                    o.error = res
+                else:
+                    o.result = res
+        except Exception as e:
+            for o in orders:
+                o.error = e
+        finally:
+            for o in orders:
+                o.done.set()
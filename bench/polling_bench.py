@@ -0,0 +1,167 @@
+"""
+Офлайн-бенчмарк приёма апдейтов: long polling против webhook на заглушке Telegram API.
+
+    python bench/polling_bench.py --updates 5000 --chats 200 --handler-ms 5
+
+Обработчик имитирует бота: задержка «БД» (--handler-ms) и sendMessage в заглушку
+(с задержкой --tg-ms). В режиме webhook заглушка доставляет каждый апдейт
+отдельным HTTP POST (--connections параллельно, как max_connections у Telegram).
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from polling import LongPollingRunner  # noqa: E402
+from updates import ChatOrderedExecutor, UpdateDeduper, update_chat_id  # noqa: E402
+
+
+def make_updates(n: int, chats: int):
+    return [
+        {"update_id": i + 1, "message": {"chat": {"id": 1000 + i % chats}, "text": "/start", "from": {"username": "u"}}}
+        for i in range(n)
+    ]
+
+
+class _FastHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # без этого keep-alive ответы упираются в Nagle + delayed ACK (~40 мс)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubTelegram:
+    def __init__(self, updates, tg_ms: float):
+        self.updates = updates
+        self.tg_ms = tg_ms
+        self.sent = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(_FastHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                method = self.path.rsplit("/", 1)[-1]
+                if method == "getUpdates":
+                    offset = int(body.get("offset") or 0)
+                    limit = int(body.get("limit") or 100)
+                    start = max(0, offset - 1)
+                    result = stub.updates[start:start + limit]
+                elif method == "sendMessage":
+                    time.sleep(stub.tg_ms / 1000.0)
+                    with stub._lock:
+                        stub.sent += 1
+                    result = {"message_id": 1}
+                else:
+                    result = True
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def make_handler(stub: StubTelegram, handler_ms: float):
+    local = threading.local()
+
+    def handle(update):
+        time.sleep(handler_ms / 1000.0)  # «get_user» в БД
+        s = getattr(local, "s", None) or requests.Session()
+        local.s = s
+        chat_id = update["message"]["chat"]["id"]
+        s.post(f"{stub.base}/botTOKEN/sendMessage", json={"chat_id": chat_id, "text": "ok"}, timeout=10)
+
+    return handle
+
+
+def bench_polling(args, updates):
+    stub = StubTelegram(updates, args.tg_ms)
+    runner = LongPollingRunner("TOKEN", make_handler(stub, args.handler_ms), api_base=stub.base,
+                               workers=args.workers, batch=args.batch, poll_timeout=0)
+    t = time.perf_counter()
+    while runner.processed < len(updates):
+        runner.run_once()
+    dt = time.perf_counter() - t
+    stub.server.shutdown()
+    return dt
+
+
+def bench_webhook(args, updates):
+    stub = StubTelegram([], args.tg_ms)
+    handle = make_handler(stub, args.handler_ms)
+    executor = ChatOrderedExecutor(workers=args.workers, name="bench-webhook")
+    dedup = UpdateDeduper()
+
+    class Receiver(_FastHandler):
+        def do_POST(self):
+            update = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+            status = 200
+            if not dedup.is_duplicate(update.get("update_id")):
+                if not executor.submit(update_chat_id(update), handle, update):
+                    dedup.forget(update.get("update_id"))
+                    status = 503
+            self.send_response(status)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Receiver)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{srv.server_address[1]}/webhook"
+    local = threading.local()
+
+    def deliver(u):
+        s = getattr(local, "s", None) or requests.Session()
+        local.s = s
+        s.post(url, json=u, timeout=10)
+
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.connections) as pool:
+        list(pool.map(deliver, updates))
+    executor.drain(timeout=600)
+    dt = time.perf_counter() - t
+    srv.shutdown()
+    stub.server.shutdown()
+    return dt
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--updates", type=int, default=2000)
+    p.add_argument("--chats", type=int, default=200)
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--batch", type=int, default=100)
+    p.add_argument("--connections", type=int, default=40)
+    p.add_argument("--handler-ms", type=float, default=5.0)
+    p.add_argument("--tg-ms", type=float, default=2.0)
+    args = p.parse_args()
+
+    updates = make_updates(args.updates, args.chats)
+    for name, fn in (("polling", bench_polling), ("webhook", bench_webhook)):
+        dt = fn(args, updates)
+        print(f"{name:8s} {len(updates)} updates in {dt:.2f}s -> {len(updates) / dt:,.0f} upd/s")
+
+
+if __name__ == "__main__":
+    main()
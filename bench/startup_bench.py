@@ -0,0 +1,79 @@
+"""
+Замер холодного старта: импорт app и первый запрос в свежем процессе.
+
+    python bench/startup_bench.py --runs 5
+
+Печатает медианы и самые тяжёлые модули по `python -X importtime`.
+Сеть не нужна: Supabase/Telegram берутся из окружения или подставляются заглушки.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+c = app.app.test_client()
+c.get("/health")
+t2 = time.perf_counter()
+print(f"{t1 - t0:.4f} {t2 - t1:.4f}")
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+    env.setdefault("SUPABASE_KEY", "bench")
+    env.setdefault("BOT_TOKEN", "bench")
+    env.setdefault("TELEGRAM_API_BASE", "http://127.0.0.1:9")
+    return env
+
+
+def measure(runs: int):
+    imports, firsts = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=_env(),
+                             capture_output=True, text=True, check=True).stdout.split()
+        imports.append(float(out[-2]))
+        firsts.append(float(out[-1]))
+    return imports, firsts
+
+
+def top_imports(n: int):
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=_env(),
+                         capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cum_us), depth, name.strip()))
+    app_total = next((c for c, d, name in rows if name == "app" and d == 0), 0)
+    direct = [(c, name) for c, d, name in rows if d == 1]
+    return app_total, sorted(direct, reverse=True)[:n]
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--top", type=int, default=8)
+    args = p.parse_args()
+
+    imports, firsts = measure(args.runs)
+    print(f"import app:     median {statistics.median(imports) * 1000:7.1f} ms  (max {max(imports) * 1000:.1f})")
+    print(f"first request:  median {statistics.median(firsts) * 1000:7.1f} ms  (max {max(firsts) * 1000:.1f})")
+    total, top = top_imports(args.top)
+    print(f"\n-X importtime: app cumulative {total / 1000:.1f} ms; heaviest direct imports:")
+    for cum, name in top:
+        print(f"  {cum / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Разбор списков для массовых действий админки: chat_id из textarea
+(через пробел, запятую, точку с запятой или по строкам) и CSV «chat_id,сумма».
+Ошибочные строки не роняют весь список — они попадают в отчёт как отдельные результаты.
+"""
+import math
+import re
+
+BULK_MAX_ROWS = 5000
+
+_SPLIT_RE = re.compile(r"[\s,;]+")
+
+
+def _chat_id(raw):
+    raw = (raw or "").strip()
+    if not re.fullmatch(r"-?\d{1,19}", raw):
+        return None
+    return int(raw)
+
+
+def parse_chat_ids(*sources):
+    """
+    Склеивает chat_id из нескольких источников (textarea, отмеченные чекбоксы, CSV).
+    Возвращает (ids без повторов в порядке появления, ошибки [{"input", "error"}]).
+    """
+    ids, seen, errors = [], set(), []
+    for src in sources:
+        if not src:
+            continue
+        tokens = _SPLIT_RE.split(src) if isinstance(src, str) else src
+        for tok in tokens:
+            tok = str(tok).strip()
+            if not tok or tok.lower() == "chat_id":
+                continue
+            cid = _chat_id(tok)
+            if cid is None:
+                errors.append({"input": tok, "error": "bad_chat_id"})
+            elif cid not in seen:
+                seen.add(cid)
+                ids.append(cid)
+    if len(ids) > BULK_MAX_ROWS:
+        errors.append({"input": f"{len(ids)} chat_id", "error": f"too_many_rows (max {BULK_MAX_ROWS})"})
+        ids = ids[:BULK_MAX_ROWS]
+    return ids, errors
+
+
+def _split_row(line: str):
+    # «;» и табуляция (экспорт из Excel) допускают десятичную запятую: 123;10,5
+    line = line.strip().replace('"', "")
+    sep = r"[;\t]" if (";" in line or "\t" in line) else r"[,\s]+"
+    return [c.strip() for c in re.split(sep, line) if c.strip()]
+
+
+def first_column(text: str):
+    """Первая колонка CSV-файла (выгрузка пользователей и т.п.) — список chat_id для parse_chat_ids."""
+    out = []
+    for line in (text or "").splitlines():
+        rec = _split_row(line)
+        if rec:
+            out.append(rec[0])
+    return out
+
+
+def parse_amount_rows(text: str):
+    """
+    Строки «chat_id,сумма» (или через ; / табуляцию / пробел), заголовок необязателен.
+    Возвращает ([(chat_id, value)], ошибки). Повтор chat_id — ошибка: непонятно, складывать или заменять.
+    """
+    rows, seen, errors = [], set(), []
+    for raw_line in (text or "").splitlines():
+        rec = _split_row(raw_line)
+        if not rec:
+            continue
+        line = ",".join(rec)
+        if rec[0].lower() == "chat_id":
+            continue
+        if len(rec) < 2:
+            errors.append({"input": line, "error": "no_amount"})
+            continue
+        cid = _chat_id(rec[0])
+        try:
+            value = float(rec[1].replace(",", "."))
+        except ValueError:
+            value = None
+        if cid is None:
+            errors.append({"input": line, "error": "bad_chat_id"})
+        elif value is None or not math.isfinite(value):
+            errors.append({"input": line, "error": "bad_amount"})
+        elif cid in seen:
+            errors.append({"input": line, "error": "duplicate"})
+        else:
+            seen.add(cid)
+            rows.append((cid, value))
+    if len(rows) > BULK_MAX_ROWS:
+        errors.append({"input": f"{len(rows)} строк", "error": f"too_many_rows (max {BULK_MAX_ROWS})"})
+        rows = rows[:BULK_MAX_ROWS]
+    return rows, errors
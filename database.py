@@ -1,24 +1,76 @@
 import os
+import threading
 import uuid
 from datetime import datetime, timedelta, timezone
 
-from supabase import create_client
+import eventbus
+from amm import DEFAULT_LIQUIDITY, initial_reserves
+from eventbus import bus
+from scheduler import parse_ts
+from usercache import UserCache, is_miss
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
 
 class Database:
     def __init__(self):
-        assert SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY, "Supabase env not set"
-        self.client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        # Клиент Supabase (и сам пакет supabase, ~0.6 с импорта) создаётся при первом обращении,
+        # поэтому `from database import db` ничего не делает по сети и почти бесплатен.
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.users = UserCache()
+        bus.subscribe(eventbus.USER_CHANGED, lambda d: self.users.invalidate(int(d["chat_id"])))
+        bus.subscribe(eventbus.BALANCE_CHANGED, lambda d: self.users.invalidate(int(d["chat_id"])))
+        bus.subscribe(eventbus.TRADE_EXECUTED, self._on_trade)
+        # выплаты при резолве меняют балансы неизвестного заранее круга пользователей
+        bus.subscribe(eventbus.MARKET_RESOLVED, lambda d: self.users.clear())
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    assert SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY, "Supabase env not set"
+                    from supabase import create_client
+                    self._client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        return self._client
+
+    @staticmethod
+    def preload():
+        """Импорт библиотек без открытия соединений — можно звать в мастер-процессе до fork."""
+        import supabase  # noqa: F401
+
+    def warm_up(self):
+        """Создаёт клиент и прогревает HTTP-соединение (вызывается в воркере после fork)."""
+        try:
+            self.client.table("users").select("chat_id").limit(1).execute()
+        except Exception as e:
+            print("[db.warm_up] error:", e)
+
+    def _on_trade(self, d):
+        if d.get("new_balance") is not None:
+            self.users.update_fields(int(d["chat_id"]), balance=float(d["new_balance"]))
+        else:
+            self.users.invalidate(int(d["chat_id"]))
+
+    def _user_changed(self, chat_id: int):
+        bus.publish(eventbus.USER_CHANGED, {"chat_id": chat_id})
 
     # --- users ---
-    def get_user(self, chat_id: int):
+    def get_user(self, chat_id: int, fresh: bool = False):
+        """Запись пользователя; по умолчанию из кэша (fresh=True — всегда из БД)."""
+        if not fresh and self.users.enabled:
+            bus.start()  # без слушателя шины кэш не узнает об изменениях в других воркерах
+            cached = self.users.get(chat_id)
+            if not is_miss(cached):
+                return cached
         try:
-            r = self.client.table("users").select("*").eq("chat_id", chat_id).single().execute()
-            return r.data
+            r = self.client.table("users").select("*").eq("chat_id", chat_id).limit(1).execute()
         except Exception:
             return None
+        user = r.data[0] if r.data else None
+        self.users.put(chat_id, user)
+        return user
 
     def create_user(self, chat_id: int, login: str, username: str = None):
         try:
@@ -30,6 +82,7 @@ class Database:
                 "balance": 1000.0,
             }
             r = self.client.table("users").insert(data).execute()
+            self._user_changed(chat_id)  # сбрасываем негативную запись кэша
             return bool(r.data)
         except Exception as e:
             print("[db.create_user] error:", e)
@@ -37,30 +90,106 @@ class Database:
 
     def approve_user(self, chat_id: int):
         self.client.table("users").update({"status":"approved","approved_at":datetime.now(timezone.utc).isoformat()}).eq("chat_id", chat_id).execute()
+        self._user_changed(chat_id)
 
     def reject_user(self, chat_id: int):
         self.client.table("users").update({"status":"rejected"}).eq("chat_id", chat_id).execute()
+        self._user_changed(chat_id)
 
     def ban_user(self, chat_id: int):
         self.client.table("users").update({"status":"banned"}).eq("chat_id", chat_id).execute()
+        self._user_changed(chat_id)
 
     def unban_user(self, chat_id: int):
         self.client.table("users").update({"status":"approved"}).eq("chat_id", chat_id).execute()
+        self._user_changed(chat_id)
 
-    def admin_set_balance_via_ledger(self, chat_id: int, new_balance: float):
-        u = self.get_user(chat_id)
-        if not u:
-            return
-        cur = float(u.get("balance") or 0)
-        delta = float(new_balance) - cur
-        if abs(delta) > 0:
-            # положим запись в ledger
-            self.client.table("ledger").insert({
-                "chat_id": chat_id,
-                "delta": delta,
-                "reason": "admin_set_balance",
+    def adjust_balance(self, chat_id: int, value: float, mode: str = "delta", expected: float | None = None,
+                       reason: str = "admin_adjust"):
+        """
+        Атомарное изменение баланса с записью в ledger (rpc_adjust_balance, sql/011): mode 'delta'
+        прибавляет value, 'set' устанавливает. expected — compare-and-set: не совпал текущий баланс —
+        ошибка balance_changed и баланс не тронут. Результат — {ok, error, old_balance, new_balance, delta}.
+        """
+        if mode not in ("delta", "set"):
+            raise ValueError("mode must be 'delta' or 'set'")
+        try:
+            r = self.client.rpc("rpc_adjust_balance", {
+                "p_chat_id": int(chat_id),
+                "p_mode": mode,
+                "p_value": float(value),
+                "p_expected": None if expected is None else float(expected),
+                "p_reason": reason,
+            }).execute()
+            row = (r.data or [None])[0]
+        except Exception as e:
+            # в том числе PGRST202 (sql/011 не применена): обходного пути без общей транзакции нет
+            print("[db.adjust_balance] error:", e)
+            return {"ok": False, "error": "rpc_failed"}
+        if row is None:
+            return {"ok": False, "error": "rpc_failed"}
+        if row.get("ok") and float(row.get("delta") or 0) != 0:
+            bus.publish(eventbus.BALANCE_CHANGED, {
+                "chat_id": int(chat_id),
+                "balance": float(row["new_balance"]),
+                "delta": float(row["delta"]),
+            })
+        return row
+
+    def admin_set_balance_via_ledger(self, chat_id: int, new_balance: float, expected: float | None = None):
+        """Установка баланса админом; expected — баланс, который админ видел в форме."""
+        return self.adjust_balance(chat_id, new_balance, mode="set", expected=expected, reason="admin_set_balance")
+
+    def bulk_set_status(self, chat_ids, action: str):
+        """Массовая смена статуса одной транзакцией (rpc_admin_bulk_set_status); результат — на каждый chat_id."""
+        if not chat_ids:
+            return []
+        try:
+            r = self.client.rpc("rpc_admin_bulk_set_status", {
+                "p_chat_ids": [int(c) for c in chat_ids],
+                "p_action": action,
+            }).execute()
+            rows = r.data or []
+        except Exception as e:
+            print("[db.bulk_set_status] error:", e)
+            return [{"chat_id": c, "ok": False, "error": "rpc_failed"} for c in chat_ids]
+        for row in rows:
+            if row.get("ok"):
+                self._user_changed(int(row["chat_id"]))
+        return rows
+
+    def bulk_adjust_balance(self, items, mode: str = "delta", reason: str = "admin_bulk_adjust"):
+        """
+        Массовое изменение балансов через ledger одной транзакцией (rpc_admin_bulk_adjust_balance).
+        items — [(chat_id, value)] или [(chat_id, value, expected)]; mode 'delta' прибавляет value,
+        'set' устанавливает баланс; expected — compare-and-set для строки (sql/011).
+        """
+        if not items:
+            return []
+        payload = []
+        for c, v, *rest in items:
+            item = {"chat_id": int(c), "value": float(v)}
+            if rest and rest[0] is not None:
+                item["expected"] = float(rest[0])
+            payload.append(item)
+        try:
+            r = self.client.rpc("rpc_admin_bulk_adjust_balance", {
+                "p_items": payload,
+                "p_mode": mode,
+                "p_reason": reason,
             }).execute()
-            self.client.table("users").update({"balance": float(new_balance)}).eq("chat_id", chat_id).execute()
+            rows = r.data or []
+        except Exception as e:
+            print("[db.bulk_adjust_balance] error:", e)
+            return [{"chat_id": c, "ok": False, "error": "rpc_failed"} for c, *_ in items]
+        for row in rows:
+            if row.get("ok") and float(row.get("delta") or 0) != 0:
+                bus.publish(eventbus.BALANCE_CHANGED, {
+                    "chat_id": int(row["chat_id"]),
+                    "balance": float(row["new_balance"]),
+                    "delta": float(row["delta"]),
+                })
+        return rows
 
     def search_users(self, status="pending", q="", sort=""):
         q = (q or "").strip()
@@ -97,20 +226,146 @@ class Database:
         except Exception:
             return []
 
+    def ledger_high_water(self, chat_id: int | None = None):
+        """Максимальный id в ledger (по пользователю или глобально) — версия для ETag."""
+        try:
+            q = self.client.table("ledger").select("id")
+            if chat_id is not None:
+                q = q.eq("chat_id", chat_id)
+            r = q.order("id", desc=True).limit(1).execute()
+            return int(r.data[0]["id"]) if r.data else 0
+        except Exception as e:
+            print("[db.ledger_high_water] error:", e)
+            return None
+
+    # --- сверка ledger / balance (reconcile.py); ошибки не глотаем — задача должна упасть, а не сдвинуть hwm ---
+    def ledger_page(self, after_id: int, limit: int = 1000, before_iso: str | None = None):
+        """Строки ledger с id > after_id по возрастанию id (keyset), только старше before_iso."""
+        q = self.client.table("ledger").select("id,chat_id,delta").gt("id", after_id)
+        if before_iso:
+            q = q.lt("created_at", before_iso)
+        return q.order("id").limit(limit).execute().data or []
+
+    def ledger_rows_for_users(self, chat_ids, after_id: int):
+        """Строки ledger новее after_id по заданным пользователям (досверка «в полёте»)."""
+        if not chat_ids:
+            return []
+        return (
+            self.client.table("ledger")
+            .select("id,chat_id,delta")
+            .in_("chat_id", list(chat_ids))
+            .gt("id", after_id)
+            .execute()
+            .data
+            or []
+        )
+
+    def user_balances(self, chat_ids):
+        if not chat_ids:
+            return {}
+        rows = self.client.table("users").select("chat_id,balance").in_("chat_id", list(chat_ids)).execute().data or []
+        return {int(r["chat_id"]): r.get("balance") for r in rows}
+
+    def users_balance_page(self, after_chat_id: int | None, limit: int = 1000):
+        q = self.client.table("users").select("chat_id,balance")
+        if after_chat_id is not None:
+            q = q.gt("chat_id", after_chat_id)
+        return q.order("chat_id").limit(limit).execute().data or []
+
+    def orders_page(self, after_id: int, limit: int = 1000, before_iso: str | None = None):
+        """Строки market_orders с id > after_id по возрастанию id (keyset), только старше before_iso."""
+        q = (
+            self.client.table("market_orders")
+            .select("id,market_id,user_chat_id,order_type,amount,price,shares,created_at")
+            .gt("id", after_id)
+        )
+        if before_iso:
+            q = q.lt("created_at", before_iso)
+        return q.order("id").limit(limit).execute().data or []
+
+    def iter_market_orders(self, market_ids, since_iso: str | None = None, before_iso: str | None = None,
+                           page_size: int = 1000):
+        """Сделки рынков market_ids страницами по возрастанию id (keyset), created_at в [since, before)."""
+        after = 0
+        while True:
+            q = (
+                self.client.table("market_orders")
+                .select("id,market_id,order_type,amount,shares,created_at")
+                .in_("market_id", list(market_ids))
+                .gt("id", after)
+            )
+            if since_iso:
+                q = q.gte("created_at", since_iso)
+            if before_iso:
+                q = q.lt("created_at", before_iso)
+            page = q.order("id").limit(page_size).execute().data or []
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after = int(page[-1]["id"])
+
+    def markets_page(self, after_id: int, limit: int = 1000):
+        """prediction_markets с id > after_id: параметры для проигрывания сделок (k, книга LMSR события)."""
+        return (
+            self.client.table("prediction_markets")
+            .select("id,event_uuid,option_index,constant_product,initial_yes_reserve,initial_no_reserve,events(lmsr_b,lmsr_q)")
+            .gt("id", after_id)
+            .order("id")
+            .limit(limit)
+            .execute()
+            .data
+            or []
+        )
+
     # --- events & markets ---
-    def get_published_events(self):
+    def get_published_events(self, event_uuids=None):
+        """Опубликованные открытые события (все или из event_uuids); None — ошибка БД."""
         try:
-            r = (
+            q = (
                 self.client.table("events")
                 .select("event_uuid,name,description,options,end_date,is_published,created_at,tags")
                 .eq("is_published", True)
-                .order("end_date", desc=False)
-                .execute()
+                .eq("is_closed", False)
             )
-            return r.data or []
+            if event_uuids is not None:
+                q = q.in_("event_uuid", list(event_uuids))
+            return q.order("end_date", desc=False).execute().data or []
         except Exception as e:
             print("[db.get_published_events] error:", e)
+            return None
+
+    SEARCH_SELECT = "event_uuid,name,description,options,tags,is_published,is_closed,created_at"
+
+    def iter_event_pages(self, page_size: int = 1000):
+        """Все события страницами (keyset по event_uuid) — для сборки поискового индекса; ошибка — исключение."""
+        after = None
+        while True:
+            q = self.client.table("events").select(self.SEARCH_SELECT)
+            if after is not None:
+                q = q.gt("event_uuid", after)
+            page = q.order("event_uuid").limit(page_size).execute().data or []
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after = page[-1]["event_uuid"]
+
+    def get_events_by_uuids(self, event_uuids, select: str | None = None):
+        """Строки events по uuid (любой статус); None — ошибка БД."""
+        if not event_uuids:
             return []
+        try:
+            return (
+                self.client.table("events")
+                .select(select or self.SEARCH_SELECT)
+                .in_("event_uuid", list(event_uuids))
+                .execute()
+                .data or []
+            )
+        except Exception as e:
+            print("[db.get_events_by_uuids] error:", e)
+            return None
 
     def get_markets_for_event(self, event_uuid: str):
         try:
@@ -126,26 +381,83 @@ class Database:
             print("[db.get_markets_for_event] error:", e)
             return []
 
-    def get_market_id(self, event_uuid: str, option_index: int):
+    # events(lmsr_b,lmsr_q) — книга LMSR события (null у рынков x*y=k), приходит тем же запросом;
+    # market_stats и часовые корзины объёма за сутки (sql/009) — тоже
+    MARKET_SELECT = (
+        "id,event_uuid,option_index,total_yes_reserve,total_no_reserve,constant_product,"
+        "initial_yes_reserve,initial_no_reserve,resolved,winner_side,is_closed,created_at,events(lmsr_b,lmsr_q),"
+        "market_stats(volume,orders,traders,open_yes,open_no),market_volume_hourly(bucket,volume)"
+    )
+
+    @staticmethod
+    def _last_day(q):
+        """Фильтр встроенных market_volume_hourly: только корзины последних 24 часов (сами рынки не отсекаются)."""
+        since = (datetime.now(timezone.utc) - timedelta(hours=24)).replace(minute=0, second=0, microsecond=0)
+        return q.gte("market_volume_hourly.bucket", since.isoformat())
+
+    def get_markets_for_events(self, event_uuids):
+        """Рынки сразу для нескольких событий одним запросом: {event_uuid: [market, ...]}; None — ошибка."""
+        if not event_uuids:
+            return {}
         try:
-            r = (
-                self.client.table("prediction_markets")
-                .select("id")
-                .eq("event_uuid", event_uuid)
-                .eq("option_index", option_index)
-                .single()
-                .execute()
-            )
-            return int(r.data["id"]) if r.data else None
-        except Exception:
+            q = self.client.table("prediction_markets").select(self.MARKET_SELECT).in_("event_uuid", list(event_uuids))
+            r = self._last_day(q).order("option_index", desc=False).execute()
+            out = {}
+            for m in (r.data or []):
+                out.setdefault(m["event_uuid"], []).append(m)
+            return out
+        except Exception as e:
+            print("[db.get_markets_for_events] error:", e)
+            return None
+
+    def get_markets_by_ids(self, market_ids):
+        """Строки prediction_markets по id; None — ошибка."""
+        if not market_ids:
+            return []
+        try:
+            q = self.client.table("prediction_markets").select(self.MARKET_SELECT).in_("id", list(market_ids))
+            r = self._last_day(q).execute()
+            return r.data or []
+        except Exception as e:
+            print("[db.get_markets_by_ids] error:", e)
             return None
 
+    # --- автозакрытие по end_date (scheduler.py, sql/006) ---
+    def get_open_event_deadlines(self):
+        """[(event_uuid, end_ts)] всех ещё не закрытых событий — для кучи таймеров."""
+        r = (
+            self.client.table("events")
+            .select("event_uuid,end_date")
+            .eq("is_closed", False)
+            .order("end_date", desc=False)
+            .execute()
+        )
+        return [(e["event_uuid"], parse_ts(e.get("end_date"))) for e in (r.data or [])]
+
+    def close_expired_events(self):
+        """Закрывает истёкшие события и их рынки; возвращает закрытые этим вызовом."""
+        return self.client.rpc("rpc_close_expired_events", {}).execute().data or []
+
     def create_event_with_markets(self, name: str, description: str, options, end_date: str,
-                                  tags, publish: bool, creator_id: int | None, double_outcome: bool):
+                                  tags, publish: bool, creator_id: int | None, double_outcome: bool,
+                                  lmsr_b: float | None = None, liquidity: float | None = None,
+                                  initial_prob: float | None = None):
+        """
+        lmsr_b — ликвидность LMSR: варианты события оцениваются совместно (lmsr.py), иначе x*y=k на вариант.
+        liquidity — sqrt(k) рынков x*y=k. initial_prob — стартовая вероятность исхода «ДА» события
+        с двойным исходом: рынок варианта «ДА» открывается по p, «НЕТ» — по 1−p (по умолчанию 0.5).
+        Для событий с N вариантами одна вероятность на все рынки дала бы сумму цен N·p — не принимается.
+        """
         try:
             event_uuid = str(uuid.uuid4())
             if double_outcome:
                 options = [{"text": "ДА"}, {"text": "НЕТ"}]
+            if initial_prob is None:
+                probs = [0.5] * len(options or [])
+            elif double_outcome:
+                probs = [initial_prob, 1.0 - initial_prob]
+            else:
+                raise ValueError("initial_prob is only supported for double_outcome events")
 
             # Вставка события
             ev_payload = {
@@ -158,86 +470,169 @@ class Database:
                 "tags": tags or [],
                 "creator_id": creator_id,
             }
+            if lmsr_b:
+                ev_payload["lmsr_b"] = float(lmsr_b)
+                ev_payload["lmsr_q"] = [0.0] * len(options or [])
             self.client.table("events").insert(ev_payload).execute()
 
-            # Создание рынков под каждый вариант
+            # Создание рынков под каждый вариант: стартовые резервы хранятся — от них проигрывается история
             markets = []
-            for idx, _ in enumerate(options or []):
+            for idx, prob in enumerate(probs):
+                yes0, no0 = initial_reserves(liquidity or DEFAULT_LIQUIDITY, prob)
                 markets.append({
                     "event_uuid": event_uuid,
                     "option_index": idx,
-                    # резервы по умолчанию как в схеме
-                    "total_yes_reserve": 1000.0,
-                    "total_no_reserve": 1000.0,
-                    "constant_product": 1_000_000.0,
+                    "total_yes_reserve": yes0,
+                    "total_no_reserve": no0,
+                    "constant_product": yes0 * no0,
+                    "initial_yes_reserve": yes0,
+                    "initial_no_reserve": no0,
                 })
             if markets:
                 self.client.table("prediction_markets").insert(markets).execute()
 
-            return True, None
+            return event_uuid, None
         except Exception as e:
             print("[db.create_event_with_markets] error:", e)
-            return False, str(e)
+            return None, str(e)
 
     # --- positions / archive for /api/me ---
-    def get_user_positions(self, chat_id: int):
+    # user_shares → prediction_markets → events одним запросом (embedding PostgREST по FK)
+    POSITION_SELECT = (
+        "market_id,share_type,quantity,average_price,created_at,"
+        "prediction_markets(event_uuid,option_index,resolved,winner_side,"
+        "events(name,options))"
+    )
+
+    def get_user_position_rows(self, chat_id: int, limit: int | None = None, offset: int = 0):
         try:
-            shares = (
+            q = (
                 self.client.table("user_shares")
-                .select("market_id,share_type,quantity,average_price,created_at")
+                .select(self.POSITION_SELECT)
                 .eq("user_chat_id", chat_id)
                 .gt("quantity", 0)
                 .order("created_at", desc=True)
-                .execute()
-            ).data or []
-
-            if not shares:
-                return []
-
-            market_ids = sorted({int(s["market_id"]) for s in shares})
-            markets = {}
-            if market_ids:
-                r = (
-                    self.client.table("prediction_markets")
-                    .select("id,event_uuid,option_index,resolved,winner_side")
-                    .in_("id", market_ids)
-                    .execute()
-                )
-                for m in (r.data or []):
-                    markets[int(m["id"])] = m
-
-            positions = []
-            for s in shares:
-                mid = int(s["market_id"])
-                m = markets.get(mid, {})
-                positions.append({
-                    "event_uuid": m.get("event_uuid"),
-                    "option_index": m.get("option_index"),
-                    "share_type": s.get("share_type"),
-                    "quantity": float(s.get("quantity", 0)),
-                    "avg_price": float(s.get("average_price", 0)),
-                    "resolved": bool(m.get("resolved")),
-                    "winner_side": m.get("winner_side"),
-                })
-            return positions
+            )
+            if limit:
+                q = q.range(offset, offset + limit - 1)
+            return q.execute().data or []
         except Exception as e:
-            print("[db.get_user_positions] error:", e)
+            print("[db.get_user_position_rows] error:", e)
             return []
 
-    def get_user_archive(self, chat_id: int, limit: int = 50):
+    def get_user_archive_page(self, chat_id: int, limit: int = 50, cursor=None, since=None,
+                              market_id: int | None = None, event_uuid: str | None = None):
+        """
+        Keyset-пагинация market_orders по (created_at, id).
+        cursor — страница старше курсора (новые сверху); since — только строки новее курсора
+        (по возрастанию, для догрузки). Оба — кортежи (created_at, id).
+        """
+        embed = "prediction_markets!inner(event_uuid,option_index)" if event_uuid else "prediction_markets(event_uuid,option_index)"
         try:
-            r = (
+            q = (
                 self.client.table("market_orders")
-                .select("market_id,order_type,amount,price,shares,created_at")
+                .select(f"id,market_id,order_type,amount,price,shares,created_at,{embed}")
                 .eq("user_chat_id", chat_id)
-                .order("created_at", desc=True)
-                .limit(limit)
-                .execute()
             )
-            return r.data or []
-        except Exception:
+            if market_id is not None:
+                q = q.eq("market_id", market_id)
+            if event_uuid:
+                q = q.eq("prediction_markets.event_uuid", event_uuid)
+            if since:
+                ts, oid = since
+                q = q.or_(f'created_at.gt."{ts}",and(created_at.eq."{ts}",id.gt.{oid})')
+                q = q.order("created_at", desc=False).order("id", desc=False)
+            else:
+                if cursor:
+                    ts, oid = cursor
+                    q = q.or_(f'created_at.lt."{ts}",and(created_at.eq."{ts}",id.lt.{oid})')
+                q = q.order("created_at", desc=True).order("id", desc=True)
+            return q.limit(limit).execute().data or []
+        except Exception as e:
+            print("[db.get_user_archive_page] error:", e)
             return []
 
+    # --- trades ---
+    def trade_buy(self, chat_id: int, market_id: int, side: str, amount: float):
+        rr = (
+            self.client.rpc(
+                "rpc_trade_buy",
+                {"p_chat_id": chat_id, "p_market_id": market_id, "p_side": side, "p_amount": amount},
+            )
+            .execute()
+            .data or []
+        )
+        return rr[0] if rr else None
+
+    def trade_buy_lmsr(self, chat_id: int, market_id: int, side: str, amount: float):
+        rr = (
+            self.client.rpc(
+                "rpc_trade_buy_lmsr",
+                {"p_chat_id": chat_id, "p_market_id": market_id, "p_side": side, "p_amount": amount},
+            )
+            .execute()
+            .data or []
+        )
+        return rr[0] if rr else None
+
+    def trade_sell(self, chat_id: int, market_id: int, side: str, shares: float):
+        rr = (
+            self.client.rpc(
+                "rpc_trade_sell",
+                {"p_chat_id": chat_id, "p_market_id": market_id, "p_side": side, "p_shares": shares},
+            )
+            .execute()
+            .data or []
+        )
+        return rr[0] if rr else None
+
+    def trade_buy_batch(self, market_id: int, orders):
+        """
+        orders: [{"chat_id", "side", "amount"[, "idem_key", "request_hash"]}, ...] — исполняются
+        по порядку одной транзакцией. Возвращает список той же длины: строка результата или
+        RuntimeError(<код ошибки>), если ордер отклонён (как исключение одиночного RPC), None —
+        если по ордеру нет ответа. Повтор ордера с уже исполненным ключом — строка с "replayed": True.
+        """
+        payload = [{"ord": i, **o} for i, o in enumerate(orders)]
+        rows = (
+            self.client.rpc("rpc_trade_buy_batch", {"p_market_id": market_id, "p_orders": payload})
+            .execute()
+            .data or []
+        )
+        out = [None] * len(orders)
+        for row in rows:
+            i = int(row["ord"])
+            if row.get("ok") and 0 <= i < len(out):
+                out[i] = {**row, "replayed": row.get("error") == "replayed"}
+            elif row.get("error") and 0 <= i < len(out):
+                # батчер пробросит отказ как исключение — вызывающий ответит так же, как без батчинга
+                print(f"[db.trade_buy_batch] market {market_id} order {i} rejected: {row['error']}")
+                out[i] = RuntimeError(row["error"])
+        return out
+
+    # --- idempotency keys for trades (таблица trade_requests, PK (chat_id, idem_key)) ---
+    def trade_idempotent(self, kind: str, chat_id: int, market_id: int, side: str, value: float,
+                         key: str, request_hash: str):
+        """
+        Сделка с ключом (sql/012): ключ, хэш запроса и результат пишутся в транзакции сделки.
+        kind — 'buy' | 'buy_lmsr' | 'sell'. Возвращает строку результата RPC (с "replayed": True,
+        если она взята из прошлого вызова) или None. Ошибки не глотает — вызывающий отвечает 5xx.
+        """
+        rr = (
+            self.client.rpc(
+                "rpc_trade_idempotent",
+                {
+                    "p_chat_id": chat_id, "p_key": key, "p_hash": request_hash, "p_kind": kind,
+                    "p_market_id": market_id, "p_side": side, "p_value": value,
+                },
+            )
+            .execute()
+            .data or []
+        )
+        if not rr or not rr[0].get("result"):
+            return None
+        return {**rr[0]["result"], "replayed": bool(rr[0].get("replayed"))}
+
     # --- leaderboard helpers ---
     @staticmethod
     def week_current_bounds():
@@ -259,13 +654,15 @@ class Database:
 
     def leaderboard(self, start_iso: str, end_iso: str, limit: int = 50):
         try:
-            # суммируем только положительные начисления (payout_*), группируем в коде
+            # суммируем только положительные начисления (payout_*), группируем в коде;
+            # выручка от продажи и погашение пар ДА+НЕТ — возврат вложенного, а не выигрыш
             r = (
                 self.client.table("ledger")
                 .select("chat_id,delta,reason,created_at")
                 .gte("created_at", start_iso)
                 .lt("created_at", end_iso)
                 .gt("delta", 0)
+                .not_.in_("reason", ["trade_sell", "trade_redeem"])
                 .execute()
             )
             payouts = {}
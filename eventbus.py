@@ -0,0 +1,154 @@
+import atexit
+import glob
+import json
+import os
+import socket
+import tempfile
+import threading
+from collections import defaultdict
+
+# Типы сообщений
+TRADE_EXECUTED = "trade_executed"
+MARKET_RESOLVED = "market_resolved"
+EVENT_CREATED = "event_created"
+EVENT_CLOSED = "event_closed"
+BALANCE_CHANGED = "balance_changed"
+USER_CHANGED = "user_changed"
+
+BUS_DIR = os.getenv("EVENT_BUS_DIR") or os.path.join(tempfile.gettempdir(), "predbot-bus")
+MAX_DATAGRAM = 64 * 1024
+
+
+class UnixSocketTransport:
+    """
+    Межпроцессная доставка через unix datagram-сокеты в общей директории:
+    каждый воркер слушает <dir>/<pid>.sock, публикация рассылает датаграмму всем соседям.
+    Сокеты умерших воркеров удаляются при первой неудачной отправке.
+    (Postgres LISTEN/NOTIFY потребовал бы прямого соединения с БД — у нас только PostgREST.)
+    """
+
+    def __init__(self, directory: str = BUS_DIR):
+        self.directory = directory
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f"{self.pid}.sock")
+        self._recv = None
+        self._send = None
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._recv = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._recv.bind(self.path)
+        self._send = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._send.setblocking(False)
+
+    def peers(self):
+        return [p for p in glob.glob(os.path.join(self.directory, "*.sock")) if p != self.path]
+
+    def send(self, payload: bytes):
+        for peer in self.peers():
+            try:
+                self._send.sendto(payload, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                # очередь соседа переполнена — он отстаёт; кэши у него доживут до TTL
+                print(f"[eventbus] peer {peer} is full, message dropped")
+            except OSError as e:
+                print(f"[eventbus] send to {peer} error: {e}")
+
+    def recv(self) -> bytes:
+        return self._recv.recv(MAX_DATAGRAM)
+
+    def close(self):
+        for s in (self._recv, self._send):
+            if s is not None:
+                s.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class EventBus:
+    """
+    Лёгкая шина событий. Локальные подписчики вызываются синхронно в потоке
+    публикации; сообщения соседних воркеров приходят в фоновом потоке-слушателе.
+    Транспорт поднимается лениво и пересоздаётся после fork.
+    """
+
+    def __init__(self, transport_factory=UnixSocketTransport):
+        self._transport_factory = transport_factory
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._transport = None
+        self._pid = None
+
+    def on(self, msg_type: str):
+        def deco(fn):
+            self._handlers[msg_type].append(fn)
+            return fn
+        return deco
+
+    def subscribe(self, msg_type: str, handler):
+        self._handlers[msg_type].append(handler)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return self._transport
+        with self._lock:
+            if self._pid == os.getpid():
+                return self._transport
+            transport = None
+            if self._transport_factory is not None:
+                try:
+                    transport = self._transport_factory()
+                    transport.open()
+                    atexit.register(transport.close)
+                    threading.Thread(target=self._listen, args=(transport,), name="eventbus", daemon=True).start()
+                except Exception as e:
+                    print(f"[eventbus] transport disabled, local only: {e}")
+                    transport = None
+            self._transport = transport
+            self._pid = os.getpid()
+            return transport
+
+    def start(self):
+        self._ensure_started()
+
+    def publish(self, msg_type: str, data: dict):
+        transport = self._ensure_started()
+        self._dispatch(msg_type, data)
+        if transport is not None:
+            payload = json.dumps({"t": msg_type, "d": data, "o": self._pid}, separators=(",", ":"), default=str)
+            transport.send(payload.encode("utf-8"))
+
+    def _dispatch(self, msg_type: str, data: dict):
+        for fn in list(self._handlers.get(msg_type, ())):
+            try:
+                fn(data)
+            except Exception as e:
+                print(f"[eventbus] handler {getattr(fn, '__name__', fn)} for {msg_type} error: {e}")
+
+    def _listen(self, transport):
+        while True:
+            try:
+                raw = transport.recv()
+            except OSError:
+                return
+            try:
+                msg = json.loads(raw.decode("utf-8"))
+            except Exception:
+                continue
+            if msg.get("o") == self._pid:
+                continue
+            self._dispatch(msg.get("t"), msg.get("d") or {})
+
+
+bus = EventBus()
@@ -0,0 +1,285 @@
+"""
+Экспорт истории сделок и цен в колоночный формат — для офлайн-анализа и бэктестов без живой БД.
+
+    python export_history.py                    # дописать сделки новее прошлого экспорта
+    python export_history.py --out history      # каталог экспорта (по умолчанию EXPORT_DIR)
+    python export_history.py --full             # переэкспорт с нуля
+
+Раскладка: <out>/<YYYY-MM-DD>.npz — сделки дня (UTC по created_at) по возрастанию id, внутри —
+по массиву NumPy на колонку (COLUMNS); np.load читает колонки по отдельности. Резервы и цена ДА —
+состояние рынка после сделки, полученное проигрыванием сделок так же, как в /api/market/history
+(x*y=k от стартовых резервов рынка; LMSR — книга события от q = 0, резервов у таких рынков нет — NaN).
+Параметры рынков (k, b, событие, вариант) — в <out>/markets.json.
+
+Инкрементально: в <out>/_state.json — hwm по market_orders.id и состояние проигрывания каждого
+рынка, поэтому запуск читает только новые сделки и переписывает только дни, в которые они попали
+(обычно — сегодняшний). Дни пишутся атомарно (tmp + os.replace), состояние — после дней; строки
+дня новее сохранённого hwm (от упавшего запуска) при дописывании отбрасываются. Строки моложе
+--lag секунд не берутся — по той же причине, что в reconcile.py.
+
+Чтение: load_history("history", since="2024-05-01") -> {колонка: np.ndarray}.
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from lmsr import LmsrBook
+from scheduler import parse_ts
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "history")
+PAGE_SIZE = 1000
+FLUSH_ROWS = 200_000  # сколько строк копится в памяти до записи дней
+COMMIT_LAG = 60
+
+COLUMNS = {
+    "order_id": np.int64,
+    "market_id": np.int64,
+    "user_chat_id": np.int64,
+    "ts": np.float64,         # unix time сделки
+    "side": np.int8,          # 1 — ДА, 0 — НЕТ
+    "sell": np.bool_,
+    "amount": np.float64,     # уплачено при покупке, получено при продаже
+    "shares": np.float64,
+    "price": np.float64,      # средняя цена сделки
+    "yes_reserve": np.float64,
+    "no_reserve": np.float64,
+    "yes_price": np.float64,  # цена ДА варианта после сделки
+}
+
+
+def _day(ts: float) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+def _num(x) -> float:
+    return float(x) if x is not None else math.nan
+
+
+class Replay:
+    """Проигрывание сделок: резервы x*y=k по рынкам и книги LMSR по событиям."""
+
+    def __init__(self, markets=None, cpmm=None, books=None):
+        self.markets = markets or {}  # market_id -> {"event_uuid", "option_index", "k", "y0", "n0", "lmsr_b", "outcomes"}
+        self.cpmm = cpmm or {}        # market_id -> [yes_reserve, no_reserve]
+        self.books = books or {}      # event_uuid -> LmsrBook
+
+    def add_markets(self, rows):
+        for m in rows:
+            ev = m.get("events") or {}
+            q = ev.get("lmsr_q") or []
+            k = float(m.get("constant_product") or 1_000_000.0)
+            self.markets[int(m["id"])] = {
+                "event_uuid": m["event_uuid"],
+                "option_index": int(m["option_index"]),
+                "k": k,
+                # рынки до sql/010 начинались с sqrt(k)/sqrt(k)
+                "y0": float(m.get("initial_yes_reserve") or math.sqrt(k)),
+                "n0": float(m.get("initial_no_reserve") or math.sqrt(k)),
+                "lmsr_b": float(ev["lmsr_b"]) if ev.get("lmsr_b") else None,
+                "outcomes": len(q),
+            }
+
+    def _book(self, m: dict) -> LmsrBook:
+        book = self.books.get(m["event_uuid"])
+        if book is None:
+            outcomes = max(m["outcomes"], 1 + max(
+                x["option_index"] for x in self.markets.values() if x["event_uuid"] == m["event_uuid"]))
+            book = self.books[m["event_uuid"]] = LmsrBook(m["lmsr_b"], (0.0,) * outcomes)
+        return book
+
+    def apply(self, market_id: int, side: str, sell: bool, amount: float, shares: float):
+        """Сделка -> (yes_reserve, no_reserve, yes_price) после неё."""
+        m = self.markets[market_id]
+        if m["lmsr_b"] is not None:
+            book = self._book(m)
+            book.apply_shares(m["option_index"], side, -shares if sell else shares)
+            return math.nan, math.nan, book.price(m["option_index"])
+        k = m["k"]
+        y, n = self.cpmm.get(market_id) or (m.get("y0") or math.sqrt(k), m.get("n0") or math.sqrt(k))
+        # те же ходы, что в api_market_history: покупка ДА добавляет в n, продажа — обратный ход
+        if side == "yes":
+            n = n - amount if sell else n + amount
+            y = k / n
+        else:
+            y = y - amount if sell else y + amount
+            n = k / y
+        self.cpmm[market_id] = [y, n]
+        return y, n, n / (y + n) if (y + n) > 0 else 0.5
+
+
+class ExportState:
+    def __init__(self, hwm: int = 0, replay: Replay | None = None):
+        self.hwm = hwm
+        self.replay = replay or Replay()
+
+    @classmethod
+    def load(cls, path: str):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        markets = {int(k): v for k, v in (data.get("markets") or {}).items()}
+        cpmm = {int(k): list(v) for k, v in (data.get("cpmm") or {}).items()}
+        books = {ev: LmsrBook(b, q) for ev, (b, q) in (data.get("books") or {}).items()}
+        return cls(int(data.get("hwm") or 0), Replay(markets, cpmm, books))
+
+    def save(self, path: str):
+        r = self.replay
+        data = {
+            "hwm": self.hwm,
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+            "markets": {str(k): v for k, v in r.markets.items()},
+            "cpmm": {str(k): v for k, v in r.cpmm.items()},
+            "books": {ev: [b.b, list(b.q)] for ev, b in r.books.items()},
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+
+class Exporter:
+    def __init__(self, source, out_dir: str, state: ExportState, page_size: int = PAGE_SIZE,
+                 lag: float = COMMIT_LAG, flush_rows: int = FLUSH_ROWS):
+        self.source = source
+        self.out_dir = out_dir
+        self.state = state
+        self.page_size = page_size
+        self.lag = lag
+        self.flush_rows = flush_rows
+        self.rows = 0
+        self.days = set()
+        self._buf = {}  # день -> {колонка: [значения]}
+        self._buffered = 0
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.out_dir, "_state.json")
+
+    def day_path(self, day: str) -> str:
+        return os.path.join(self.out_dir, day + ".npz")
+
+    def load_markets(self):
+        """Дочитывает новые рынки (keyset по id) — параметры нужны до их первой сделки."""
+        after = max(self.state.replay.markets, default=0)
+        while True:
+            page = self.source.markets_page(after, self.page_size)
+            self.state.replay.add_markets(page)
+            if len(page) < self.page_size:
+                return
+            after = int(page[-1]["id"])
+
+    def _append(self, o: dict):
+        ts = parse_ts(o.get("created_at")) or 0.0
+        ot = o["order_type"]
+        side = "yes" if ot.endswith("yes") else "no"
+        sell = ot.startswith("sell_")
+        amount, shares = float(o.get("amount") or 0), _num(o.get("shares"))
+        market_id = int(o["market_id"])
+        yes_reserve, no_reserve, yes_price = self.state.replay.apply(market_id, side, sell, amount, shares)
+        cols = self._buf.get(_day(ts))
+        if cols is None:
+            cols = self._buf[_day(ts)] = {c: [] for c in COLUMNS}
+        for c, v in (
+            ("order_id", int(o["id"])), ("market_id", market_id), ("user_chat_id", int(o.get("user_chat_id") or 0)),
+            ("ts", ts), ("side", 1 if side == "yes" else 0), ("sell", sell), ("amount", amount),
+            ("shares", shares), ("price", _num(o.get("price"))),
+            ("yes_reserve", yes_reserve), ("no_reserve", no_reserve), ("yes_price", yes_price),
+        ):
+            cols[c].append(v)
+        self._buffered += 1
+
+    def _write_day(self, day: str, cols: dict):
+        new = {c: np.asarray(v, dtype=COLUMNS[c]) for c, v in cols.items()}
+        path = self.day_path(day)
+        if os.path.exists(path):
+            with np.load(path) as old:
+                keep = old["order_id"] <= self.state.hwm  # хвост упавшего запуска — перезаписывается
+                new = {c: np.concatenate([old[c][keep], new[c]]) for c in COLUMNS}
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **new)
+        os.replace(tmp, path)
+
+    def flush(self, hwm: int):
+        """Пишет накопленные дни, затем состояние: после падения экспорт продолжится с hwm."""
+        for day, cols in self._buf.items():
+            self._write_day(day, cols)
+            self.days.add(day)
+        self._buf, self._buffered = {}, 0
+        self.state.hwm = hwm
+        self.state.save(self.state_path)
+        with open(os.path.join(self.out_dir, "markets.json"), "w", encoding="utf-8") as f:
+            json.dump({str(k): v for k, v in self.state.replay.markets.items()}, f, ensure_ascii=False)
+
+    def run(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.load_markets()
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=self.lag)).isoformat() if self.lag else None
+        hwm = self.state.hwm
+        while True:
+            page = self.source.orders_page(hwm, self.page_size, before_iso=cutoff)
+            for o in page:
+                if int(o["market_id"]) not in self.state.replay.markets:
+                    self.load_markets()
+                if int(o["market_id"]) not in self.state.replay.markets:
+                    print("[export] unknown market, order skipped:", o["id"])
+                    continue
+                self._append(o)
+            self.rows += len(page)
+            if page:
+                hwm = int(page[-1]["id"])
+            if self._buffered >= self.flush_rows:
+                self.flush(hwm)
+            if len(page) < self.page_size:
+                break
+        self.flush(hwm)
+        return self.rows
+
+
+def load_history(out_dir: str = EXPORT_DIR, since: str | None = None, until: str | None = None, columns=None):
+    """Колонки экспорта за дни [since, until] ('YYYY-MM-DD', включительно) одним словарём массивов."""
+    names = list(columns or COLUMNS)
+    parts = {c: [] for c in names}
+    for path in sorted(glob.glob(os.path.join(out_dir, "????-??-??.npz"))):
+        day = os.path.basename(path)[:10]
+        if (since and day < since) or (until and day > until):
+            continue
+        with np.load(path) as f:
+            for c in names:
+                parts[c].append(f[c])
+    return {c: np.concatenate(v) if v else np.empty(0, dtype=COLUMNS[c]) for c, v in parts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт истории сделок и цен в .npz по дням")
+    parser.add_argument("--out", default=EXPORT_DIR)
+    parser.add_argument("--full", action="store_true", help="переэкспорт с нуля")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--lag", type=float, default=COMMIT_LAG, help="не брать сделки моложе, с")
+    args = parser.parse_args()
+
+    from database import db
+
+    state_path = os.path.join(args.out, "_state.json")
+    if args.full:
+        for path in glob.glob(os.path.join(args.out, "????-??-??.npz")):
+            os.remove(path)
+        state = ExportState()
+    else:
+        state = ExportState.load(state_path)
+    exp = Exporter(db, args.out, state, page_size=args.page_size, lag=args.lag)
+    started = time.monotonic()
+    rows = exp.run()
+    print(f"[export] {'full' if args.full else 'incremental'}: {rows} orders, hwm={exp.state.hwm}, "
+          f"days={len(exp.days)}, markets={len(exp.state.replay.markets)}, {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
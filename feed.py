@@ -0,0 +1,257 @@
+"""
+Лента событий: ранжирующие индексы в памяти процесса вместо выборки и сортировки всего каталога
+на каждое открытие Mini App.
+
+Порядки: trending — затухающий недавний объём, ending — скоро закончатся, new — новые.
+Каждый индекс есть для всей ленты и отдельно для каждого тега; страница — срез индекса от курсора.
+
+«Тренд» — сумма объёмов сделок с весом exp(-λ·возраст). Ключ хранится в лог-шкале, приведённой
+к общему моменту: ln(heat) + λ·t. Затухание одинаково для всех событий, поэтому порядок со временем
+не меняется и индекс не надо пересортировывать — сделка двигает только своё событие.
+"""
+import base64
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+from scheduler import parse_ts
+
+FEED_TTL = float(os.getenv("FEED_TTL", "300"))
+FEED_HALF_LIFE = float(os.getenv("FEED_HALF_LIFE", str(6 * 3600)))
+FEED_PAGE_MAX = 50
+ORDERS = ("trending", "ending", "new")
+NO_HEAT = -1e300  # событие без сделок: в тренде — после всех, между собой — по новизне
+
+
+def _log_add(a: float, b: float) -> float:
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+class SortedIndex:
+    """Отсортированный список (ключ, event_uuid); вставка и удаление — bisect."""
+
+    __slots__ = ("_items",)
+
+    def __init__(self, items=()):
+        self._items = sorted(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, key, uuid: str):
+        bisect.insort(self._items, (key, uuid))
+
+    def remove(self, key, uuid: str):
+        i = bisect.bisect_left(self._items, (key, uuid))
+        if i < len(self._items) and self._items[i] == (key, uuid):
+            del self._items[i]
+
+    def after(self, cursor, limit: int):
+        """До limit элементов строго после курсора (ключ, uuid); None — с начала."""
+        i = 0 if cursor is None else bisect.bisect_right(self._items, cursor)
+        return self._items[i:i + limit]
+
+
+class FeedEntry:
+    __slots__ = ("uuid", "row", "tags", "heat", "end_ts", "created_ts")
+
+    def __init__(self, row: dict, heat: float):
+        self.uuid = row["event_uuid"]
+        self.row = row
+        self.tags = {str(t).strip().lower() for t in (row.get("tags") or []) if str(t).strip()}
+        self.heat = heat
+        self.end_ts = parse_ts(row.get("end_date")) or math.inf
+        self.created_ts = parse_ts(row.get("created_at")) or 0.0
+
+    def key(self, order: str):
+        if order == "trending":
+            return (-self.heat, -self.created_ts)
+        if order == "ending":
+            return (self.end_ts, 0.0)
+        return (-self.created_ts, 0.0)
+
+
+def encode_feed_cursor(order: str, key, uuid: str) -> str:
+    raw = json.dumps([order, list(key), uuid], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_feed_cursor(cursor: str, order: str):
+    """(ключ, uuid) для bisect или None, если курсор битый или от другого порядка."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        c_order, key, uuid = json.loads(raw)
+        key = tuple(float(x) for x in key)
+    except Exception:
+        return None
+    if c_order != order or len(key) != 2 or not isinstance(uuid, str):
+        return None
+    return key, uuid
+
+
+class EventFeed:
+    """
+    load_events() -> [строка events] опубликованных открытых событий или None при ошибке БД;
+    load_by_uuids(uuids) -> то же для отдельных событий (созданных после загрузки);
+    volume_buckets(uuids) -> {event_uuid: [(unix time, объём)]} — затравка тренда при загрузке.
+    Между перечитываниями (раз в ttl) индексы обновляются по шине: сделки, новые и закрытые события.
+    """
+
+    def __init__(self, load_events, load_by_uuids, volume_buckets,
+                 ttl: float = FEED_TTL, half_life: float = FEED_HALF_LIFE):
+        self.load_events = load_events
+        self.load_by_uuids = load_by_uuids
+        self.volume_buckets = volume_buckets
+        self.ttl = ttl
+        self.rate = math.log(2) / half_life
+        self._entries = {}
+        self._indexes = {}   # (order, tag | None) -> SortedIndex
+        self._pending = set()
+        self._loaded = None  # monotonic() последней полной загрузки
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    # --- индексы ---
+    def _index_keys(self, e: FeedEntry):
+        for tag in (None, *e.tags):
+            for order in ORDERS:
+                yield (order, tag), e.key(order)
+
+    def _insert(self, e: FeedEntry):
+        self._entries[e.uuid] = e
+        for ik, key in self._index_keys(e):
+            idx = self._indexes.get(ik)
+            if idx is None:
+                idx = self._indexes[ik] = SortedIndex()
+            idx.add(key, e.uuid)
+
+    def _drop(self, uuid: str):
+        e = self._entries.pop(uuid, None)
+        if e is None:
+            return
+        for ik, key in self._index_keys(e):
+            idx = self._indexes.get(ik)
+            if idx is not None:
+                idx.remove(key, uuid)
+                if not idx and ik[1] is not None:
+                    del self._indexes[ik]
+
+    def _seed_heat(self, buckets) -> float:
+        heat = NO_HEAT
+        for ts, volume in buckets or ():
+            if volume > 0:
+                heat = _log_add(heat, math.log(volume) + self.rate * ts)
+        return heat
+
+    # --- загрузка ---
+    def reload(self):
+        rows = self.load_events()
+        if rows is None:
+            return
+        known = {u: e.heat for u, e in self._entries.items()}
+        fresh = [r["event_uuid"] for r in rows if r["event_uuid"] not in known]
+        buckets = self.volume_buckets(fresh) if fresh else {}
+        entries = {}
+        for r in rows:
+            u = r["event_uuid"]
+            entries[u] = FeedEntry(r, known[u] if u in known else self._seed_heat(buckets.get(u)))
+        indexes = {}
+        for e in entries.values():
+            for ik, key in self._index_keys(e):
+                indexes.setdefault(ik, []).append((key, e.uuid))
+        with self._lock:
+            self._entries = entries
+            self._indexes = {ik: SortedIndex(items) for ik, items in indexes.items()}
+            self._pending.clear()
+            self._loaded = time.monotonic()
+
+    def _due(self) -> bool:
+        return self._loaded is None or time.monotonic() - self._loaded >= self.ttl
+
+    def _ensure(self):
+        if self._due():
+            # перечитывает один поток; остальные отдают текущие индексы (ждут только самую первую загрузку)
+            if self._reload_lock.acquire(blocking=self._loaded is None):
+                try:
+                    if self._due():
+                        self.reload()
+                finally:
+                    self._reload_lock.release()
+            return
+        if self._pending:
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            rows = self.load_by_uuids(list(pending))
+            if rows is None:
+                with self._lock:
+                    self._pending |= pending
+                return
+            buckets = self.volume_buckets([r["event_uuid"] for r in rows])
+            with self._lock:
+                for r in rows:
+                    self._drop(r["event_uuid"])
+                    self._insert(FeedEntry(r, self._seed_heat(buckets.get(r["event_uuid"]))))
+
+    # --- чтение ---
+    def page(self, order: str = "trending", tag: str | None = None, limit: int = 20, cursor=None):
+        """(строки событий, курсор следующей страницы или None). cursor — из decode_feed_cursor."""
+        self._ensure()
+        tag = tag.strip().lower() if tag else None
+        with self._lock:
+            idx = self._indexes.get((order, tag))
+            items = idx.after(cursor, limit + 1) if idx is not None else []
+            rows = [self._entries[u].row for _, u in items[:limit]]
+        next_cursor = None
+        if len(items) > limit:
+            key, uuid = items[limit - 1]
+            next_cursor = encode_feed_cursor(order, key, uuid)
+        return rows, next_cursor
+
+    def get_many(self, uuids):
+        """Строки событий по uuid (закладки), в порядке запроса; закрытых и неизвестных нет."""
+        self._ensure()
+        with self._lock:
+            return [self._entries[u].row for u in uuids if u in self._entries]
+
+    def tags(self, limit: int = 30):
+        """Теги по числу открытых событий."""
+        self._ensure()
+        with self._lock:
+            counts = [(len(idx), ik[1]) for ik, idx in self._indexes.items() if ik[0] == "new" and ik[1]]
+        counts.sort(key=lambda c: (-c[0], c[1]))
+        return [t for _, t in counts[:limit]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    # --- обновления из шины ---
+    def apply_trade(self, d: dict):
+        amount = float((d.get("got_amount") if d.get("sell") else d.get("amount")) or 0)
+        if amount <= 0:
+            return
+        with self._lock:
+            e = self._entries.get(d.get("event_uuid"))
+            if e is None:
+                return
+            old = [(ik, key) for ik, key in self._index_keys(e) if ik[0] == "trending"]
+            e.heat = _log_add(e.heat, math.log(amount) + self.rate * time.time())
+            for ik, key in old:
+                idx = self._indexes[ik]
+                idx.remove(key, e.uuid)
+                idx.add(e.key("trending"), e.uuid)
+
+    def apply_created(self, d: dict):
+        if d.get("is_published"):
+            with self._lock:
+                self._pending.add(d["event_uuid"])
+
+    def apply_closed(self, d: dict):
+        with self._lock:
+            self._drop(d["event_uuid"])
@@ -0,0 +1,44 @@
+# Конфиг gunicorn подхватывается автоматически (./gunicorn.conf.py);
+# bind/workers/threads/timeout по-прежнему задаются в Procfile.
+import threading
+
+# Приложение импортируется один раз в мастере, воркеры получают его через fork.
+# Это безопасно: при импорте не создаются ни соединения, ни потоки — всё ленивое.
+preload_app = True
+
+
+def when_ready(server):
+    # один раз на старт мастера (деплой/скейл-ап), а не в каждом воркере на первом запросе
+    from app import ensure_webhook
+    from database import db
+    from static_bundle import bundle
+
+    db.preload()
+    bundle.version  # чтение и сжатие статики — до fork, страницы памяти общие
+    # синхронно: потоки в мастере перед fork опасны (унаследованные захваченные блокировки)
+    ensure_webhook()
+
+
+def post_fork(server, worker):
+    from app import expiry, search_index
+    from database import db
+    from eventbus import bus
+    from pricehub import hub, streams_for_threads
+
+    bus.start()
+    # SSE не должен занять все потоки воркера (--threads в Procfile)
+    hub.max_streams = streams_for_threads(worker.cfg.threads)
+    # таймеры закрытия событий по end_date; закрывает RPC, так что дубли по воркерам безвредны
+    expiry.start()
+    # соединение с Supabase прогреваем в фоне: воркер начинает принимать запросы сразу
+    threading.Thread(target=db.warm_up, name="db-warm-up", daemon=True).start()
+    # поисковый индекс собирается в фоне: первый поиск не ждёт чтения всей таблицы events
+    search_index.start()
+
+
+def worker_exit(server, worker):
+    from app import update_executor
+
+    # апдейты Telegram уже подтверждены ответом 200 — дорабатываем очередь до выхода воркера
+    # (drain короче graceful_timeout, иначе мастер добьёт воркер SIGKILL раньше)
+    update_executor.drain()
@@ -0,0 +1,56 @@
+import gzip
+import hashlib
+
+from flask import Response, make_response, request
+
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+API_CACHE_CONTROL = "private, no-cache"
+
+
+def weak_etag(*parts) -> str:
+    """ETag из «версий» данных (резервы, high-water mark леджера и т.п.), а не из тела ответа."""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+
+
+def conditional(etag_parts, build):
+    """
+    Если If-None-Match совпал — 304 без вызова build() (ни запросов, ни сериализации).
+    Иначе build() строит обычный ответ, к которому добавляется слабый ETag.
+    Если какую-то из версий получить не удалось (None) — отвечаем без ETag.
+    """
+    if any(p is None for p in etag_parts):
+        return make_response(build())
+    tag = weak_etag(*etag_parts)
+    if request.if_none_match.contains_weak(tag):
+        resp = Response(status=304)
+        resp.set_etag(tag, weak=True)
+        resp.headers["Cache-Control"] = API_CACHE_CONTROL
+        return resp
+    resp = make_response(build())
+    if resp.status_code == 200:
+        resp.set_etag(tag, weak=True)
+        resp.headers["Cache-Control"] = API_CACHE_CONTROL
+    return resp
+
+
+def _gzip_json(resp):
+    if (
+        resp.status_code != 200
+        or resp.direct_passthrough
+        or resp.mimetype != "application/json"
+        or "Content-Encoding" in resp.headers
+        or "gzip" not in (request.headers.get("Accept-Encoding") or "").lower()
+    ):
+        return resp
+    body = resp.get_data()
+    if len(body) < GZIP_MIN_SIZE:
+        return resp
+    resp.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    resp.headers["Content-Encoding"] = "gzip"
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+
+def init_app(app):
+    app.after_request(_gzip_json)
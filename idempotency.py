@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+
+IDEMPOTENCY_TTL = 15 * 60
+IDEMPOTENCY_MAX_ITEMS = 20_000
+MAX_KEY_LEN = 64
+
+
+def normalize_key(raw) -> str | None:
+    key = str(raw or "").strip()
+    if not key or len(key) > MAX_KEY_LEN:
+        return None
+    return key
+
+
+class IdempotencyStore:
+    """
+    Локальный ограниченный кэш результатов (LRU + TTL) по ключу (chat_id, idempotency_key).
+    Плюс «в полёте»: параллельный дубль в том же воркере ждёт первый запрос, а не идёт в RPC.
+    Хранит (хэш запроса, ответ). Межворкерную гарантию даёт уникальный ключ в таблице
+    trade_requests, который пишется в транзакции самой сделки (sql/012).
+    """
+
+    def __init__(self, max_items: int = IDEMPOTENCY_MAX_ITEMS, ttl: float = IDEMPOTENCY_TTL):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, result = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, result)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def begin(self, key):
+        """(True, None) — мы владельцы ключа; (False, event) — ключ уже обрабатывается, ждать event."""
+        with self._lock:
+            ev = self._inflight.get(key)
+            if ev is not None:
+                return False, ev
+            self._inflight[key] = threading.Event()
+            return True, None
+
+    def finish(self, key):
+        with self._lock:
+            ev = self._inflight.pop(key, None)
+        if ev is not None:
+            ev.set()
+
+
+buy_results = IdempotencyStore()
@@ -0,0 +1,155 @@
+"""
+LMSR (logarithmic market scoring rule) — совместная цена всех вариантов события.
+
+C(q) = b * ln(sum_j exp(q_j / b)), цена варианта i = softmax(q / b)_i, сумма цен = 1.
+q_i — число выпущенных долей «ДА» по варианту i. Доля «НЕТ» по варианту i эквивалентна
+доле «ДА» по каждому из остальных вариантов. Максимальный убыток маркет-мейкера — b * ln N.
+
+Сколько долей даёт сумма a (в единицах баланса), решается в закрытой форме (x = a / b):
+    ДА:  shares = b * (x - ln p_i + ln(1 - (1 - p_i) * e^-x))
+    НЕТ: shares = b * (x - ln(1 - p_i) + ln(1 - p_i * e^-x))
+Логарифмы цен берутся через log-sum-exp со сдвигом на максимум, поэтому нет переполнения
+при больших q / b и потери точности для почти нулевых цен.
+Та же формула — в rpc_trade_buy_lmsr (sql/007). Продажа — обратный ход: выручка C(q) - C(q'),
+где q' — q без проданных долей (rpc_trade_sell, sql/008).
+Стоимость и цены считаются векторно (NumPy); price_path — траектория цены по серии сделок
+одной операцией над матрицей (сделки × варианты), для /api/market/history.
+"""
+import math
+
+import numpy as np
+
+LMSR_DEFAULT_B = 300.0
+
+
+def log_sum_exp(xs) -> float:
+    a = np.asarray(xs, dtype=float)
+    if not a.size:
+        return -math.inf
+    m = a.max()
+    if m == -math.inf:
+        return -math.inf
+    return float(m + np.log(np.exp(a - m).sum()))
+
+
+def share_deltas(outcomes: int, option_index, is_yes, shares) -> np.ndarray:
+    """
+    Сделки -> приращения q формы (сделки, варианты): ДА по i — +shares к q_i,
+    НЕТ по i — +shares ко всем остальным. Продажа — отрицательные shares.
+    """
+    idx = np.asarray(option_index, dtype=int)
+    yes = np.asarray(is_yes, dtype=bool)
+    s = np.asarray(shares, dtype=float)
+    d = np.repeat(np.where(yes, 0.0, s)[:, None], outcomes, axis=1)
+    d[np.arange(len(idx)), idx] = np.where(yes, s, 0.0)
+    return d
+
+
+class LmsrBook:
+    """Состояние LMSR одного события. q — кортеж: подменяется целиком, читатели не видят полузаписи."""
+
+    __slots__ = ("b", "q", "_priced")
+
+    def __init__(self, b: float, q):
+        if b <= 0:
+            raise ValueError("b must be positive")
+        self.b = float(b)
+        self.q = tuple(float(x) for x in q)
+        self._priced = (None, ())  # (q, цены) — цены всех вариантов считаются один раз на состояние
+
+    @classmethod
+    def new(cls, outcomes: int, b: float = LMSR_DEFAULT_B):
+        return cls(b, (0.0,) * outcomes)
+
+    def _scaled(self, q=None) -> np.ndarray:
+        return np.asarray(self.q if q is None else q, dtype=float) / self.b
+
+    def cost(self, q=None) -> float:
+        return self.b * log_sum_exp(self._scaled(q))
+
+    def log_prices(self, q=None) -> np.ndarray:
+        s = self._scaled(q)
+        return s - log_sum_exp(s)
+
+    def prices(self, q=None):
+        """Цены всех вариантов (список) за один проход O(N)."""
+        if q is None:
+            q = self.q
+            cached_q, cached = self._priced
+            if cached_q is q:
+                return cached
+            out = np.exp(self.log_prices(q)).tolist()
+            self._priced = (q, out)
+            return out
+        return np.exp(self.log_prices(q)).tolist()
+
+    def price(self, i: int) -> float:
+        return self.prices()[i]
+
+    def price_path(self, i: int, deltas) -> np.ndarray:
+        """Цена варианта i после каждой строки deltas (share_deltas) от текущего q; состояние не меняет."""
+        s = (np.asarray(self.q, dtype=float) + np.cumsum(deltas, axis=0)) / self.b
+        s -= s.max(axis=1, keepdims=True)
+        e = np.exp(s)
+        return e[:, i] / e.sum(axis=1)
+
+    def apply_deltas(self, deltas):
+        """Сразу все сделки (строки share_deltas) — одним сложением."""
+        self.q = tuple((np.asarray(self.q, dtype=float) + np.asarray(deltas, dtype=float).sum(axis=0)).tolist())
+
+    def _log_p_and_not(self, i: int):
+        s = self._scaled()
+        lse = log_sum_exp(s)
+        others = np.delete(s, i)
+        # ln(1 - p_i) = ln(сумма остальных) - ln(сумма всех): точно и при p_i → 1
+        return float(s[i] - lse), (log_sum_exp(others) - lse) if others.size else -math.inf
+
+    def shares_for(self, i: int, side: str, amount: float) -> float:
+        """Сколько долей стороны side варианта i даёт сумма amount (без изменения состояния)."""
+        if amount <= 0:
+            return 0.0
+        x = amount / self.b
+        log_p, log_not = self._log_p_and_not(i)
+        if side == "yes":
+            p_not = math.exp(log_not)
+            return self.b * (x - log_p + math.log1p(-p_not * math.exp(-x)))
+        if side == "no":
+            if log_not == -math.inf:
+                return 0.0
+            p = math.exp(log_p)
+            return self.b * (x - log_not + math.log1p(-p * math.exp(-x)))
+        raise ValueError(f"unknown side: {side}")
+
+    def _moved(self, i: int, side: str, shares: float):
+        q = list(self.q)
+        if side == "yes":
+            q[i] += shares
+        else:
+            for j in range(len(q)):
+                if j != i:
+                    q[j] += shares
+        return tuple(q)
+
+    def apply_shares(self, i: int, side: str, shares: float):
+        """Отрицательное shares — продажа."""
+        self.q = self._moved(i, side, shares)
+
+    def proceeds_for(self, i: int, side: str, shares: float) -> float:
+        """Выручка за продажу shares долей: C(q) - C(q') (без изменения состояния)."""
+        if shares <= 0:
+            return 0.0
+        return self.cost() - self.cost(self._moved(i, side, -shares))
+
+    def buy(self, i: int, side: str, amount: float):
+        """Покупка на сумму amount: (доли, средняя цена доли). Меняет состояние."""
+        shares = self.shares_for(i, side, amount)
+        if shares > 0:
+            self.apply_shares(i, side, shares)
+        return shares, (amount / shares if shares > 0 else 0.0)
+
+    def sell(self, i: int, side: str, shares: float):
+        """Продажа shares долей: (выручка, средняя цена доли). Меняет состояние."""
+        amount = self.proceeds_for(i, side, shares)
+        if amount > 0:
+            self.apply_shares(i, side, -shares)
+        return amount, (amount / shares if amount > 0 else 0.0)
@@ -0,0 +1,103 @@
+"""
+Агрегаты рынка: объём (всего и за 24 часа), число сделок, уникальные трейдеры, открытый интерес.
+Источник — таблицы market_stats / market_volume_hourly (sql/009), их ведут триггеры на каждую
+сделку. Здесь — копия в MarketState: перечитывается вместе с рынком и досчитывается по сделкам
+из шины, поэтому чтение — O(1) на рынок без сканирования market_orders.
+"""
+import time
+
+from scheduler import parse_ts
+
+BUCKET = 3600
+WINDOW_BUCKETS = 24
+
+
+class RollingVolume:
+    """Объём по часовым корзинам за последние 24 часа: кольцо фиксированного размера."""
+
+    __slots__ = ("_stamp", "_volume")
+
+    def __init__(self):
+        self._stamp = [-1] * WINDOW_BUCKETS   # номер часа, которому принадлежит ячейка
+        self._volume = [0.0] * WINDOW_BUCKETS
+
+    def add(self, ts: float, amount: float):
+        hour = int(ts // BUCKET)
+        i = hour % WINDOW_BUCKETS
+        if self._stamp[i] != hour:
+            self._stamp[i] = hour
+            self._volume[i] = 0.0
+        self._volume[i] += amount
+
+    def load(self, buckets):
+        """buckets — [(unix time начала часа, объём)] из market_volume_hourly."""
+        self._stamp = [-1] * WINDOW_BUCKETS
+        self._volume = [0.0] * WINDOW_BUCKETS
+        for ts, amount in buckets:
+            self.add(ts, amount)
+
+    def buckets(self):
+        """[(unix time начала часа, объём)] непустых ячеек."""
+        return [(stamp * BUCKET, v) for stamp, v in zip(self._stamp, self._volume) if stamp >= 0 and v]
+
+    def total(self, now: float | None = None) -> float:
+        hour = int((time.time() if now is None else now) // BUCKET)
+        return sum((v for s, v in zip(self._stamp, self._volume) if hour - WINDOW_BUCKETS < s <= hour), 0.0)
+
+
+class MarketStats:
+    __slots__ = ("volume", "orders", "traders", "open_yes", "open_no", "window")
+
+    def __init__(self):
+        self.volume = 0.0
+        self.orders = 0
+        self.traders = 0
+        self.open_yes = 0.0   # доли ДА на руках у пользователей
+        self.open_no = 0.0
+        self.window = RollingVolume()
+
+    def load(self, row, hourly):
+        """row — встроенная market_stats (объект, список из одного объекта или None), hourly — market_volume_hourly."""
+        if isinstance(row, list):
+            row = row[0] if row else None
+        row = row or {}
+        self.volume = float(row.get("volume") or 0)
+        self.orders = int(row.get("orders") or 0)
+        self.traders = int(row.get("traders") or 0)
+        self.open_yes = float(row.get("open_yes") or 0)
+        self.open_no = float(row.get("open_no") or 0)
+        self.window.load((parse_ts(h.get("bucket")) or 0, float(h.get("volume") or 0)) for h in (hourly or []))
+
+    def record_trade(self, d: dict, now: float | None = None):
+        """Сделка из шины (TRADE_EXECUTED). Новых трейдеров и неттинг видит только перечитывание из БД."""
+        if d.get("sell"):
+            amount, shares = float(d.get("got_amount") or 0), -float(d.get("shares") or 0)
+        else:
+            amount, shares = float(d.get("amount") or 0), float(d.get("got_shares") or 0)
+        self.volume += amount
+        self.orders += 1
+        self.window.add(time.time() if now is None else now, amount)
+        if d.get("side") == "yes":
+            self.open_yes = max(0.0, self.open_yes + shares)
+        else:
+            self.open_no = max(0.0, self.open_no + shares)
+
+    def volume_24h(self, now: float | None = None) -> float:
+        return self.window.total(now)
+
+    @property
+    def open_interest(self) -> float:
+        return self.open_yes + self.open_no
+
+    def version(self):
+        return (self.volume, self.orders, self.traders, self.open_yes, self.open_no)
+
+    def as_dict(self, now: float | None = None) -> dict:
+        return {
+            "volume": round(self.volume, 2),
+            "volume_24h": round(self.volume_24h(now), 2),
+            "orders": self.orders,
+            "traders": self.traders,
+            "open_yes": round(self.open_yes, 4),
+            "open_no": round(self.open_no, 4),
+        }
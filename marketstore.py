@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+
+from lmsr import LmsrBook
+from marketstats import MarketStats
+
+MARKET_STORE_TTL = float(os.getenv("MARKET_STORE_TTL", "60"))
+
+
+class MarketState:
+    """Состояние одного рынка. Резервы — один кортеж: читатель не увидит yes от одной сделки и no от другой."""
+
+    __slots__ = ("id", "event_uuid", "option_index", "reserves", "initial", "k", "book", "resolved", "winner",
+                 "closed", "created_at", "stats", "loaded")
+
+    def __init__(self, market_id: int, event_uuid: str, option_index: int):
+        self.id = market_id
+        self.event_uuid = event_uuid
+        self.option_index = option_index
+        self.reserves = (0.0, 0.0)
+        self.initial = (0.0, 0.0)  # стартовые резервы — от них проигрывается история цены
+        self.k = 0.0
+        self.book = None  # LmsrBook, общая для всех вариантов события; None — рынок x*y=k
+        self.resolved = False
+        self.winner = None
+        self.closed = False
+        self.created_at = None
+        self.stats = MarketStats()
+        self.loaded = 0.0
+
+    @property
+    def yes_price(self) -> float:
+        if self.book is not None:
+            return self.book.price(self.option_index)
+        yes, no = self.reserves
+        total = yes + no
+        return no / total if total > 0 else 0.5
+
+    def version(self):
+        """Всё, что видно клиенту, — для ETag."""
+        q = self.book.q if self.book is not None else None
+        return (self.id, self.reserves, q, self.resolved, self.winner, self.closed, self.stats.version())
+
+    def as_dict(self) -> dict:
+        yes, no = self.reserves
+        return {
+            "id": self.id, "option_index": self.option_index,
+            "total_yes_reserve": yes, "total_no_reserve": no, "liquidity": round(self.k ** 0.5, 2),
+            "resolved": self.resolved, "winner_side": self.winner,
+            **self.stats.as_dict(),
+        }
+
+
+class MarketStore:
+    """
+    Рынки в памяти процесса: по id, по (event_uuid, option_index) и списком по событию.
+    Загружаются из БД при первом обращении и перечитываются раз в ttl секунд; между перечитываниями
+    обновляются результатами сделок и резолвов из шины (своих и соседних воркеров). Перечитывание
+    по ttl страхует от датаграмм шины, пришедших не по порядку, и от изменений в обход приложения.
+    """
+
+    def __init__(self, load_events, load_ids, ttl: float = MARKET_STORE_TTL):
+        # загрузчики возвращают None при ошибке БД — тогда отдаём то, что есть, и пробуем в следующий раз
+        self.load_events = load_events  # [event_uuid] -> {event_uuid: [строка prediction_markets]}
+        self.load_ids = load_ids        # [market_id] -> [строка prediction_markets]
+        self.ttl = ttl
+        self._by_id = {}
+        self._by_key = {}
+        self._by_event = {}
+        self._event_loaded = {}
+        self._books = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_id)
+
+    # --- загрузка ---
+    def _put(self, row: dict, now: float) -> MarketState:
+        mid = int(row["id"])
+        st = self._by_id.get(mid)
+        if st is None:
+            st = MarketState(mid, row["event_uuid"], int(row["option_index"]))
+            self._by_id[mid] = st
+            self._by_key[(st.event_uuid, st.option_index)] = st
+            markets = self._by_event.setdefault(st.event_uuid, [])
+            markets.append(st)
+            markets.sort(key=lambda s: s.option_index)
+        yes = float(row.get("total_yes_reserve") or 0)
+        no = float(row.get("total_no_reserve") or 0)
+        st.reserves = (yes, no)
+        st.k = float(row.get("constant_product") or yes * no)
+        # рынки до sql/010 без стартовых резервов начинались с sqrt(k)/sqrt(k)
+        root = st.k ** 0.5
+        st.initial = (float(row.get("initial_yes_reserve") or root), float(row.get("initial_no_reserve") or root))
+        ev = row.get("events") or {}
+        if ev.get("lmsr_b"):
+            book = self._books.get(st.event_uuid)
+            if book is None:
+                book = self._books[st.event_uuid] = LmsrBook(float(ev["lmsr_b"]), ev.get("lmsr_q") or [])
+            else:
+                book.q = tuple(float(x) for x in (ev.get("lmsr_q") or []))
+            st.book = book
+        st.resolved = bool(row.get("resolved"))
+        st.winner = row.get("winner_side")
+        st.closed = bool(row.get("is_closed"))
+        st.created_at = row.get("created_at") or st.created_at
+        if "market_stats" in row:
+            st.stats.load(row.get("market_stats"), row.get("market_volume_hourly"))
+        st.loaded = now
+        return st
+
+    def _fresh(self, loaded: float, now: float) -> bool:
+        return now - loaded < self.ttl
+
+    def for_events(self, event_uuids) -> dict:
+        """{event_uuid: [MarketState по option_index]}; недостающие и устаревшие события — одним запросом."""
+        now = time.monotonic()
+        stale = [u for u in event_uuids if not self._fresh(self._event_loaded.get(u, 0.0), now)]
+        if stale:
+            loaded = self.load_events(stale)
+            if loaded is None:
+                return {u: self._by_event.get(u, []) for u in event_uuids}
+            with self._lock:
+                for u in stale:
+                    for row in loaded.get(u, []):
+                        self._put(row, now)
+                    self._event_loaded[u] = now
+        return {u: self._by_event.get(u, []) for u in event_uuids}
+
+    def get_many(self, market_ids) -> dict:
+        now = time.monotonic()
+        stale = [i for i in market_ids if i not in self._by_id or not self._fresh(self._by_id[i].loaded, now)]
+        if stale:
+            rows = self.load_ids(stale)
+            with self._lock:
+                for row in rows or []:
+                    self._put(row, now)
+        return {i: self._by_id[i] for i in market_ids if i in self._by_id}
+
+    def get(self, market_id: int):
+        return self.get_many([market_id]).get(market_id)
+
+    def by_key(self, event_uuid: str, option_index: int):
+        st = self._by_key.get((event_uuid, option_index))
+        if st is None or not self._fresh(st.loaded, time.monotonic()):
+            self.for_events([event_uuid])
+            st = self._by_key.get((event_uuid, option_index))
+        return st
+
+    def invalidate_event(self, event_uuid: str):
+        with self._lock:
+            self._event_loaded.pop(event_uuid, None)
+            for st in self._by_event.get(event_uuid, []):
+                st.loaded = 0.0
+
+    # --- обновления из шины ---
+    def apply_trade(self, d: dict):
+        st = self._by_id.get(int(d["market_id"]))
+        if st is None:
+            return
+        st.stats.record_trade(d)
+        if st.book is not None:
+            if d.get("lmsr_q"):
+                st.book.q = tuple(float(x) for x in d["lmsr_q"])
+            return
+        if d.get("yes_reserve") is None:
+            return
+        yes, no = float(d["yes_reserve"]), float(d["no_reserve"])
+        st.reserves = (yes, no)
+        st.k = yes * no
+
+    def apply_resolution(self, d: dict):
+        st = self._by_id.get(int(d["market_id"]))
+        if st is not None:
+            st.resolved = True
+            st.winner = d.get("winner_side")
+
+    def apply_closed(self, d: dict):
+        for st in self._by_event.get(d["event_uuid"], []):
+            st.closed = True
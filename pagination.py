@@ -0,0 +1,26 @@
+import base64
+import json
+import re
+
+# ISO-8601 из PostgREST; курсор попадает в фильтр or=(...), поэтому лишние символы не пропускаем
+_TS_RE = re.compile(r"^[0-9T:.+\- Z]{10,40}$")
+
+
+def encode_cursor(created_at: str, row_id: int) -> str:
+    raw = json.dumps([created_at, int(row_id)], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """(created_at, id) или None, если курсор битый."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        created_at, row_id = str(created_at), int(row_id)
+    except Exception:
+        return None
+    if not _TS_RE.match(created_at):
+        return None
+    return created_at, row_id
@@ -0,0 +1,164 @@
+"""
+Приём апдейтов через getUpdates (long polling) вместо webhook.
+
+    python polling.py                 # токен и адрес API из окружения, как у app.py
+    python polling.py --workers 8 --batch 100 --offset-file .tg_offset
+
+Логика бота общая с webhook (app.handle_update). Апдейты одного чата
+обрабатываются по порядку, разных чатов — параллельно. Offset фиксируется
+только после обработки всей пачки, поэтому при падении апдейты не теряются
+(повторы отсекает окно дедупликации).
+"""
+import argparse
+import os
+import threading
+import time
+
+import requests
+
+from updates import ChatOrderedExecutor, UpdateDeduper, update_chat_id
+
+ALLOWED_UPDATES = ["message"]
+
+
+class _Countdown:
+    def __init__(self, n: int):
+        self._n = n
+        self._cond = threading.Condition()
+
+    def done(self):
+        with self._cond:
+            self._n -= 1
+            if self._n <= 0:
+                self._cond.notify_all()
+
+    def wait(self):
+        with self._cond:
+            while self._n > 0:
+                self._cond.wait()
+
+
+class LongPollingRunner:
+    def __init__(self, token: str, handler, api_base: str = "https://api.telegram.org",
+                 workers: int = 4, batch: int = 100, poll_timeout: int = 30, offset_file: str | None = None):
+        self.url = f"{api_base.rstrip('/')}/bot{token}"
+        self.handler = handler
+        self.batch = batch
+        self.poll_timeout = poll_timeout
+        self.offset_file = offset_file
+        self.executor = ChatOrderedExecutor(workers=workers, name="tg-poll")
+        self.dedup = UpdateDeduper()
+        self.session = requests.Session()
+        self.offset = self._load_offset()
+        self.processed = 0
+        self._stop = threading.Event()
+
+    # --- offset ---
+    def _load_offset(self) -> int:
+        if not self.offset_file:
+            return 0
+        try:
+            with open(self.offset_file, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _commit_offset(self, offset: int):
+        self.offset = offset
+        if not self.offset_file:
+            return
+        tmp = self.offset_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(offset))
+        os.replace(tmp, self.offset_file)
+
+    # --- Telegram API ---
+    def delete_webhook(self):
+        # getUpdates не работает, пока у бота установлен webhook
+        try:
+            r = self.session.post(f"{self.url}/deleteWebhook", json={"drop_pending_updates": False}, timeout=10)
+            print(f"[polling] deleteWebhook {r.status_code} {r.text}")
+        except Exception as e:
+            print(f"[polling] deleteWebhook error: {e}")
+
+    def fetch(self):
+        r = self.session.post(
+            f"{self.url}/getUpdates",
+            json={"offset": self.offset, "limit": self.batch, "timeout": self.poll_timeout,
+                  "allowed_updates": ALLOWED_UPDATES},
+            timeout=self.poll_timeout + 10,
+        )
+        data = r.json()
+        if not data.get("ok"):
+            raise RuntimeError(f"getUpdates failed: {data}")
+        return data.get("result") or []
+
+    # --- обработка ---
+    def process_batch(self, updates):
+        fresh = [u for u in updates if not self.dedup.is_duplicate(u.get("update_id"))]
+        countdown = _Countdown(len(fresh))
+
+        def task(u):
+            try:
+                self.handler(u)
+            finally:
+                countdown.done()
+
+        for u in fresh:
+            # long polling сам задаёт темп: ждём места в очереди, а не исполняем вне порядка чата
+            self.executor.submit(update_chat_id(u), task, u, timeout=None)
+        countdown.wait()
+        self.processed += len(fresh)
+        if updates:
+            self._commit_offset(max(int(u["update_id"]) for u in updates) + 1)
+
+    def run_once(self) -> int:
+        updates = self.fetch()
+        self.process_batch(updates)
+        return len(updates)
+
+    def run(self, max_updates: int | None = None):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                backoff = 1.0
+            except Exception as e:
+                print(f"[polling] error: {e}; retry in {backoff:.0f}s")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            if max_updates is not None and self.processed >= max_updates:
+                break
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Telegram long polling runner")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("UPDATE_WORKERS", "4")))
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--timeout", type=int, default=30, help="long poll timeout, s")
+    parser.add_argument("--offset-file", default=os.getenv("POLLING_OFFSET_FILE"))
+    args = parser.parse_args()
+
+    from app import handle_update, TOKEN, BASE_URL, TELEGRAM_API
+
+    assert TOKEN, "BOT_TOKEN not set"
+    public_host = (BASE_URL or "").split("://", 1)[-1].rstrip("/") or "localhost"
+    runner = LongPollingRunner(
+        TOKEN, lambda u: handle_update(u, public_host), api_base=TELEGRAM_API,
+        workers=args.workers, batch=args.batch, poll_timeout=args.timeout, offset_file=args.offset_file,
+    )
+    runner.delete_webhook()
+    print(f"[polling] started, offset={runner.offset}, workers={args.workers}")
+    started = time.monotonic()
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        pass
+    print(f"[polling] stopped: {runner.processed} updates in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
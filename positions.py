@@ -0,0 +1,66 @@
+"""Оценка позиций пользователя по текущим резервам рынков (mark-to-market)."""
+
+POSITIONS_PAGE_MAX = 200
+
+
+def value_position(row: dict, market=None) -> dict:
+    """
+    Строка user_shares с вложенными prediction_markets/events → позиция с оценкой.
+    market — MarketState из marketstore (резервы и статус рынка); без него цена 0.5.
+    """
+    m = row.get("prediction_markets") or {}
+    ev = m.get("events") or {}
+    side = row.get("share_type")
+    qty = float(row.get("quantity") or 0)
+    avg = float(row.get("average_price") or 0)
+    if market is not None:
+        yes_price = market.yes_price
+        resolved, winner = market.resolved, market.winner
+    else:
+        yes_price = 0.5
+        resolved, winner = bool(m.get("resolved")), m.get("winner_side")
+
+    if resolved:
+        # после резолва доля стоит 1 у победившей стороны и 0 у проигравшей
+        price = 1.0 if winner == side else 0.0
+    else:
+        price = yes_price if side == "yes" else 1.0 - yes_price
+
+    options = ev.get("options") or []
+    idx = m.get("option_index")
+    option = options[idx] if isinstance(idx, int) and 0 <= idx < len(options) else None
+    cost = qty * avg
+    value = qty * price
+    return {
+        "market_id": row.get("market_id"),
+        "event_uuid": m.get("event_uuid"),
+        "event_name": ev.get("name"),
+        "option_index": idx,
+        "option_text": option.get("text") if isinstance(option, dict) else option,
+        "share_type": side,
+        "quantity": qty,
+        "avg_price": avg,
+        "yes_price": round(yes_price, 6),
+        "no_price": round(1.0 - yes_price, 6),
+        "price": round(price, 6),
+        "cost": round(cost, 4),
+        "value": round(value, 4),
+        "pnl": round(value - cost, 4),
+        "resolved": resolved,
+        "winner_side": winner,
+    }
+
+
+def portfolio_page(rows, limit: int, markets=None):
+    """
+    rows выбраны с запасом в одну строку (limit + 1), чтобы узнать, есть ли следующая страница.
+    markets — {market_id: MarketState}.
+    """
+    markets = markets or {}
+    items = [value_position(r, markets.get(r.get("market_id"))) for r in rows[:limit]]
+    totals = {
+        "cost": round(sum(p["cost"] for p in items), 4),
+        "value": round(sum(p["value"] for p in items), 4),
+    }
+    totals["pnl"] = round(totals["value"] - totals["cost"], 4)
+    return items, len(rows) > limit, totals
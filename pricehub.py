@@ -0,0 +1,95 @@
+import os
+import threading
+from collections import defaultdict
+
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "200"))
+SSE_MAX_TOPICS = 50
+# gthread: каждый SSE-поток держит поток воркера. Под SSE — не больше четверти потоков,
+# остальные остаются webhook, сделкам и API; клиенты сверх лимита получают 503 и опрашивают /api/prices
+SSE_THREAD_SHARE = 4
+
+
+def streams_for_threads(threads: int) -> int:
+    """Лимит SSE-потоков воркера с threads потоками (0 — только опрос)."""
+    return min(SSE_MAX_STREAMS, max(0, int(threads) // SSE_THREAD_SHARE))
+
+
+class Subscription:
+    """
+    Очередь одного SSE-клиента. Обновления коалесцируются по market_id:
+    между двумя «тиками» клиент получает только последнее состояние рынка,
+    поэтому медленный клиент не копит очередь (backpressure без потерь актуальности).
+    """
+    __slots__ = ("topics", "_pending", "_cond", "closed")
+
+    def __init__(self, topics):
+        self.topics = frozenset(topics)
+        self._pending = {}
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def offer(self, market_id, update: dict):
+        with self._cond:
+            prev = self._pending.get(market_id)
+            self._pending[market_id] = {**prev, **update} if prev else update
+            self._cond.notify()
+
+    def wait(self, timeout: float) -> bool:
+        """Ждёт появления обновлений не дольше timeout секунд."""
+        with self._cond:
+            if not self._pending and not self.closed:
+                self._cond.wait(timeout)
+            return bool(self._pending)
+
+    def drain(self):
+        with self._cond:
+            items = list(self._pending.values())
+            self._pending.clear()
+            return items
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class PriceHub:
+    """In-process pub/sub: топик — event_uuid, сообщение — компактное состояние рынка."""
+
+    def __init__(self, max_streams: int = SSE_MAX_STREAMS):
+        self.max_streams = max_streams
+        self._lock = threading.Lock()
+        self._by_topic = defaultdict(set)
+        self._count = 0
+
+    def subscribe(self, topics):
+        topics = [t for t in topics if t][:SSE_MAX_TOPICS]
+        with self._lock:
+            if self._count >= self.max_streams:
+                return None
+            sub = Subscription(topics)
+            for t in sub.topics:
+                self._by_topic[t].add(sub)
+            self._count += 1
+            return sub
+
+    def unsubscribe(self, sub: Subscription):
+        sub.close()
+        with self._lock:
+            for t in sub.topics:
+                subs = self._by_topic.get(t)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._by_topic[t]
+            self._count -= 1
+
+    def publish(self, topic: str, market_id: int, update: dict):
+        with self._lock:
+            subs = list(self._by_topic.get(topic, ()))
+        for sub in subs:
+            sub.offer(market_id, update)
+        return len(subs)
+
+
+hub = PriceHub()
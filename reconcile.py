@@ -0,0 +1,225 @@
+"""
+Сверка users.balance с ledger.
+
+    python reconcile.py                  # инкрементально: только строки ledger новее high-water mark
+    python reconcile.py --full           # полный аудит: весь ledger и все пользователи, постранично
+    python reconcile.py --json --tolerance 0.01 --state .reconcile_state.json
+
+Ожидаемый баланс = стартовый (INITIAL_BALANCE, его ставит create_user) + сумма ledger.delta.
+В файле состояния — hwm по ledger.id и накопленные (сумма, число строк) по каждому пользователю,
+поэтому обычный запуск читает только новые строки ledger и проверяет только затронутых ими
+пользователей (плюс тех, у кого дрейф был в прошлый раз). Изменение баланса в обход ledger
+находит только --full. Память — O(пользователей), а не O(строк ledger).
+
+Строки моложе --lag секунд не учитываются: транзакция с меньшим id может закоммититься позже
+большего, и hwm не должен её перепрыгнуть. Код возврата 1 — найден дрейф (для cron).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+INITIAL_BALANCE = Decimal(os.getenv("INITIAL_BALANCE", "1000"))
+RECONCILE_STATE = os.getenv("RECONCILE_STATE", ".reconcile_state.json")
+PAGE_SIZE = 1000
+IN_CHUNK = 200  # chat_id в одном in.(...) — ограничение длины URL
+COMMIT_LAG = 60
+
+
+def _dec(x) -> Decimal:
+    return Decimal(str(x if x is not None else 0))
+
+
+def _chunks(items, n):
+    items = list(items)
+    for i in range(0, len(items), n):
+        yield items[i:i + n]
+
+
+class ReconcileState:
+    def __init__(self, hwm: int = 0, sums=None, drift=None):
+        self.hwm = hwm
+        self.sums = sums or {}    # chat_id -> [Decimal сумма, int строк]
+        self.drift = drift or {}  # chat_id -> str(дрейф) с прошлого запуска
+
+    @classmethod
+    def load(cls, path: str):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        sums = {int(k): [Decimal(v[0]), int(v[1])] for k, v in (data.get("users") or {}).items()}
+        drift = {int(k): v for k, v in (data.get("drift") or {}).items()}
+        return cls(int(data.get("hwm") or 0), sums, drift)
+
+    def save(self, path: str):
+        data = {
+            "hwm": self.hwm,
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+            "users": {str(k): [str(v[0]), v[1]] for k, v in self.sums.items()},
+            "drift": {str(k): v for k, v in self.drift.items()},
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def apply(self, rows) -> set:
+        """Добавляет строки ledger (по возрастанию id) к суммам; возвращает затронутые chat_id."""
+        touched = set()
+        for r in rows:
+            cid = int(r["chat_id"])
+            acc = self.sums.get(cid)
+            if acc is None:
+                acc = self.sums[cid] = [Decimal(0), 0]
+            acc[0] += _dec(r["delta"])
+            acc[1] += 1
+            self.hwm = max(self.hwm, int(r["id"]))
+            touched.add(cid)
+        return touched
+
+    def expected(self, chat_id: int) -> Decimal:
+        acc = self.sums.get(chat_id)
+        return INITIAL_BALANCE + (acc[0] if acc else 0)
+
+    def rows(self, chat_id: int) -> int:
+        acc = self.sums.get(chat_id)
+        return acc[1] if acc else 0
+
+
+class Reconciler:
+    def __init__(self, source, state: ReconcileState, tolerance: float = 0.01,
+                 page_size: int = PAGE_SIZE, lag: float = COMMIT_LAG):
+        self.source = source
+        self.state = state
+        self.tolerance = Decimal(str(tolerance))
+        self.page_size = page_size
+        self.lag = lag
+        self.ledger_rows = 0
+
+    def consume_ledger(self) -> set:
+        """Дочитывает ledger от hwm страницами по id; в памяти — одна страница."""
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=self.lag)).isoformat() if self.lag else None
+        touched = set()
+        while True:
+            page = self.source.ledger_page(self.state.hwm, self.page_size, before_iso=cutoff)
+            touched |= self.state.apply(page)
+            self.ledger_rows += len(page)
+            if len(page) < self.page_size:
+                return touched
+
+    def _candidate(self, chat_id: int, balance):
+        if balance is None:
+            return None
+        drift = _dec(balance) - self.state.expected(chat_id)
+        if abs(drift) <= self.tolerance:
+            return None
+        return {"chat_id": chat_id, "balance": _dec(balance), "expected": self.state.expected(chat_id), "drift": drift}
+
+    def _settle(self, candidates):
+        """
+        Досверка: сделка могла попасть в users.balance, но её строка ledger — новее hwm/cutoff.
+        Такие расхождения «в полёте» не считаем дрейфом и состояние ими не двигаем.
+        """
+        by_id = {c["chat_id"]: c for c in candidates}
+        for chunk in _chunks(by_id, IN_CHUNK):
+            for r in self.source.ledger_rows_for_users(chunk, self.state.hwm):
+                c = by_id[int(r["chat_id"])]
+                c["expected"] += _dec(r["delta"])
+                c["drift"] -= _dec(r["delta"])
+        return [c for c in by_id.values() if abs(c["drift"]) > self.tolerance]
+
+    def _finish(self, candidates):
+        drifted = self._settle(candidates)
+        report = []
+        prev = self.state.drift
+        for c in sorted(drifted, key=lambda c: -abs(c["drift"])):
+            report.append({
+                "chat_id": c["chat_id"],
+                "balance": str(c["balance"]),
+                "expected": str(c["expected"]),
+                "drift": str(c["drift"]),
+                "ledger_rows": self.state.rows(c["chat_id"]),
+                # тот же дрейф второй запуск подряд — не гонка, а реальное расхождение
+                "repeated": prev.get(c["chat_id"]) == str(c["drift"]),
+            })
+        self.state.drift = {r["chat_id"]: r["drift"] for r in report}
+        return report
+
+    def check(self, chat_ids):
+        candidates = []
+        for chunk in _chunks(chat_ids, IN_CHUNK):
+            balances = self.source.user_balances(chunk)
+            for cid in chunk:
+                if cid not in balances:
+                    if self.state.rows(cid):
+                        candidates.append({"chat_id": cid, "balance": Decimal(0),
+                                           "expected": self.state.expected(cid), "drift": -self.state.expected(cid)})
+                    continue
+                c = self._candidate(cid, balances[cid])
+                if c:
+                    candidates.append(c)
+        return candidates
+
+    def run_incremental(self):
+        touched = self.consume_ledger()
+        # пользователи с прошлым дрейфом проверяются снова — чтобы увидеть, что его исправили
+        return self._finish(self.check(touched | set(self.state.drift)))
+
+    def run_full(self):
+        """Полный аудит с нуля: ledger и users читаются постранично (keyset), состояние пересобирается."""
+        self.state = ReconcileState(drift=self.state.drift)
+        self.consume_ledger()
+        candidates, seen, after = [], set(), None
+        while True:
+            page = self.source.users_balance_page(after, self.page_size)
+            for u in page:
+                cid = int(u["chat_id"])
+                seen.add(cid)
+                c = self._candidate(cid, u.get("balance"))
+                if c:
+                    candidates.append(c)
+            if len(page) < self.page_size:
+                break
+            after = int(page[-1]["chat_id"])
+        # строки ledger пользователей, которых нет в users
+        candidates += self.check([cid for cid in self.state.sums if cid not in seen])
+        return self._finish(candidates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка users.balance с ledger")
+    parser.add_argument("--full", action="store_true", help="полный аудит вместо инкрементального")
+    parser.add_argument("--state", default=RECONCILE_STATE)
+    parser.add_argument("--tolerance", type=float, default=0.01)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--lag", type=float, default=COMMIT_LAG, help="не брать строки ledger моложе, с")
+    parser.add_argument("--json", action="store_true", help="отчёт в JSON")
+    args = parser.parse_args()
+
+    from database import db
+
+    state = ReconcileState.load(args.state)
+    rec = Reconciler(db, state, tolerance=args.tolerance, page_size=args.page_size, lag=args.lag)
+    started = time.monotonic()
+    report = rec.run_full() if args.full else rec.run_incremental()
+    rec.state.save(args.state)
+
+    if args.json:
+        print(json.dumps({"hwm": rec.state.hwm, "ledger_rows": rec.ledger_rows, "drift": report}, ensure_ascii=False))
+    else:
+        for r in report:
+            mark = " (повторно)" if r["repeated"] else ""
+            print(f"{r['chat_id']}: balance={r['balance']} expected={r['expected']} drift={r['drift']}{mark}")
+        print(f"[reconcile] {'full' if args.full else 'incremental'}: {rec.ledger_rows} ledger rows, "
+              f"hwm={rec.state.hwm}, users={len(rec.state.sums)}, drift={len(report)}, "
+              f"{time.monotonic() - started:.1f}s")
+    sys.exit(1 if report else 0)
+
+
+if __name__ == "__main__":
+    main()
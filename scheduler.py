@@ -0,0 +1,153 @@
+import atexit
+import heapq
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+EXPIRY_SCHEDULER = os.getenv("EXPIRY_SCHEDULER", "1") != "0"
+EXPIRY_RESYNC = float(os.getenv("EXPIRY_RESYNC", "300"))
+EXPIRY_RETRY = 5.0
+
+
+def parse_ts(value) -> float | None:
+    """end_date из PostgREST ('2024-05-01T10:00:00+00:00' или без зоны — считаем UTC) -> unix time."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace(" ", "T").replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class ExpiryScheduler:
+    """
+    Закрытие событий по end_date: куча таймеров (end_ts, event_uuid), поток спит до ближайшего
+    дедлайна и вызывает close_expired() — RPC, который атомарно помечает истёкшие события
+    закрытыми. Планировщик есть в каждом воркере, но RPC возвращает событие ровно одному
+    вызывающему, поэтому слушатели on_closed срабатывают один раз на событие.
+    Раз в resync секунд куча пересобирается из БД (правки end_date, события из других процессов).
+    Слушатели работают в отдельном потоке — медленная рассылка не задерживает закрытие.
+    """
+
+    def __init__(self, load_deadlines, close_expired, resync: float = EXPIRY_RESYNC, name: str = "expiry"):
+        self.load_deadlines = load_deadlines  # () -> [(event_uuid, end_ts)] открытых событий
+        self.close_expired = close_expired    # () -> [{"event_uuid", "name", "end_date"}] закрытых сейчас
+        self.resync = resync
+        self.name = name
+        self._heap = []
+        self._deadlines = {}  # event_uuid -> end_ts; запись кучи с другим end_ts устарела
+        self._cond = threading.Condition()
+        self._listeners = []
+        self._notify = queue.Queue()
+        self._pid = None
+
+    def on_closed(self, fn):
+        self._listeners.append(fn)
+        return fn
+
+    def schedule(self, event_uuid: str, end_ts: float | None):
+        if end_ts is None:
+            return
+        with self._cond:
+            self._deadlines[event_uuid] = end_ts
+            heapq.heappush(self._heap, (end_ts, event_uuid))
+            self._cond.notify()
+
+    def cancel(self, event_uuid: str):
+        with self._cond:
+            self._deadlines.pop(event_uuid, None)
+
+    def next_deadline(self):
+        with self._cond:
+            return self._peek()
+
+    def _peek(self):
+        while self._heap:
+            end_ts, uuid = self._heap[0]
+            if self._deadlines.get(uuid) == end_ts:
+                return end_ts
+            heapq.heappop(self._heap)
+        return None
+
+    def _pop_due(self, now: float):
+        due = []
+        with self._cond:
+            while self._peek() is not None and self._heap[0][0] <= now:
+                end_ts, uuid = heapq.heappop(self._heap)
+                del self._deadlines[uuid]
+                due.append((end_ts, uuid))
+        return due
+
+    def reload(self):
+        try:
+            items = list(self.load_deadlines())
+        except Exception as e:
+            print(f"[{self.name}] reload error:", e)
+            return
+        with self._cond:
+            self._deadlines = {uuid: ts for uuid, ts in items if ts is not None}
+            self._heap = [(ts, uuid) for uuid, ts in self._deadlines.items()]
+            heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def sweep(self, now: float | None = None):
+        """Закрывает всё, что истекло к now. Возвращает закрытые этим вызовом события."""
+        due = self._pop_due(time.time() if now is None else now)
+        if not due:
+            return []
+        try:
+            closed = self.close_expired() or []
+        except Exception as e:
+            print(f"[{self.name}] close error:", e)
+            for _, uuid in due:
+                self.schedule(uuid, time.time() + EXPIRY_RETRY)
+            return []
+        for row in closed:
+            self._notify.put(row)
+        return closed
+
+    def start(self):
+        if not EXPIRY_SCHEDULER or self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name=self.name, daemon=True).start()
+        threading.Thread(target=self._run_listeners, name=f"{self.name}-notify", daemon=True).start()
+        atexit.register(self._drain_notify)
+
+    def _run(self):
+        next_resync = 0.0
+        while True:
+            if time.time() >= next_resync:
+                self.reload()
+                next_resync = time.time() + self.resync
+            with self._cond:
+                top = self._peek()
+                wake = next_resync if top is None else min(top, next_resync)
+                timeout = wake - time.time()
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+            self.sweep()
+
+    def _run_listeners(self):
+        while True:
+            row = self._notify.get()
+            for fn in self._listeners:
+                try:
+                    fn(row)
+                except Exception as e:
+                    print(f"[{self.name}] listener error:", e)
+            self._notify.task_done()
+
+    def _drain_notify(self, timeout: float = 5.0):
+        deadline = time.monotonic() + timeout
+        while self._notify.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
@@ -0,0 +1,302 @@
+"""
+Поиск событий: инвертированный индекс в памяти процесса по названию, описанию, тегам и вариантам.
+
+Нормализация: casefold, ё → е, слова — \\w+; лёгкий стемминг отрезает частые русские
+окончания («выборы», «выборов» → «выбор»), у английских слов — s/es. Каждое слово запроса —
+префикс: «выб» находит «выборы»; префиксы ищутся по отсортированному словарю (bisect), а не
+перебором документов. Документы — целые id; постинги — {id: вес поля}, совпадение в названии
+весит больше, чем в описании.
+"""
+import bisect
+import functools
+import heapq
+import os
+import re
+import threading
+import time
+
+from scheduler import parse_ts
+
+SEARCH_TTL = float(os.getenv("SEARCH_TTL", "900"))
+SEARCH_LIMIT_MAX = 50
+MAX_EXPANSIONS = 200   # сколько слов словаря может раскрыть один короткий префикс
+MIN_STEM = 3
+
+FIELD_WEIGHTS = {"name": 3.0, "tags": 2.0, "options": 1.5, "description": 1.0}
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_RU_ENDINGS = (
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией", "иях", "ах", "ях",
+    "ов", "ев", "ей", "ой", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ам", "ям", "ом", "ем",
+    "ую", "юю", "ия", "ии", "ью", "ть", "ет", "ут", "ют", "ит", "ат", "ят",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+)
+# по длине, от длинных к коротким: отрезаем самое длинное подходящее окончание
+_RU_BY_LEN = [(n, {e for e in _RU_ENDINGS if len(e) == n}) for n in range(max(map(len, _RU_ENDINGS)), 0, -1)]
+_CYR_RE = re.compile(r"[а-я]")
+# служебные слова есть почти в каждом описании: ничего не отбирают, а постинги у них самые длинные
+STOP_WORDS = frozenset((
+    "а", "без", "бы", "в", "во", "да", "для", "до", "же", "за", "и", "из", "или", "к", "ко", "ли", "на",
+    "над", "не", "ни", "о", "об", "от", "по", "под", "при", "с", "со", "то", "у", "что", "это",
+    "a", "an", "and", "in", "is", "of", "on", "or", "the", "to",
+))
+
+
+@functools.lru_cache(maxsize=200_000)
+def stem(word: str) -> str:
+    if _CYR_RE.search(word):
+        for n, ends in _RU_BY_LEN:
+            if len(word) - n >= MIN_STEM and word[-n:] in ends:
+                return word[:-n]
+        return word
+    if word.isascii() and word.isalpha():
+        if word.endswith("es") and len(word) - 2 >= MIN_STEM:
+            return word[:-2]
+        if word.endswith("s") and not word.endswith("ss") and len(word) - 1 >= MIN_STEM:
+            return word[:-1]
+    return word
+
+
+def tokens(text) -> list:
+    """Нормализованные основы слов текста, без служебных слов."""
+    norm = str(text or "").casefold().replace("ё", "е")
+    return [stem(w) for w in _WORD_RE.findall(norm) if w not in STOP_WORDS]
+
+
+def _option_texts(options):
+    for o in options or []:
+        yield o.get("text") if isinstance(o, dict) else o
+
+
+class SearchDoc:
+    __slots__ = ("uuid", "published", "closed", "created_ts", "terms")
+
+    def __init__(self, row: dict, terms: dict):
+        self.uuid = row["event_uuid"]
+        self.published = bool(row.get("is_published"))
+        self.closed = bool(row.get("is_closed"))
+        self.created_ts = parse_ts(row.get("created_at")) or 0.0
+        self.terms = terms  # основа -> вес лучшего поля
+
+
+def doc_terms(row: dict) -> dict:
+    fields = {
+        "name": [row.get("name")],
+        "description": [row.get("description")],
+        "tags": row.get("tags") or [],
+        "options": list(_option_texts(row.get("options"))),
+    }
+    terms = {}
+    for field, texts in fields.items():
+        w = FIELD_WEIGHTS[field]
+        for text in texts:
+            for t in tokens(text):
+                if terms.get(t, 0.0) < w:
+                    terms[t] = w
+    # группы uuid — для админского поиска по идентификатору (префикс тоже находит)
+    for t in tokens(row.get("event_uuid")):
+        terms[t] = FIELD_WEIGHTS["name"]
+    return terms
+
+
+class SearchIndex:
+    """
+    Индекс событий. load_pages() -> итератор страниц строк events (все события, включая
+    неопубликованные и закрытые — их отсекает фильтр запроса); load_by_uuids(uuids) -> строки
+    или None при ошибке. Новые события из шины дочитываются лениво, полная пересборка — раз в ttl.
+    """
+
+    def __init__(self, load_pages, load_by_uuids, ttl: float = SEARCH_TTL):
+        self.load_pages = load_pages
+        self.load_by_uuids = load_by_uuids
+        self.ttl = ttl
+        self._docs = {}       # id -> SearchDoc
+        self._ids = {}        # event_uuid -> id
+        self._postings = {}   # основа -> {id: вес}
+        self._vocab = []      # отсортированные основы — для префиксов
+        self._next_id = 0
+        self._pending = set()
+        self._loaded = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    # --- изменение индекса (под self._lock) ---
+    def _add(self, row: dict, vocab: bool = True):
+        """vocab=False — при пересборке: словарь сортируется один раз в конце, а не insort на каждое слово."""
+        uuid = row["event_uuid"]
+        old = self._ids.get(uuid)
+        if old is not None:
+            self._remove_id(old)
+        doc_id = self._next_id
+        self._next_id += 1
+        doc = SearchDoc(row, doc_terms(row))
+        self._docs[doc_id] = doc
+        self._ids[uuid] = doc_id
+        for t, w in doc.terms.items():
+            posting = self._postings.get(t)
+            if posting is None:
+                posting = self._postings[t] = {}
+                if vocab:
+                    bisect.insort(self._vocab, t)
+            posting[doc_id] = w
+
+    def _remove_id(self, doc_id: int):
+        doc = self._docs.pop(doc_id)
+        self._ids.pop(doc.uuid, None)
+        for t in doc.terms:
+            posting = self._postings.get(t)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[t]
+                i = bisect.bisect_left(self._vocab, t)
+                if i < len(self._vocab) and self._vocab[i] == t:
+                    del self._vocab[i]
+
+    def upsert(self, row: dict):
+        with self._lock:
+            self._add(row)
+
+    def remove(self, event_uuid: str):
+        with self._lock:
+            doc_id = self._ids.get(event_uuid)
+            if doc_id is not None:
+                self._remove_id(doc_id)
+
+    # --- загрузка ---
+    def rebuild(self):
+        """Полная пересборка в отдельный индекс и подмена: поиск не ждёт загрузки таблицы."""
+        fresh = SearchIndex(self.load_pages, self.load_by_uuids, self.ttl)
+        try:
+            for page in self.load_pages():
+                for row in page:
+                    fresh._add(row, vocab=False)
+        except Exception as e:
+            print("[search] rebuild error:", e)
+            return
+        fresh._vocab = sorted(fresh._postings)
+        with self._lock:
+            self._docs, self._ids = fresh._docs, fresh._ids
+            self._postings, self._vocab, self._next_id = fresh._postings, fresh._vocab, fresh._next_id
+            self._loaded = time.monotonic()
+        # события, созданные во время пересборки, дочитываем поверх
+        self._load_pending()
+
+    def _due(self) -> bool:
+        return self._loaded is None or time.monotonic() - self._loaded >= self.ttl
+
+    def _load_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        if not pending:
+            return
+        rows = self.load_by_uuids(list(pending))
+        if rows is None:
+            with self._lock:
+                self._pending |= pending
+            return
+        with self._lock:
+            for row in rows:
+                self._add(row)
+
+    def _rebuild_locked(self):
+        try:
+            if self._due():
+                self.rebuild()
+        finally:
+            self._reload_lock.release()
+
+    def _ensure(self):
+        if self._due():
+            if self._loaded is None:
+                # индекса ещё нет — ждём сборку (или ту, что уже запустил start())
+                with self._reload_lock:
+                    if self._due():
+                        self.rebuild()
+            elif self._reload_lock.acquire(blocking=False):
+                # пересборка больших каталогов — секунды; поиск тем временем отвечает по текущему индексу
+                threading.Thread(target=self._rebuild_locked, name="search-rebuild", daemon=True).start()
+            return
+        if self._pending:
+            self._load_pending()
+
+    def start(self):
+        """Первая сборка в фоне (в воркере после fork), чтобы её не ждал первый поиск."""
+        if self._loaded is None and self._reload_lock.acquire(blocking=False):
+            threading.Thread(target=self._rebuild_locked, name="search-rebuild", daemon=True).start()
+
+    # --- запрос ---
+    def _expand(self, prefix: str):
+        i = bisect.bisect_left(self._vocab, prefix)
+        out = []
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix) and len(out) < MAX_EXPANSIONS:
+            out.append(self._vocab[i])
+            i += 1
+        return out
+
+    def _term_scores(self, expanded, term: str, within=None) -> dict:
+        """
+        {id: вес} документов со словом на этот префикс; точное совпадение основы — с бонусом.
+        within — уже отобранные кандидаты: если их мало, проверяем только их, а не весь постинг.
+        """
+        scores = {}
+        if within is not None and len(within) * len(expanded) < sum(len(self._postings[t]) for t in expanded):
+            for doc_id in within:
+                best = 0.0
+                for t in expanded:
+                    w = self._postings[t].get(doc_id)
+                    if w is not None and w + (t == term) > best:
+                        best = w + (t == term)
+                if best:
+                    scores[doc_id] = best
+            return scores
+        for t in expanded:
+            bonus = 1.0 if t == term else 0.0
+            for doc_id, w in self._postings[t].items():
+                s = w + bonus
+                if scores.get(doc_id, 0.0) < s:
+                    scores[doc_id] = s
+        return scores
+
+    def search(self, query: str, limit: int = 20, published_only: bool = True, open_only: bool = True):
+        """event_uuid по убыванию релевантности (при равенстве — новые выше); все слова обязательны (AND)."""
+        self._ensure()
+        terms = list(dict.fromkeys(tokens(query)))
+        if not terms:
+            return []
+        with self._lock:
+            plan = []
+            for t in terms:
+                expanded = self._expand(t)
+                if not expanded:
+                    return []
+                plan.append((sum(len(self._postings[x]) for x in expanded), t, expanded))
+            plan.sort(key=lambda p: p[0])  # пересечение — от самого редкого слова
+            total = None
+            for _, t, expanded in plan:
+                scores = self._term_scores(expanded, t, total)
+                total = scores if total is None else {d: s + scores[d] for d, s in total.items() if d in scores}
+                if not total:
+                    return []
+            docs = self._docs
+            hits = (
+                d for d in total
+                if not (published_only and not docs[d].published) and not (open_only and docs[d].closed)
+            )
+            top = heapq.nsmallest(limit, hits, key=lambda d: (-total[d], -docs[d].created_ts))
+            return [docs[d].uuid for d in top]
+
+    # --- обновления из шины ---
+    def apply_created(self, d: dict):
+        with self._lock:
+            self._pending.add(d["event_uuid"])
+
+    def apply_closed(self, d: dict):
+        with self._lock:
+            doc_id = self._ids.get(d["event_uuid"])
+            if doc_id is not None:
+                self._docs[doc_id].closed = True
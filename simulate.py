@@ -0,0 +1,233 @@
+"""
+Офлайн-симулятор рынков x*y=k: как глубина ликвидности влияет на проскальзывание и риск платформы.
+
+    python simulate.py --liquidity 250,500,1000,2000,5000          # синтетический поток сделок
+    python simulate.py --history history --since 2024-05-01       # сделки из export_history.py
+    python simulate.py --liquidity 500,1000 --prob 0.2,0.5 --workers 4 --json
+
+Один и тот же поток сделок проигрывается сразу для всей сетки параметров: состояние — массивы
+NumPy формы (потоки, сетка), шаг по сделкам двигает все рынки одной векторной операцией. Потоки
+делятся на куски и считаются в пуле процессов.
+
+Рынок сетки: ликвидность L (= sqrt(k)) и стартовая цена ДА p0 — резервы amm.initial_reserves.
+Формулы — как в rpc_trade_buy / rpc_trade_sell (PredictionMarketAMM.sell_shares): покупка ДА на a
+чеканит a комплектов (no + a, yes = k / no), трейдер получает yes + a - yes'; продажа s долей —
+(yes + s - a) * (no - a) = k. Продажа ограничена долями, которые при этой ликвидности есть на руках.
+
+Метрики (по каждой точке сетки, усреднение по потокам):
+    impact_mean / impact_max — средний и наибольший |Δ цены ДА| за сделку;
+    swing_rate — доля сделок, сдвинувших цену больше --swing;
+    lp_loss — выплата победителям минус чистые деньги сделок (потеря платформы; у истории, где
+              исход неизвестен, — ожидание по последней цене);
+    exposure — пик наихудшей выплаты за время жизни рынка: max(ДА, НЕТ на руках) - деньги сделок.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from amm import initial_reserves
+
+CHUNK_FLOWS = 256
+METRICS = ("impact_mean", "impact_max", "swing_rate", "lp_loss", "exposure")
+
+
+def simulate(side, sell, size, yes0, no0, winner=None, swing: float = 0.05):
+    """
+    side, sell, size — (F, T): сторона (True — ДА), продажа, сумма покупки или число проданных долей
+    (size 0 — пустой шаг для выравнивания потоков разной длины). yes0, no0 — (G,) стартовые резервы.
+    winner — (F,) исход (True — ДА) или None. Возвращает {метрика: (F, G)}.
+    """
+    F, T = size.shape
+    y = np.broadcast_to(np.asarray(yes0, float), (F, len(yes0))).copy()
+    n = np.broadcast_to(np.asarray(no0, float), (F, len(no0))).copy()
+    k = y * n
+    out_yes = np.zeros_like(y)   # доли на руках трейдеров
+    out_no = np.zeros_like(y)
+    cash = np.zeros_like(y)      # покупки минус выручка продаж
+    impact_sum = np.zeros_like(y)
+    impact_max = np.zeros_like(y)
+    swings = np.zeros_like(y)
+    exposure = np.zeros_like(y)
+    trades = np.zeros((F, 1))
+    price = n / (y + n)
+    for t in range(T):
+        is_yes = side[:, t:t + 1]
+        is_sell = sell[:, t:t + 1]
+        same = np.where(is_yes, y, n)
+        other = np.where(is_yes, n, y)
+        held = np.where(is_yes, out_yes, out_no)
+        amt = np.broadcast_to(size[:, t:t + 1], y.shape)
+        # продажа: не больше долей на руках при этой ликвидности
+        s = np.where(is_sell, np.minimum(amt, held), 0.0)
+        big = same + s + other
+        got = 2 * s * other / (big + np.sqrt(np.maximum(big * big - 4 * s * other, 0.0)))
+        # покупка
+        a = np.where(is_sell, 0.0, amt)
+        other_buy = other + a
+        same_buy = k / other_buy
+        bought = same + a - same_buy
+        new_same = np.where(is_sell, same + s - got, same_buy)
+        new_other = np.where(is_sell, other - got, other_buy)
+        delta_held = np.where(is_sell, -s, bought)
+        y = np.where(is_yes, new_same, new_other)
+        n = np.where(is_yes, new_other, new_same)
+        out_yes = out_yes + np.where(is_yes, delta_held, 0.0)
+        out_no = out_no + np.where(is_yes, 0.0, delta_held)
+        cash = cash + np.where(is_sell, -got, a)
+
+        new_price = n / (y + n)
+        move = np.abs(new_price - price)
+        price = new_price
+        impact_sum += move
+        np.maximum(impact_max, move, out=impact_max)
+        swings += move > swing
+        np.maximum(exposure, np.maximum(out_yes, out_no) - cash, out=exposure)
+        trades += size[:, t:t + 1] > 0
+
+    if winner is None:
+        payout = price * out_yes + (1 - price) * out_no
+    else:
+        payout = np.where(np.asarray(winner)[:, None], out_yes, out_no)
+    trades = np.maximum(trades, 1)
+    return {
+        "impact_mean": impact_sum / trades,
+        "impact_max": impact_max,
+        "swing_rate": swings / trades,
+        "lp_loss": payout - cash,
+        "exposure": exposure,
+    }
+
+
+def _run_chunk(args):
+    return simulate(*args[:5], winner=args[5], swing=args[6])
+
+
+def synthetic_flows(flows: int, orders: int, order_size: float, informed: float, sell_rate: float, seed: int):
+    """
+    Потоки с известным исходом: у каждого своя истинная вероятность p; информированная доля
+    трейдеров покупает сторону исхода, остальные — случайную. Размеры — логнормальные со средним order_size.
+    """
+    rng = np.random.default_rng(seed)
+    p = rng.uniform(0.05, 0.95, size=flows)
+    winner = rng.random(flows) < p
+    informed_mask = rng.random((flows, orders)) < informed
+    side = np.where(informed_mask, winner[:, None], rng.random((flows, orders)) < 0.5)
+    sell = rng.random((flows, orders)) < sell_rate
+    sigma = 1.0
+    size = rng.lognormal(math.log(order_size) - sigma * sigma / 2, sigma, size=(flows, orders))
+    # продаёт тот, кто ошибся: информированные продают проигрывающую сторону
+    side = np.where(sell & informed_mask, ~winner[:, None], side)
+    return side, sell, size, winner
+
+
+def history_flows(path: str, since: str | None = None, until: str | None = None):
+    """Сделки рынков x*y=k из export_history.py, по рынку на поток, выровненные пустыми шагами."""
+    from export_history import load_history
+
+    h = load_history(path, since, until, columns=["order_id", "market_id", "side", "sell", "amount", "shares", "yes_reserve"])
+    keep = ~np.isnan(h["yes_reserve"])   # у LMSR-рынков резервов нет
+    order = np.lexsort((h["order_id"][keep], h["market_id"][keep]))
+    market = h["market_id"][keep][order]
+    side = h["side"][keep][order] == 1
+    sell = h["sell"][keep][order]
+    size = np.where(sell, h["shares"][keep][order], h["amount"][keep][order])
+    size = np.nan_to_num(size)
+    if not len(market):
+        return np.zeros((0, 0), bool), np.zeros((0, 0), bool), np.zeros((0, 0)), None
+    starts = np.flatnonzero(np.r_[True, market[1:] != market[:-1]])
+    lengths = np.diff(np.r_[starts, len(market)])
+    # потоки одного куска — близкой длины: меньше пустых шагов
+    by_len = np.argsort(-lengths, kind="stable")
+    T = int(lengths.max())
+    out_side = np.zeros((len(starts), T), bool)
+    out_sell = np.zeros((len(starts), T), bool)
+    out_size = np.zeros((len(starts), T))
+    for row, m in enumerate(by_len):
+        a, ln = starts[m], lengths[m]
+        out_side[row, :ln] = side[a:a + ln]
+        out_sell[row, :ln] = sell[a:a + ln]
+        out_size[row, :ln] = size[a:a + ln]
+    return out_side, out_sell, out_size, None
+
+
+def run_grid(side, sell, size, grid, winner=None, swing: float = 0.05, workers: int = 1, chunk: int = CHUNK_FLOWS):
+    """grid — [(ликвидность, p0)]. Возвращает {метрика: (F, G)}; куски потоков — в пуле процессов."""
+    reserves = [initial_reserves(liq, p0) for liq, p0 in grid]
+    yes0 = np.array([r[0] for r in reserves])
+    no0 = np.array([r[1] for r in reserves])
+    tasks = []
+    for i in range(0, len(size), chunk):
+        # у куска обрезаем хвост пустых шагов
+        T = int(np.max(np.flatnonzero(size[i:i + chunk].any(axis=0)), initial=-1)) + 1
+        w = winner[i:i + chunk] if winner is not None else None
+        tasks.append((side[i:i + chunk, :T], sell[i:i + chunk, :T], size[i:i + chunk, :T], yes0, no0, w, swing))
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_run_chunk, tasks))
+    else:
+        parts = [_run_chunk(t) for t in tasks]
+    return {m: np.concatenate([p[m] for p in parts]) if parts else np.zeros((0, len(grid))) for m in METRICS}
+
+
+def summarize(result, grid):
+    rows = []
+    for g, (liq, p0) in enumerate(grid):
+        row = {"liquidity": liq, "prob": p0}
+        for m in METRICS:
+            col = result[m][:, g]
+            row[m] = float(col.mean()) if len(col) else 0.0
+        row["exposure_p95"] = float(np.percentile(result["exposure"][:, g], 95)) if len(result["exposure"]) else 0.0
+        rows.append(row)
+    return rows
+
+
+def _floats(s: str):
+    return [float(x) for x in s.split(",") if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симуляция рынков x*y=k по сетке ликвидности")
+    parser.add_argument("--liquidity", default="250,500,1000,2000,5000", help="sqrt(k) через запятую")
+    parser.add_argument("--prob", default="0.5", help="стартовые цены ДА через запятую")
+    parser.add_argument("--history", help="каталог export_history.py вместо синтетики")
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    parser.add_argument("--flows", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=300)
+    parser.add_argument("--order-size", type=float, default=20.0)
+    parser.add_argument("--informed", type=float, default=0.3)
+    parser.add_argument("--sell-rate", type=float, default=0.1)
+    parser.add_argument("--swing", type=float, default=0.05, help="порог «резкого» сдвига цены за сделку")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    grid = [(liq, p0) for liq in _floats(args.liquidity) for p0 in _floats(args.prob)]
+    started = time.monotonic()
+    if args.history:
+        side, sell, size, winner = history_flows(args.history, args.since, args.until)
+    else:
+        side, sell, size, winner = synthetic_flows(args.flows, args.orders, args.order_size,
+                                                   args.informed, args.sell_rate, args.seed)
+    rows = summarize(run_grid(side, sell, size, grid, winner, args.swing, args.workers), grid)
+
+    if args.json:
+        print(json.dumps({"flows": len(size), "grid": rows}, ensure_ascii=False))
+        return
+    print(f"{'L':>8} {'p0':>5} {'impact':>8} {'max':>7} {'swing%':>7} {'lp_loss':>9} {'exposure':>9} {'exp p95':>9}")
+    for r in rows:
+        print(f"{r['liquidity']:>8g} {r['prob']:>5.2f} {r['impact_mean']:>8.4f} {r['impact_max']:>7.3f} "
+              f"{100 * r['swing_rate']:>7.2f} {r['lp_loss']:>9.1f} {r['exposure']:>9.1f} {r['exposure_p95']:>9.1f}")
+    print(f"[simulate] {len(size)} flows x {size.shape[1] if size.ndim == 2 else 0} steps, "
+          f"{len(grid)} grid points, {time.monotonic() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+-- Идемпотентность сделок (/api/market/buy и /sell): один ключ клиента = одна сделка.
+-- Строку пишут rpc_trade_idempotent и rpc_trade_buy_batch (sql/012) в транзакции самой сделки:
+-- ключ, хэш запроса (request_hash) и результат RPC появляются вместе со сделкой или не появляются вовсе.
+create table if not exists public.trade_requests (
+    chat_id    bigint      not null references public.users (chat_id) on delete cascade,
+    idem_key   text        not null check (char_length(idem_key) <= 64),
+    result     jsonb,
+    created_at timestamptz not null default now(),
+    primary key (chat_id, idem_key)
+);
+
+create index if not exists trade_requests_created_at_idx on public.trade_requests (created_at);
+
+-- Чистка старых ключей (например, из pg_cron раз в час):
+-- delete from public.trade_requests where created_at < now() - interval '1 day';
@@ -0,0 +1,57 @@
+-- Пакетное исполнение покупок по одному рынку: одна транзакция и один round trip
+-- вместо N вызовов rpc_trade_buy, каждый из которых ждёт блокировку строки рынка.
+-- Ордера применяются строго по порядку (ord) той же логикой rpc_trade_buy;
+-- ошибка одного ордера (нет баланса и т.п.) откатывает только его подтранзакцию.
+create or replace function public.rpc_trade_buy_batch(p_market_id bigint, p_orders jsonb)
+returns table (
+    ord          int,
+    ok           boolean,
+    error        text,
+    got_shares   numeric,
+    trade_price  numeric,
+    new_balance  numeric,
+    yes_price    numeric,
+    no_price     numeric,
+    yes_reserve  numeric,
+    no_reserve   numeric
+)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    o   record;
+    r   record;
+begin
+    -- блокируем рынок один раз на весь пакет
+    perform 1 from prediction_markets where id = p_market_id for update;
+
+    for o in
+        select (e.value ->> 'ord')::int          as ord,
+               (e.value ->> 'chat_id')::bigint   as chat_id,
+               (e.value ->> 'side')::text        as side,
+               (e.value ->> 'amount')::numeric   as amount
+        from jsonb_array_elements(p_orders) as e(value)
+        order by (e.value ->> 'ord')::int
+    loop
+        begin
+            select * into r
+            from rpc_trade_buy(p_chat_id => o.chat_id, p_market_id => p_market_id, p_side => o.side, p_amount => o.amount)
+            limit 1;
+            if not found then
+                return query select o.ord, false, 'rpc_failed'::text,
+                    null::numeric, null::numeric, null::numeric, null::numeric,
+                    null::numeric, null::numeric, null::numeric;
+            else
+                return query select o.ord, true, null::text,
+                    r.got_shares::numeric, r.trade_price::numeric, r.new_balance::numeric,
+                    r.yes_price::numeric, r.no_price::numeric, r.yes_reserve::numeric, r.no_reserve::numeric;
+            end if;
+        exception when others then
+            return query select o.ord, false, sqlerrm,
+                null::numeric, null::numeric, null::numeric, null::numeric,
+                null::numeric, null::numeric, null::numeric;
+        end;
+    end loop;
+end;
+$$;
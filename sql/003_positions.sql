@@ -0,0 +1,19 @@
+-- Позиции одним запросом: PostgREST встраивает prediction_markets и events по внешним ключам.
+do $$
+begin
+    if not exists (select 1 from pg_constraint where conname = 'user_shares_market_id_fkey') then
+        alter table public.user_shares
+            add constraint user_shares_market_id_fkey
+            foreign key (market_id) references public.prediction_markets (id) on delete cascade;
+    end if;
+    if not exists (select 1 from pg_constraint where conname = 'prediction_markets_event_uuid_fkey') then
+        alter table public.prediction_markets
+            add constraint prediction_markets_event_uuid_fkey
+            foreign key (event_uuid) references public.events (event_uuid) on delete cascade;
+    end if;
+end $$;
+
+-- постраничная выборка портфеля: фильтр по пользователю + сортировка по дате
+create index if not exists user_shares_user_created_idx
+    on public.user_shares (user_chat_id, created_at desc)
+    where quantity > 0;
@@ -0,0 +1,17 @@
+-- Архив сделок: keyset-пагинация по (created_at, id) и встраивание рынка по внешнему ключу.
+do $$
+begin
+    if not exists (select 1 from pg_constraint where conname = 'market_orders_market_id_fkey') then
+        alter table public.market_orders
+            add constraint market_orders_market_id_fkey
+            foreign key (market_id) references public.prediction_markets (id) on delete cascade;
+    end if;
+end $$;
+
+-- страница = range scan по индексу без сортировки и без OFFSET
+create index if not exists market_orders_user_created_id_idx
+    on public.market_orders (user_chat_id, created_at desc, id desc);
+
+-- фильтр по рынку внутри истории пользователя
+create index if not exists market_orders_user_market_created_idx
+    on public.market_orders (user_chat_id, market_id, created_at desc, id desc);
@@ -0,0 +1,143 @@
+-- Массовые действия админки: одна транзакция и один round trip на весь список chat_id.
+-- Результат — строка на каждый chat_id в порядке входа (ok / error), чтобы показать отчёт.
+
+-- Смена статуса. Переходы допускаются только из ожидаемых статусов,
+-- остальные строки возвращаются с error = 'wrong_status' и не меняются.
+create or replace function public.rpc_admin_bulk_set_status(p_chat_ids bigint[], p_action text)
+returns table (
+    chat_id     bigint,
+    ok          boolean,
+    error       text,
+    old_status  text,
+    new_status  text
+)
+language plpgsql
+security definer
+set search_path = public
+as $$
+#variable_conflict use_column
+declare
+    v_to   text;
+    v_from text[];
+begin
+    case p_action
+        when 'approve' then v_to := 'approved'; v_from := array['pending', 'rejected'];
+        when 'reject'  then v_to := 'rejected'; v_from := array['pending'];
+        when 'ban'     then v_to := 'banned';   v_from := array['pending', 'approved'];
+        when 'unban'   then v_to := 'approved'; v_from := array['banned'];
+        else raise exception 'unknown action: %', p_action;
+    end case;
+
+    return query
+    with ids as (
+        select x.chat_id, min(x.ord) as ord
+        from unnest(p_chat_ids) with ordinality as x(chat_id, ord)
+        group by x.chat_id
+    ),
+    cur as (
+        select u.chat_id, u.status::text as status
+        from users u
+        join ids on ids.chat_id = u.chat_id
+        for update of u
+    ),
+    upd as (
+        update users u
+        set status = v_to,
+            approved_at = case when v_to = 'approved' then now() else u.approved_at end
+        from cur
+        where u.chat_id = cur.chat_id and cur.status = any (v_from)
+        returning u.chat_id
+    )
+    select ids.chat_id,
+           upd.chat_id is not null,
+           case when cur.chat_id is null then 'not_found'
+                when upd.chat_id is null then 'wrong_status' end,
+           cur.status,
+           case when upd.chat_id is not null then v_to else cur.status end
+    from ids
+    left join cur on cur.chat_id = ids.chat_id
+    left join upd on upd.chat_id = ids.chat_id
+    order by ids.ord;
+end;
+$$;
+
+-- Изменение балансов через ledger. p_items = [{"chat_id": ..., "value": ...}],
+-- p_mode = 'delta' (прибавить value) или 'set' (установить баланс = value).
+-- Строки пользователей блокируются, дельта считается от заблокированного значения —
+-- без гонки read-modify-write с параллельными сделками.
+create or replace function public.rpc_admin_bulk_adjust_balance(p_items jsonb, p_mode text, p_reason text)
+returns table (
+    chat_id      bigint,
+    ok           boolean,
+    error        text,
+    old_balance  numeric,
+    new_balance  numeric,
+    delta        numeric
+)
+language plpgsql
+security definer
+set search_path = public
+as $$
+#variable_conflict use_column
+begin
+    if p_mode not in ('delta', 'set') then
+        raise exception 'unknown mode: %', p_mode;
+    end if;
+
+    return query
+    with items as (
+        -- повтор chat_id во входе: берём последнюю строку
+        select distinct on ((e.value ->> 'chat_id')::bigint)
+               (e.value ->> 'chat_id')::bigint as chat_id,
+               (e.value ->> 'value')::numeric  as val,
+               e.ord
+        from jsonb_array_elements(p_items) with ordinality as e(value, ord)
+        order by (e.value ->> 'chat_id')::bigint, e.ord desc
+    ),
+    cur as (
+        select u.chat_id, coalesce(u.balance, 0)::numeric as balance
+        from users u
+        join items on items.chat_id = u.chat_id
+        for update of u
+    ),
+    calc as (
+        select i.chat_id,
+               c.balance as old_b,
+               case when p_mode = 'set' then i.val else c.balance + i.val end as new_b
+        from items i
+        join cur c on c.chat_id = i.chat_id
+    ),
+    good as (
+        select * from calc where new_b >= 0 and new_b <> old_b
+    ),
+    led as (
+        insert into ledger (chat_id, delta, reason)
+        select g.chat_id, g.new_b - g.old_b, coalesce(nullif(p_reason, ''), 'admin_bulk_adjust')
+        from good g
+        returning ledger.chat_id
+    ),
+    upd as (
+        update users u
+        set balance = g.new_b
+        from good g
+        where u.chat_id = g.chat_id
+        returning u.chat_id
+    )
+    select i.chat_id,
+           c.chat_id is not null and c.new_b >= 0,
+           case when c.chat_id is null then 'not_found'
+                when c.new_b < 0 then 'negative_balance' end,
+           c.old_b,
+           case when c.new_b >= 0 then c.new_b else c.old_b end,
+           case when c.new_b >= 0 then c.new_b - c.old_b else 0 end
+    from items i
+    left join calc c on c.chat_id = i.chat_id
+    order by i.ord;
+end;
+$$;
+
+-- только серверный ключ (service_role), не anon/authenticated
+revoke execute on function public.rpc_admin_bulk_set_status(bigint[], text) from public, anon, authenticated;
+revoke execute on function public.rpc_admin_bulk_adjust_balance(jsonb, text, text) from public, anon, authenticated;
+grant execute on function public.rpc_admin_bulk_set_status(bigint[], text) to service_role;
+grant execute on function public.rpc_admin_bulk_adjust_balance(jsonb, text, text) to service_role;
@@ -0,0 +1,73 @@
+-- Автозакрытие событий по end_date: хранимый флаг вместо разбора дат на каждом чтении.
+alter table public.events
+    add column if not exists is_closed boolean not null default false,
+    add column if not exists closed_at timestamptz;
+
+alter table public.prediction_markets
+    add column if not exists is_closed boolean not null default false;
+
+-- то, что уже истекло до миграции
+update public.events set is_closed = true, closed_at = coalesce(closed_at, end_date)
+where not is_closed and end_date <= now();
+update public.prediction_markets pm set is_closed = true
+from public.events e
+where e.event_uuid = pm.event_uuid and e.is_closed and not pm.is_closed;
+
+-- ближайшие дедлайны открытых событий (планировщик) и выборка открытых для ленты
+create index if not exists events_open_end_date_idx
+    on public.events (end_date) where not is_closed;
+
+-- Закрывает все истёкшие события и их рынки. Идемпотентна: каждое событие вернётся ровно
+-- одному вызывающему, даже если планировщики нескольких воркеров сработали одновременно.
+create or replace function public.rpc_close_expired_events(p_now timestamptz default now())
+returns table (event_uuid text, name text, end_date timestamptz)
+language plpgsql
+security definer
+set search_path = public
+as $$
+#variable_conflict use_column
+begin
+    return query
+    with closed as (
+        update events e
+        set is_closed = true, closed_at = p_now
+        where not e.is_closed and e.end_date <= p_now
+        returning e.event_uuid, e.name, e.end_date
+    ),
+    markets as (
+        update prediction_markets pm
+        set is_closed = true
+        from closed c
+        where pm.event_uuid = c.event_uuid and not pm.is_closed
+        returning pm.id
+    )
+    select c.event_uuid::text, c.name::text, c.end_date::timestamptz from closed c;
+end;
+$$;
+
+revoke execute on function public.rpc_close_expired_events(timestamptz) from public, anon, authenticated;
+grant execute on function public.rpc_close_expired_events(timestamptz) to service_role;
+
+-- Последний рубеж: ордер по закрытому или уже истёкшему (планировщик ещё не успел) рынку
+-- откатывает всю сделку, какой бы RPC его ни писал.
+create or replace function public.market_orders_reject_closed()
+returns trigger
+language plpgsql
+as $$
+begin
+    if exists (
+        select 1
+        from prediction_markets pm
+        join events e on e.event_uuid = pm.event_uuid
+        where pm.id = new.market_id and (pm.is_closed or e.end_date <= now())
+    ) then
+        raise exception 'market_closed' using errcode = 'P0001';
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists market_orders_reject_closed on public.market_orders;
+create trigger market_orders_reject_closed
+    before insert on public.market_orders
+    for each row execute function public.market_orders_reject_closed();
@@ -0,0 +1,144 @@
+-- LMSR: совместная цена всех вариантов события (см. lmsr.py).
+-- Состояние — в строке события: lmsr_b (ликвидность) и lmsr_q (выпущено долей «ДА» по вариантам).
+-- lmsr_b is null — событие на прежних независимых рынках x*y=k.
+alter table public.events
+    add column if not exists lmsr_b numeric check (lmsr_b is null or lmsr_b > 0),
+    add column if not exists lmsr_q numeric[];
+
+-- Покупка на сумму p_amount стороны p_side варианта рынка p_market_id.
+-- Колонки результата — как у rpc_trade_buy, плюс новое lmsr_q (цены всех вариантов меняются разом).
+create or replace function public.rpc_trade_buy_lmsr(p_chat_id bigint, p_market_id bigint, p_side text, p_amount numeric)
+returns table (
+    got_shares   numeric,
+    trade_price  numeric,
+    new_balance  numeric,
+    yes_price    numeric,
+    no_price     numeric,
+    yes_reserve  numeric,
+    no_reserve   numeric,
+    lmsr_q       numeric[]
+)
+language plpgsql
+security definer
+set search_path = public
+as $$
+#variable_conflict use_column
+declare
+    v_event    text;
+    v_i        int;       -- индекс в массиве (с 1)
+    v_yes_r    numeric;
+    v_no_r     numeric;
+    v_b        numeric;
+    v_q        numeric[];
+    v_balance  numeric;
+    v_max      numeric;
+    v_lse      numeric;   -- ln(sum exp(q/b)), со сдвигом на максимум
+    v_log_p    numeric;
+    v_log_not  numeric;
+    v_x        numeric;
+    v_shares   numeric;
+    v_order_id bigint;
+    v_qty      numeric;
+    v_avg      numeric;
+begin
+    if p_amount is null or p_amount <= 0 then
+        raise exception 'bad_amount';
+    end if;
+    if p_side not in ('yes', 'no') then
+        raise exception 'bad_side';
+    end if;
+
+    select pm.event_uuid::text, pm.option_index + 1, pm.total_yes_reserve, pm.total_no_reserve
+      into v_event, v_i, v_yes_r, v_no_r
+    from prediction_markets pm
+    where pm.id = p_market_id and not pm.resolved and not pm.is_closed;
+    if not found then
+        raise exception 'market_closed';
+    end if;
+
+    -- блокируем книгу события: сделки по любым его вариантам идут по очереди
+    select e.lmsr_b, e.lmsr_q into v_b, v_q
+    from events e
+    where e.event_uuid::text = v_event
+    for update;
+    if v_b is null then
+        raise exception 'not_lmsr';
+    end if;
+
+    select u.balance into v_balance
+    from users u
+    where u.chat_id = p_chat_id and u.status = 'approved'
+    for update;
+    if not found then
+        raise exception 'user_not_found';
+    end if;
+    if v_balance < p_amount then
+        raise exception 'insufficient_balance';
+    end if;
+
+    -- log-sum-exp со сдвигом: exp не переполняется при больших q/b
+    select max(x / v_b) into v_max from unnest(v_q) as t(x);
+    select v_max + ln(sum(exp(x / v_b - v_max))) into v_lse from unnest(v_q) as t(x);
+    v_log_p := v_q[v_i] / v_b - v_lse;
+    select v_max + ln(sum(exp(x / v_b - v_max))) - v_lse into v_log_not
+    from unnest(v_q) with ordinality as t(x, n)
+    where n <> v_i;
+
+    v_x := p_amount / v_b;
+    if p_side = 'yes' then
+        -- единственный вариант (v_log_not null): цена 1, доля = сумма
+        v_shares := v_b * (v_x - v_log_p + ln(1 - coalesce(exp(v_log_not), 0) * exp(-v_x)));
+        v_q[v_i] := v_q[v_i] + v_shares;
+    else
+        if v_log_not is null then
+            raise exception 'single_outcome';
+        end if;
+        v_shares := v_b * (v_x - v_log_not + ln(1 - exp(v_log_p) * exp(-v_x)));
+        for n in 1 .. array_length(v_q, 1) loop
+            if n <> v_i then
+                v_q[n] := v_q[n] + v_shares;
+            end if;
+        end loop;
+    end if;
+    if v_shares is null or v_shares <= 0 then
+        raise exception 'zero_shares';
+    end if;
+
+    update events set lmsr_q = v_q where event_uuid::text = v_event;
+
+    update users set balance = balance - p_amount where chat_id = p_chat_id
+    returning balance into v_balance;
+
+    insert into market_orders (user_chat_id, market_id, order_type, amount, price, shares)
+    values (p_chat_id, p_market_id, 'buy_' || p_side, p_amount, p_amount / v_shares, v_shares)
+    returning id into v_order_id;
+
+    insert into ledger (chat_id, delta, reason, market_id, order_id)
+    values (p_chat_id, -p_amount, 'trade_buy', p_market_id, v_order_id);
+
+    select s.quantity, s.average_price into v_qty, v_avg
+    from user_shares s
+    where s.user_chat_id = p_chat_id and s.market_id = p_market_id and s.share_type = p_side
+    for update;
+    if found then
+        update user_shares s
+        set quantity = v_qty + v_shares,
+            average_price = (coalesce(v_avg, 0) * v_qty + p_amount) / (v_qty + v_shares)
+        where s.user_chat_id = p_chat_id and s.market_id = p_market_id and s.share_type = p_side;
+    else
+        insert into user_shares (user_chat_id, market_id, share_type, quantity, average_price)
+        values (p_chat_id, p_market_id, p_side, v_shares, p_amount / v_shares);
+    end if;
+
+    -- новая цена варианта
+    select max(x / v_b) into v_max from unnest(v_q) as t(x);
+    select v_max + ln(sum(exp(x / v_b - v_max))) into v_lse from unnest(v_q) as t(x);
+    v_log_p := v_q[v_i] / v_b - v_lse;
+
+    return query select v_shares, p_amount / v_shares, v_balance,
+        exp(v_log_p), 1 - exp(v_log_p), v_yes_r, v_no_r, v_q;
+end;
+$$;
+
+revoke execute on function public.rpc_trade_buy_lmsr(bigint, bigint, text, numeric) from public, anon, authenticated;
+grant execute on function public.rpc_trade_buy_lmsr(bigint, bigint, text, numeric) to service_role;
@@ -0,0 +1,250 @@
+-- Продажа долей обратно рынку и неттинг позиций.
+-- Раньше выйти из позиции можно было только покупкой противоположной стороны: в user_shares
+-- копились пары ДА/НЕТ по одному рынку, а market_orders, история и выплаты при резолве
+-- обрабатывали обе строки.
+
+-- C(q) = b * ln(sum exp(q / b)) со сдвигом на максимум (как в rpc_trade_buy_lmsr)
+create or replace function public.lmsr_cost(p_q numeric[], p_b numeric)
+returns numeric
+language sql
+immutable
+as $$
+    select p_b * (m.mx + ln(sum(exp(t.x / p_b - m.mx))))
+    from unnest(p_q) as t(x),
+         (select max(x / p_b) as mx from unnest(p_q) as u(x)) as m
+    group by m.mx;
+$$;
+
+-- Неттинг: пара «ДА + НЕТ» одного рынка при любом исходе стоит ровно 1, поэтому
+-- min(ДА, НЕТ) пар погашается на баланс, а обнулившаяся строка удаляется.
+-- Возвращает погашенную сумму.
+create or replace function public.net_user_shares(p_chat_id bigint, p_market_id bigint)
+returns numeric
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_yes   numeric;
+    v_no    numeric;
+    v_pairs numeric;
+begin
+    if exists (select 1 from prediction_markets where id = p_market_id and resolved) then
+        return 0;
+    end if;
+
+    perform 1 from user_shares
+    where user_chat_id = p_chat_id and market_id = p_market_id
+    for update;
+
+    select coalesce(sum(quantity) filter (where share_type = 'yes'), 0),
+           coalesce(sum(quantity) filter (where share_type = 'no'), 0)
+      into v_yes, v_no
+    from user_shares
+    where user_chat_id = p_chat_id and market_id = p_market_id;
+
+    v_pairs := least(v_yes, v_no);
+    if v_pairs <= 0 then
+        return 0;
+    end if;
+
+    update user_shares set quantity = quantity - v_pairs
+    where user_chat_id = p_chat_id and market_id = p_market_id;
+    delete from user_shares
+    where user_chat_id = p_chat_id and market_id = p_market_id and quantity <= 0;
+
+    update users set balance = balance + v_pairs where chat_id = p_chat_id;
+    insert into ledger (chat_id, delta, reason, market_id)
+    values (p_chat_id, v_pairs, 'trade_redeem', p_market_id);
+    return v_pairs;
+end;
+$$;
+
+revoke execute on function public.net_user_shares(bigint, bigint) from public, anon, authenticated;
+grant execute on function public.net_user_shares(bigint, bigint) to service_role;
+
+-- Любая покупка (rpc_trade_buy, пакет, LMSR) неттится сразу. new_balance, который вернул
+-- rpc_trade_buy, погашение не учитывает — приложение после такой покупки перечитывает пользователя.
+create or replace function public.user_shares_net()
+returns trigger
+language plpgsql
+as $$
+begin
+    -- изменения из самого неттинга (глубина > 1) не обрабатываем повторно
+    if pg_trigger_depth() = 1 and new.quantity > 0 then
+        perform net_user_shares(new.user_chat_id, new.market_id);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists user_shares_net on public.user_shares;
+create trigger user_shares_net
+    after insert or update of quantity on public.user_shares
+    for each row execute function public.user_shares_net();
+
+-- разовый неттинг накопленных пар
+do $$
+declare
+    r record;
+begin
+    for r in
+        select user_chat_id, market_id
+        from user_shares
+        where quantity > 0
+        group by user_chat_id, market_id
+        having count(distinct share_type) = 2
+    loop
+        perform net_user_shares(r.user_chat_id, r.market_id);
+    end loop;
+end $$;
+
+-- Продажа p_shares долей стороны p_side рынка p_market_id.
+-- x*y=k: доли уходят в свой пул, пул погашает a комплектов: (same + s - a) * (other - a) = k
+-- (формула — PredictionMarketAMM.sell_shares). LMSR: выручка C(q) - C(q') (LmsrBook.sell).
+-- Колонки результата — как у rpc_trade_buy_lmsr, got_amount вместо got_shares.
+create or replace function public.rpc_trade_sell(p_chat_id bigint, p_market_id bigint, p_side text, p_shares numeric)
+returns table (
+    got_amount   numeric,
+    trade_price  numeric,
+    new_balance  numeric,
+    yes_price    numeric,
+    no_price     numeric,
+    yes_reserve  numeric,
+    no_reserve   numeric,
+    lmsr_q       numeric[]
+)
+language plpgsql
+security definer
+set search_path = public
+as $$
+#variable_conflict use_column
+declare
+    v_event    text;
+    v_i        int;       -- индекс варианта в lmsr_q (с 1)
+    v_y        numeric;
+    v_n        numeric;
+    v_b        numeric;
+    v_q        numeric[];
+    v_held     numeric;
+    v_shares   numeric := p_shares;
+    v_same     numeric;
+    v_other    numeric;
+    v_big      numeric;
+    v_amount   numeric;
+    v_cost     numeric;
+    v_price    numeric;
+    v_balance  numeric;
+    v_order_id bigint;
+begin
+    if p_shares is null or p_shares <= 0 then
+        raise exception 'bad_amount';
+    end if;
+    if p_side not in ('yes', 'no') then
+        raise exception 'bad_side';
+    end if;
+
+    -- порядок блокировок как у покупок: книга события (LMSR, как rpc_trade_buy_lmsr), рынок,
+    -- пользователь, доли. Рынок — for no key update: он совместим с FOR KEY SHARE, который берёт
+    -- FK market_orders → prediction_markets при вставке сделки параллельной LMSR-покупкой
+    select pm.event_uuid::text into v_event from prediction_markets pm where pm.id = p_market_id;
+    if not found then
+        raise exception 'market_closed';
+    end if;
+
+    select e.lmsr_b into v_b from events e where e.event_uuid::text = v_event;
+    if v_b is not null then
+        select e.lmsr_q into v_q from events e where e.event_uuid::text = v_event for update;
+    end if;
+
+    select pm.option_index + 1, pm.total_yes_reserve, pm.total_no_reserve
+      into v_i, v_y, v_n
+    from prediction_markets pm
+    where pm.id = p_market_id and not pm.resolved and not pm.is_closed
+    for no key update;
+    if not found then
+        raise exception 'market_closed';
+    end if;
+
+    select u.balance into v_balance
+    from users u
+    where u.chat_id = p_chat_id and u.status = 'approved'
+    for update;
+    if not found then
+        raise exception 'user_not_found';
+    end if;
+
+    select s.quantity into v_held
+    from user_shares s
+    where s.user_chat_id = p_chat_id and s.market_id = p_market_id and s.share_type = p_side
+    for update;
+    -- «продать всё» с клиента приходит во float: хвост в пределах 1e-9 считаем всей позицией
+    if found and v_shares > v_held and v_shares - v_held < 1e-9 then
+        v_shares := v_held;
+    end if;
+    if not found or v_held < v_shares then
+        raise exception 'insufficient_shares';
+    end if;
+
+    if v_b is null then
+        if p_side = 'yes' then
+            v_same := v_y; v_other := v_n;
+        else
+            v_same := v_n; v_other := v_y;
+        end if;
+        v_big := v_same + v_shares + v_other;
+        v_amount := 2 * v_shares * v_other / (v_big + sqrt(v_big * v_big - 4 * v_shares * v_other));
+        if p_side = 'yes' then
+            v_y := v_same + v_shares - v_amount; v_n := v_other - v_amount;
+        else
+            v_n := v_same + v_shares - v_amount; v_y := v_other - v_amount;
+        end if;
+        update prediction_markets
+        set total_yes_reserve = v_y, total_no_reserve = v_n
+        where id = p_market_id;
+        v_price := v_n / (v_y + v_n);
+    else
+        v_cost := lmsr_cost(v_q, v_b);
+        if p_side = 'yes' then
+            v_q[v_i] := v_q[v_i] - v_shares;
+        else
+            for n in 1 .. array_length(v_q, 1) loop
+                if n <> v_i then
+                    v_q[n] := v_q[n] - v_shares;
+                end if;
+            end loop;
+        end if;
+        v_amount := v_cost - lmsr_cost(v_q, v_b);
+        update events set lmsr_q = v_q where event_uuid::text = v_event;
+        v_price := exp(v_q[v_i] / v_b - lmsr_cost(v_q, v_b) / v_b);
+    end if;
+    if v_amount is null or v_amount <= 0 then
+        raise exception 'zero_amount';
+    end if;
+
+    update users set balance = balance + v_amount where chat_id = p_chat_id
+    returning balance into v_balance;
+
+    insert into market_orders (user_chat_id, market_id, order_type, amount, price, shares)
+    values (p_chat_id, p_market_id, 'sell_' || p_side, v_amount, v_amount / v_shares, v_shares)
+    returning id into v_order_id;
+
+    insert into ledger (chat_id, delta, reason, market_id, order_id)
+    values (p_chat_id, v_amount, 'trade_sell', p_market_id, v_order_id);
+
+    -- средняя цена оставшихся долей не меняется; пустая позиция удаляется
+    if v_held - v_shares <= 0 then
+        delete from user_shares s
+        where s.user_chat_id = p_chat_id and s.market_id = p_market_id and s.share_type = p_side;
+    else
+        update user_shares s set quantity = v_held - v_shares
+        where s.user_chat_id = p_chat_id and s.market_id = p_market_id and s.share_type = p_side;
+    end if;
+
+    return query select v_amount, v_amount / v_shares, v_balance,
+        v_price, 1 - v_price, v_y, v_n, v_q;
+end;
+$$;
+
+revoke execute on function public.rpc_trade_sell(bigint, bigint, text, numeric) from public, anon, authenticated;
+grant execute on function public.rpc_trade_sell(bigint, bigint, text, numeric) to service_role;
@@ -0,0 +1,134 @@
+-- Агрегаты рынков, которые ведутся на каждую сделку, а не считаются сканированием market_orders:
+-- объём и число сделок, уникальные трейдеры, открытый интерес (доли на руках) и часовые
+-- корзины объёма для скользящих 24 часов. Приложение встраивает их в выборку рынков (marketstats.py).
+create table if not exists public.market_stats (
+    market_id  bigint      primary key references public.prediction_markets (id) on delete cascade,
+    volume     numeric     not null default 0,   -- сумма amount покупок и продаж
+    orders     int         not null default 0,
+    traders    int         not null default 0,
+    open_yes   numeric     not null default 0,
+    open_no    numeric     not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+create table if not exists public.market_volume_hourly (
+    market_id bigint      not null references public.prediction_markets (id) on delete cascade,
+    bucket    timestamptz not null,              -- date_trunc('hour', created_at)
+    volume    numeric     not null default 0,
+    primary key (market_id, bucket)
+);
+
+-- Чистка старых корзин (приложению нужны только последние сутки), например из pg_cron:
+-- delete from public.market_volume_hourly where bucket < now() - interval '7 days';
+
+-- Сделка: объём, число сделок, корзина часа и — если это первая сделка пользователя на рынке — трейдер.
+-- Строка рынка уже заблокирована сделкой (или книга LMSR-события), так что счётчики не гоняются.
+create or replace function public.market_stats_on_order()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_new int := 0;
+begin
+    if not exists (
+        select 1 from market_orders o
+        where o.user_chat_id = new.user_chat_id and o.market_id = new.market_id and o.id <> new.id
+    ) then
+        v_new := 1;
+    end if;
+
+    insert into market_stats as s (market_id, volume, orders, traders)
+    values (new.market_id, new.amount, 1, v_new)
+    on conflict (market_id) do update
+    set volume = s.volume + excluded.volume,
+        orders = s.orders + 1,
+        traders = s.traders + excluded.traders,
+        updated_at = now();
+
+    insert into market_volume_hourly as h (market_id, bucket, volume)
+    values (new.market_id, date_trunc('hour', coalesce(new.created_at, now())), new.amount)
+    on conflict (market_id, bucket) do update
+    set volume = h.volume + excluded.volume;
+    return null;
+end;
+$$;
+
+-- Открытый интерес: любое изменение user_shares (покупка, продажа, неттинг, выплаты).
+create or replace function public.market_stats_on_shares()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_market bigint;
+    v_side   text;
+    v_delta  numeric;
+begin
+    if tg_op = 'DELETE' then
+        v_market := old.market_id; v_side := old.share_type; v_delta := -old.quantity;
+    elsif tg_op = 'INSERT' then
+        v_market := new.market_id; v_side := new.share_type; v_delta := new.quantity;
+    else
+        v_market := new.market_id; v_side := new.share_type; v_delta := new.quantity - old.quantity;
+    end if;
+    if coalesce(v_delta, 0) = 0 then
+        return null;
+    end if;
+
+    insert into market_stats as s (market_id, open_yes, open_no)
+    values (v_market,
+            case when v_side = 'yes' then v_delta else 0 end,
+            case when v_side = 'no' then v_delta else 0 end)
+    on conflict (market_id) do update
+    set open_yes = s.open_yes + excluded.open_yes,
+        open_no = s.open_no + excluded.open_no,
+        updated_at = now();
+    return null;
+end;
+$$;
+
+-- Триггеры и разовый пересчёт из истории — одной транзакцией: блокировка до commit не пускает
+-- сделки между созданием триггеров и пересчётом (иначе такая сделка попала бы в счётчики дважды).
+-- share row exclusive — тот же режим, что берёт create trigger, без повышения блокировки.
+begin;
+
+lock table public.market_orders, public.user_shares in share row exclusive mode;
+
+drop trigger if exists market_stats_on_order on public.market_orders;
+create trigger market_stats_on_order
+    after insert on public.market_orders
+    for each row execute function public.market_stats_on_order();
+
+drop trigger if exists market_stats_on_shares on public.user_shares;
+create trigger market_stats_on_shares
+    after insert or update of quantity or delete on public.user_shares
+    for each row execute function public.market_stats_on_shares();
+
+insert into public.market_stats as s (market_id, volume, orders, traders, open_yes, open_no)
+select pm.id,
+       coalesce(o.volume, 0), coalesce(o.orders, 0), coalesce(o.traders, 0),
+       coalesce(sh.open_yes, 0), coalesce(sh.open_no, 0)
+from public.prediction_markets pm
+left join (
+    select market_id, sum(amount) as volume, count(*) as orders, count(distinct user_chat_id) as traders
+    from public.market_orders
+    group by market_id
+) o on o.market_id = pm.id
+left join (
+    select market_id,
+           sum(quantity) filter (where share_type = 'yes') as open_yes,
+           sum(quantity) filter (where share_type = 'no') as open_no
+    from public.user_shares
+    group by market_id
+) sh on sh.market_id = pm.id
+on conflict (market_id) do update
+set volume = excluded.volume, orders = excluded.orders, traders = excluded.traders,
+    open_yes = excluded.open_yes, open_no = excluded.open_no, updated_at = now();
+
+insert into public.market_volume_hourly as h (market_id, bucket, volume)
+select market_id, date_trunc('hour', created_at), sum(amount)
+from public.market_orders
+where created_at >= date_trunc('hour', now()) - interval '24 hours'
+group by market_id, date_trunc('hour', created_at)
+on conflict (market_id, bucket) do update set volume = excluded.volume;
+
+commit;
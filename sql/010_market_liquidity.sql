@@ -0,0 +1,12 @@
+-- Ликвидность рынка — параметр события, а не константа 1000/1000: стартовые резервы хранятся
+-- в строке рынка (create_event_with_markets считает их через amm.initial_reserves из ликвидности
+-- sqrt(k) и стартовой цены ДА). По ним проигрывается история цены (/api/market/history, export_history.py).
+alter table public.prediction_markets
+    add column if not exists initial_yes_reserve numeric check (initial_yes_reserve is null or initial_yes_reserve > 0),
+    add column if not exists initial_no_reserve  numeric check (initial_no_reserve is null or initial_no_reserve > 0);
+
+-- Существующие рынки создавались с равными резервами sqrt(k)/sqrt(k).
+update public.prediction_markets
+set initial_yes_reserve = sqrt(constant_product),
+    initial_no_reserve  = sqrt(constant_product)
+where initial_yes_reserve is null and constant_product > 0;
@@ -0,0 +1,122 @@
+-- Атомарное изменение баланса: блокировка строки пользователя, ledger и users — в одной транзакции
+-- внутри одного вызова, без блокировок между round trip'ами. p_expected (не null) — compare-and-set:
+-- изменение применяется, только если баланс всё ещё равен тому, что видел вызывающий. Баланс
+-- приходит из формы через JSON как float, поэтому сравнение — с допуском 1e-9 (относительным
+-- для балансов больше 1): точное numeric-сравнение не сходилось бы у любого, кто торговал.
+-- p_mode = 'delta' (прибавить p_value) или 'set' (установить баланс = p_value).
+
+-- Общая часть для одиночного и массового RPC; вызывать из своей транзакции.
+create or replace function public.adjust_user_balance(
+    p_chat_id bigint, p_mode text, p_value numeric, p_expected numeric, p_reason text,
+    out ok boolean, out error text, out old_balance numeric, out new_balance numeric, out delta numeric
+)
+language plpgsql
+set search_path = public
+as $$
+begin
+    if p_mode not in ('delta', 'set') then
+        raise exception 'unknown mode: %', p_mode;
+    end if;
+
+    select coalesce(u.balance, 0)::numeric into old_balance
+    from users u where u.chat_id = p_chat_id
+    for update;
+    if not found then
+        ok := false; error := 'not_found'; delta := 0;
+        return;
+    end if;
+    new_balance := old_balance; delta := 0;
+
+    if p_expected is not null and abs(old_balance - p_expected) > 1e-9 * greatest(1, abs(old_balance)) then
+        ok := false; error := 'balance_changed';
+        return;
+    end if;
+
+    new_balance := case when p_mode = 'set' then p_value else old_balance + p_value end;
+    if new_balance < 0 then
+        ok := false; error := 'negative_balance'; new_balance := old_balance;
+        return;
+    end if;
+
+    ok := true;
+    delta := new_balance - old_balance;
+    if delta <> 0 then
+        insert into ledger (chat_id, delta, reason) values (p_chat_id, delta, coalesce(nullif(p_reason, ''), 'admin_adjust'));
+        update users set balance = new_balance where chat_id = p_chat_id;
+    end if;
+end;
+$$;
+
+create or replace function public.rpc_adjust_balance(
+    p_chat_id bigint, p_mode text, p_value numeric, p_expected numeric default null, p_reason text default 'admin_adjust'
+)
+returns table (ok boolean, error text, old_balance numeric, new_balance numeric, delta numeric)
+language sql
+security definer
+set search_path = public
+as $$
+    select a.ok, a.error, a.old_balance, a.new_balance, a.delta
+    from adjust_user_balance(p_chat_id, p_mode, p_value, p_expected, p_reason) a;
+$$;
+
+-- Массовый вариант (sql/005) на той же функции. Строки блокируются заранее в порядке chat_id:
+-- два пересекающихся списка не ждут друг друга крест-накрест (дедлок). Элемент может нести
+-- "expected" — compare-and-set для этой строки; остальные строки списка это не останавливает.
+create or replace function public.rpc_admin_bulk_adjust_balance(p_items jsonb, p_mode text, p_reason text)
+returns table (
+    chat_id      bigint,
+    ok           boolean,
+    error        text,
+    old_balance  numeric,
+    new_balance  numeric,
+    delta        numeric
+)
+language plpgsql
+security definer
+set search_path = public
+as $$
+#variable_conflict use_column
+declare
+    v_ids bigint[];
+    v_vals numeric[];
+    v_expected numeric[];
+    v_res record;
+begin
+    if p_mode not in ('delta', 'set') then
+        raise exception 'unknown mode: %', p_mode;
+    end if;
+
+    -- повтор chat_id во входе: берём последнюю строку; порядок ответа — порядок входа
+    select array_agg(x.chat_id order by x.ord), array_agg(x.val order by x.ord), array_agg(x.expected order by x.ord)
+    into v_ids, v_vals, v_expected
+    from (
+        select distinct on ((e.value ->> 'chat_id')::bigint)
+               (e.value ->> 'chat_id')::bigint as chat_id,
+               (e.value ->> 'value')::numeric  as val,
+               (e.value ->> 'expected')::numeric as expected,
+               e.ord
+        from jsonb_array_elements(p_items) with ordinality as e(value, ord)
+        order by (e.value ->> 'chat_id')::bigint, e.ord desc
+    ) x;
+
+    perform 1 from users u
+    where u.chat_id = any (v_ids)
+    order by u.chat_id
+    for update of u;
+
+    for i in 1 .. coalesce(array_length(v_ids, 1), 0) loop
+        select * into v_res
+        from adjust_user_balance(v_ids[i], p_mode, v_vals[i], v_expected[i],
+                                 coalesce(nullif(p_reason, ''), 'admin_bulk_adjust'));
+        chat_id := v_ids[i];
+        ok := v_res.ok; error := v_res.error;
+        old_balance := v_res.old_balance; new_balance := v_res.new_balance; delta := v_res.delta;
+        return next;
+    end loop;
+end;
+$$;
+
+-- только серверный ключ (service_role), не anon/authenticated
+revoke execute on function public.adjust_user_balance(bigint, text, numeric, numeric, text) from public, anon, authenticated;
+revoke execute on function public.rpc_adjust_balance(bigint, text, numeric, numeric, text) from public, anon, authenticated;
+grant execute on function public.rpc_adjust_balance(bigint, text, numeric, numeric, text) to service_role;
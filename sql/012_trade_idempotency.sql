@@ -0,0 +1,160 @@
+-- Идемпотентность сделок в транзакции самой сделки (вместо sql/001 «занять ключ → RPC → записать ответ»
+-- тремя запросами). Ключ, хэш тела запроса и строка результата RPC пишутся вместе со сделкой:
+--   * сделка откатилась — ключа нет, повтор исполняет её заново;
+--   * сделка закоммичена, а ответ потерян (таймаут, 500) — повтор получает её настоящий результат;
+--   * параллельный дубль ждёт на уникальном ключе, пока первая транзакция не завершится.
+-- Тот же ключ с другим телом запроса — ошибка idempotency_key_reused, а не чужой результат.
+alter table public.trade_requests
+    add column if not exists request_hash text;
+
+-- Занять ключ в текущей транзакции. null — ключ новый, сделку исполнять; иначе — сохранённый результат.
+create or replace function public.trade_request_begin(p_chat_id bigint, p_key text, p_hash text)
+returns jsonb
+language plpgsql
+set search_path = public
+as $$
+declare
+    v_row trade_requests%rowtype;
+begin
+    insert into trade_requests (chat_id, idem_key, request_hash)
+    values (p_chat_id, p_key, p_hash)
+    on conflict do nothing;
+    if found then
+        return null;
+    end if;
+
+    select * into v_row from trade_requests where chat_id = p_chat_id and idem_key = p_key;
+    -- у строк прежней схемы хэша нет — сверять не с чем
+    if v_row.request_hash is not null and v_row.request_hash <> p_hash then
+        raise exception 'idempotency_key_reused';
+    end if;
+    if v_row.result is null then
+        -- строка без результата — только от прежней схемы (sql/001), где ключ занимался заранее
+        raise exception 'in_progress';
+    end if;
+    return v_row.result;
+end;
+$$;
+
+create or replace function public.trade_request_finish(p_chat_id bigint, p_key text, p_result jsonb)
+returns void
+language sql
+set search_path = public
+as $$
+    update trade_requests set result = p_result where chat_id = p_chat_id and idem_key = p_key;
+$$;
+
+-- Сделка с ключом: p_kind = 'buy' | 'buy_lmsr' | 'sell', p_value — сумма покупки или число долей.
+-- result — строка соответствующего RPC (jsonb), replayed — результат взят из прошлого вызова.
+create or replace function public.rpc_trade_idempotent(
+    p_chat_id bigint, p_key text, p_hash text, p_kind text, p_market_id bigint, p_side text, p_value numeric
+)
+returns table (replayed boolean, result jsonb)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_res jsonb;
+begin
+    v_res := trade_request_begin(p_chat_id, p_key, p_hash);
+    if v_res is not null then
+        return query select true, v_res;
+        return;
+    end if;
+
+    case p_kind
+        when 'buy' then
+            select to_jsonb(r) into v_res from rpc_trade_buy(p_chat_id, p_market_id, p_side, p_value) r limit 1;
+        when 'buy_lmsr' then
+            select to_jsonb(r) into v_res from rpc_trade_buy_lmsr(p_chat_id, p_market_id, p_side, p_value) r limit 1;
+        when 'sell' then
+            select to_jsonb(r) into v_res from rpc_trade_sell(p_chat_id, p_market_id, p_side, p_value) r limit 1;
+        else
+            raise exception 'unknown kind: %', p_kind;
+    end case;
+    if v_res is null then
+        raise exception 'rpc_failed';
+    end if;
+
+    perform trade_request_finish(p_chat_id, p_key, v_res);
+    return query select false, v_res;
+end;
+$$;
+
+-- Пакет покупок (sql/002) с теми же ключами: ордер может нести idem_key и request_hash.
+-- Ключ занимается в подтранзакции ордера — отклонённый ордер освобождает его вместе с откатом.
+-- Повтор уже исполненного ордера — ok с error = 'replayed' (сделку второй раз не публикуют).
+create or replace function public.rpc_trade_buy_batch(p_market_id bigint, p_orders jsonb)
+returns table (
+    ord          int,
+    ok           boolean,
+    error        text,
+    got_shares   numeric,
+    trade_price  numeric,
+    new_balance  numeric,
+    yes_price    numeric,
+    no_price     numeric,
+    yes_reserve  numeric,
+    no_reserve   numeric
+)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    o     record;
+    r     record;
+    v_res jsonb;
+    v_replayed boolean;
+begin
+    -- блокируем рынок один раз на весь пакет
+    perform 1 from prediction_markets where id = p_market_id for update;
+
+    for o in
+        select (e.value ->> 'ord')::int          as ord,
+               (e.value ->> 'chat_id')::bigint   as chat_id,
+               (e.value ->> 'side')::text        as side,
+               (e.value ->> 'amount')::numeric   as amount,
+               (e.value ->> 'idem_key')::text    as idem_key,
+               (e.value ->> 'request_hash')::text as request_hash
+        from jsonb_array_elements(p_orders) as e(value)
+        order by (e.value ->> 'ord')::int
+    loop
+        begin
+            v_res := null;
+            if o.idem_key is not null then
+                v_res := trade_request_begin(o.chat_id, o.idem_key, o.request_hash);
+            end if;
+            v_replayed := v_res is not null;
+            if v_res is null then
+                select * into r
+                from rpc_trade_buy(p_chat_id => o.chat_id, p_market_id => p_market_id, p_side => o.side, p_amount => o.amount)
+                limit 1;
+                if not found then
+                    raise exception 'rpc_failed';
+                end if;
+                v_res := to_jsonb(r);
+                if o.idem_key is not null then
+                    perform trade_request_finish(o.chat_id, o.idem_key, v_res);
+                end if;
+            end if;
+            return query select o.ord, true, case when v_replayed then 'replayed' end,
+                (v_res ->> 'got_shares')::numeric, (v_res ->> 'trade_price')::numeric,
+                (v_res ->> 'new_balance')::numeric, (v_res ->> 'yes_price')::numeric,
+                (v_res ->> 'no_price')::numeric, (v_res ->> 'yes_reserve')::numeric,
+                (v_res ->> 'no_reserve')::numeric;
+        exception when others then
+            return query select o.ord, false, sqlerrm,
+                null::numeric, null::numeric, null::numeric, null::numeric,
+                null::numeric, null::numeric, null::numeric;
+        end;
+    end loop;
+end;
+$$;
+
+-- только серверный ключ (service_role), не anon/authenticated
+revoke execute on function public.trade_request_begin(bigint, text, text) from public, anon, authenticated;
+revoke execute on function public.trade_request_finish(bigint, text, jsonb) from public, anon, authenticated;
+revoke execute on function public.rpc_trade_idempotent(bigint, text, text, text, bigint, text, numeric) from public, anon, authenticated;
+grant execute on function public.rpc_trade_idempotent(bigint, text, text, text, bigint, text, numeric) to service_role;
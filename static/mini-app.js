@@ -0,0 +1,344 @@
+(function () {
+  'use strict';
+
+  const tg = window.Telegram && window.Telegram.WebApp;
+  if (tg) { tg.ready(); tg.expand(); }
+
+  const qs = new URLSearchParams(location.search);
+  const AUTH = { chat_id: qs.get('chat_id'), sig: qs.get('sig') };
+  const AUTH_QS = 'chat_id=' + encodeURIComponent(AUTH.chat_id || '') + '&sig=' + encodeURIComponent(AUTH.sig || '');
+
+  const $ = (id) => document.getElementById(id);
+  const esc = (s) => String(s == null ? '' : s).replace(/[&<>"']/g, (c) => ({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+  }[c]));
+  const pct = (p) => Math.round((p || 0) * 100) + '%';
+  const num = (x) => (Math.round((x || 0) * 100) / 100).toFixed(2);
+
+  async function api(path, body) {
+    const sep = path.indexOf('?') >= 0 ? '&' : '?';
+    const opts = body
+      ? { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(Object.assign({}, AUTH, body)) }
+      : {};
+    const r = await fetch(path + (body ? '' : sep + AUTH_QS), opts);
+    return r.json();
+  }
+
+  // ---- закладки (localStorage) ----
+  const BM_KEY = 'bm:' + AUTH.chat_id;
+  let bookmarks = new Set();
+  try { bookmarks = new Set(JSON.parse(localStorage.getItem(BM_KEY) || '[]')); } catch (e) { /* пусто */ }
+  function toggleBookmark(uuid) {
+    if (bookmarks.has(uuid)) bookmarks.delete(uuid); else bookmarks.add(uuid);
+    try { localStorage.setItem(BM_KEY, JSON.stringify(Array.from(bookmarks))); } catch (e) { /* квота */ }
+    renderAll();
+  }
+
+  // ---- состояние ----
+  const state = { events: [], byUuid: {}, me: null, portfolio: null, buy: null,
+    feed: { sort: 'trending', tag: '', next: null, tags: [], q: '' }, bmEvents: null,
+    trades: { items: [], next: null, latest: null } };
+
+  function unpackEvents(data) {
+    const fields = data.market_fields || [];
+    return (data.events || []).map((e) => {
+      const markets = {};
+      (e.markets || []).forEach((row) => {
+        const m = {};
+        fields.forEach((f, i) => { m[f] = row[i]; });
+        markets[m.option_index] = m;
+      });
+      e.markets = markets;
+      return e;
+    });
+  }
+
+  function only(id) { const el = $(id); return !!(el && el.checked); }
+
+  function renderEvents() {
+    const now = Date.now() / 1000;
+    // закладки могут быть не на загруженных страницах ленты — их список грузится отдельно
+    const source = only('bm-events') && state.bmEvents ? state.bmEvents : state.events;
+    const list = source.filter((e) => !e.end_ts || e.end_ts > now)
+      .filter((e) => !only('bm-events') || bookmarks.has(e.event_uuid));
+    $('events').innerHTML = list.length ? list.map((e) => `
+      <div class="ev">
+        <div class="head">
+          <span class="name">${esc(e.name)}</span>
+          <button class="bm" data-bm="${esc(e.event_uuid)}">${bookmarks.has(e.event_uuid) ? '★' : '☆'}</button>
+        </div>
+        <div class="muted">до ${esc(e.end_short)} · объём ${num(e.total_volume)} · за 24ч ${num(e.volume_24h)}${(e.tags || []).length ? ' · ' + e.tags.map(esc).join(', ') : ''}</div>
+        ${(e.options || []).map((text, idx) => {
+          const m = e.markets[idx] || {};
+          const closed = m.resolved;
+          return `<div class="opt">
+            <span>${esc(text)} <b>${pct(m.yes_price)}</b></span>
+            <span>${closed ? '<span class="muted">закрыт</span>' : `
+              <button class="yes" data-buy="${esc(e.event_uuid)}|${idx}|yes">ДА</button>
+              <button class="no" data-buy="${esc(e.event_uuid)}|${idx}|no">НЕТ</button>`}</span>
+          </div>`;
+        }).join('')}
+      </div>`).join('') : '<div class="muted">Нет мероприятий</div>';
+    $('events-more').classList.toggle('hidden', !state.feed.next || only('bm-events'));
+    document.querySelectorAll('[data-sort]').forEach((b) => b.classList.toggle('sel', b.dataset.sort === state.feed.sort));
+  }
+
+  function optionLabel(p) {
+    if (p.event_name) return esc(p.event_name) + (p.option_text ? ' · ' + esc(p.option_text) : '');
+    const e = state.byUuid[p.event_uuid];
+    const opt = e && e.options ? e.options[p.option_index] : null;
+    return esc(e ? e.name : p.event_uuid) + (opt ? ' · ' + esc(opt) : '');
+  }
+
+  function renderActive() {
+    if (!state.portfolio) return;
+    const list = state.portfolio.filter((p) => !p.resolved)
+      .filter((p) => !only('bm-active') || bookmarks.has(p.event_uuid));
+    $('active').innerHTML = list.length ? list.map((p) => `
+      <div class="row">${optionLabel(p)} — ${p.share_type === 'yes' ? 'ДА' : 'НЕТ'}
+        ${num(p.quantity)} шт. по ${num(p.avg_price)}${p.value != null
+          ? ` · сейчас ${num(p.value)} (${p.pnl >= 0 ? '+' : ''}${num(p.pnl)})` : ''}
+        <button data-sell="${esc([p.event_uuid, p.option_index, p.share_type, p.quantity].join('|'))}">Продать</button></div>`).join('')
+      : '<div class="muted">Нет активных ставок</div>';
+  }
+
+  function renderArchive() {
+    if (!state.portfolio) return;
+    // резолвнутые позиции — из того же портфеля (/api/me/positions), что и активные
+    const list = state.portfolio.filter((p) => p.resolved)
+      .filter((p) => !only('bm-archive') || bookmarks.has(p.event_uuid));
+    $('archive').innerHTML = list.length ? list.map((p) => `
+      <div class="row">${optionLabel(p)} — ${p.share_type === 'yes' ? 'ДА' : 'НЕТ'}
+        ${num(p.quantity)} шт. · ${p.winner_side === p.share_type ? 'выигрыш' : 'проигрыш'}</div>`).join('') : '<div class="muted">Архив пуст</div>';
+  }
+
+  function renderTrades() {
+    const t = state.trades;
+    $('trades').innerHTML = t.items.length ? t.items.map((o) => `
+      <div class="row">${optionLabel(o)} — ${/^sell_/.test(o.order_type) ? 'продажа ' : ''}${/yes/.test(o.order_type) ? 'ДА' : 'НЕТ'}
+        ${num(o.shares)} шт. за ${num(o.amount)} <span class="muted">${esc((o.created_at || '').slice(0, 16).replace('T', ' '))}</span></div>`).join('')
+      : '<div class="muted">Сделок пока нет</div>';
+    $('trades-more').classList.toggle('hidden', !t.next);
+  }
+
+  function renderMe() {
+    const me = state.me;
+    if (!me || !me.user) return;
+    $('login').textContent = me.user.login || '—';
+    $('balance').textContent = num(me.user.balance);
+  }
+
+  function renderAll() { renderEvents(); renderActive(); renderArchive(); renderTrades(); renderMe(); }
+
+  // ---- загрузка ----
+  function remember(events) { events.forEach((e) => { state.byUuid[e.event_uuid] = e; }); return events; }
+
+  // первый экран ленты приходит с bootstrap, дальше — /api/events по курсору
+  async function loadEvents() {
+    const data = await api('/api/mini-app/bootstrap');
+    if (!data.success) { $('events').textContent = 'Ошибка загрузки'; return; }
+    state.events = remember(unpackEvents(data));
+    state.feed.next = data.next_cursor;
+    state.feed.tags = data.tags || [];
+    $('ev-tag').innerHTML = '<option value="">все темы</option>' +
+      state.feed.tags.map((t) => `<option value="${esc(t)}">${esc(t)}</option>`).join('');
+  }
+
+  async function loadFeed(more) {
+    const f = state.feed;
+    if (f.q) { f.q = ''; $('ev-search').value = ''; }
+    let path = '/api/events?sort=' + f.sort + (f.tag ? '&tag=' + encodeURIComponent(f.tag) : '');
+    if (more && f.next) path += '&cursor=' + encodeURIComponent(f.next);
+    const data = await api(path);
+    if (!data.success) return;
+    const events = remember(unpackEvents(data));
+    state.events = more ? state.events.concat(events) : events;
+    f.next = data.next_cursor;
+    renderEvents();
+    subscribePrices();
+  }
+
+  // поиск заменяет ленту результатами (без пагинации); пустой запрос возвращает ленту
+  async function searchEvents(q) {
+    const f = state.feed;
+    if (q.length < 2) { if (f.q) loadFeed(false); return; }
+    const data = await api('/api/events/search?q=' + encodeURIComponent(q));
+    if (!data.success || $('ev-search').value.trim() !== q) return;  // ответ на устаревший запрос
+    f.q = q;
+    state.events = remember(unpackEvents(data));
+    f.next = null;
+    renderEvents();
+    subscribePrices();
+  }
+
+  async function loadBookmarked() {
+    const ids = Array.from(bookmarks).slice(0, 50);
+    if (!ids.length) { state.bmEvents = []; return; }
+    const data = await api('/api/events?ids=' + encodeURIComponent(ids.join(',')));
+    if (data.success) state.bmEvents = remember(unpackEvents(data));
+  }
+
+  async function loadMe() {
+    const [data, pf] = await Promise.all([api('/api/me'), api('/api/me/positions?limit=100')]);
+    if (data.success) state.me = data;
+    if (pf.success) state.portfolio = pf.positions;
+  }
+
+  // история сделок: курсоры вместо offset — страницы не съезжают, когда появляются новые сделки
+  async function loadTrades(mode) {
+    const t = state.trades;
+    let path = '/api/me/archive?limit=20';
+    if (mode === 'more' && t.next) path += '&cursor=' + encodeURIComponent(t.next);
+    else if (mode === 'new' && t.latest) path = '/api/me/archive?limit=100&since=' + encodeURIComponent(t.latest);
+    const data = await api(path);
+    if (!data.success) return;
+    if (mode === 'more') {
+      t.items = t.items.concat(data.items);
+      t.next = data.next_cursor;
+    } else if (mode === 'new' && t.latest) {
+      // since отдаёт по возрастанию; если новых больше страницы — проще перечитать первую
+      if (data.has_more) return loadTrades();
+      t.items = data.items.slice().reverse().concat(t.items);
+      t.latest = data.latest_cursor;
+    } else {
+      t.items = data.items;
+      t.next = data.next_cursor;
+      t.latest = data.latest_cursor;
+    }
+  }
+
+  async function loadLeaders(period) {
+    $('leaders').textContent = 'Загрузка...';
+    const data = await fetch('/api/leaderboard?period=' + encodeURIComponent(period)).then((r) => r.json());
+    const items = data.items || [];
+    $('leaders').innerHTML = '<div class="muted">' + esc((data.week || {}).label || '') + '</div>' +
+      (items.length ? items.map((it, i) => `<div class="row">${i + 1}. ${esc(it.login)} — ${num(it.payouts)}</div>`).join('')
+        : '<div class="muted">Пока пусто</div>');
+  }
+
+  // ---- покупка ----
+  function openBuy(key) {
+    const [uuid, idx, side] = key.split('|');
+    state.buy = { event_uuid: uuid, option_index: Number(idx), side: side };
+    const e = state.byUuid[uuid];
+    $('buy-title').textContent = (e ? e.name : '') + ' — ' + (side === 'yes' ? 'ДА' : 'НЕТ');
+    $('buy-amount').value = '';
+    $('buy').classList.remove('hidden');
+    $('buy-amount').focus();
+  }
+
+  const sleep = (ms) => new Promise((res) => setTimeout(res, ms));
+  function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + Math.random().toString(36).slice(2);
+  }
+
+  function closeBuy() { state.buy = null; $('buy').classList.add('hidden'); }
+
+  async function submitBuy() {
+    const amount = parseFloat($('buy-amount').value);
+    if (!state.buy || !(amount > 0)) return;
+    $('buy-ok').disabled = true;
+    // один ключ на попытку покупки: повторы при сетевых сбоях не создают вторую сделку
+    const order = Object.assign({ amount: amount, idempotency_key: newIdempotencyKey() }, state.buy);
+    try {
+      let r = null;
+      for (let attempt = 0; attempt < 3 && !r; attempt++) {
+        try { r = await api('/api/market/buy', order); } catch (e) { await sleep(500 * (attempt + 1)); }
+      }
+      if (!r) { alert('Сеть недоступна, попробуйте позже'); return; }
+      if (!r.success) { alert('Ошибка: ' + r.error); return; }
+      const e = state.byUuid[state.buy.event_uuid];
+      if (e && e.markets[state.buy.option_index]) e.markets[state.buy.option_index].yes_price = r.market.yes_price;
+      closeBuy();
+      await Promise.all([loadMe(), loadTrades('new')]);
+      renderAll();
+    } finally {
+      $('buy-ok').disabled = false;
+    }
+  }
+
+  // ---- продажа позиции целиком ----
+  async function sellPosition(key) {
+    const [uuid, idx, side, qty] = key.split('|');
+    if (!confirm('Продать ' + num(Number(qty)) + ' шт.?')) return;
+    const order = { event_uuid: uuid, option_index: Number(idx), side: side, shares: Number(qty), idempotency_key: newIdempotencyKey() };
+    let r = null;
+    for (let attempt = 0; attempt < 3 && !r; attempt++) {
+      try { r = await api('/api/market/sell', order); } catch (e) { await sleep(500 * (attempt + 1)); }
+    }
+    if (!r) { alert('Сеть недоступна, попробуйте позже'); return; }
+    if (!r.success) { alert('Ошибка: ' + r.error); return; }
+    const e = state.byUuid[uuid];
+    if (e && e.markets[Number(idx)]) e.markets[Number(idx)].yes_price = r.market.yes_price;
+    await Promise.all([loadMe(), loadTrades('new')]);
+    renderAll();
+  }
+
+  document.addEventListener('click', (ev) => {
+    const t = ev.target;
+    if (t.dataset.bm) toggleBookmark(t.dataset.bm);
+    else if (t.dataset.buy) openBuy(t.dataset.buy);
+    else if (t.dataset.sell) sellPosition(t.dataset.sell);
+    else if (t.dataset.period) loadLeaders(t.dataset.period);
+    else if (t.dataset.sort) { state.feed.sort = t.dataset.sort; loadFeed(false); }
+  });
+  document.addEventListener('change', (ev) => {
+    if (ev.target.id === 'ev-tag') { state.feed.tag = ev.target.value; loadFeed(false); return; }
+    if (ev.target.id === 'bm-events' && ev.target.checked) { loadBookmarked().then(renderAll); return; }
+    if (ev.target.type === 'checkbox') renderAll();
+  });
+  $('events-more').addEventListener('click', () => loadFeed(true));
+  let searchTimer = null;
+  $('ev-search').addEventListener('input', (ev) => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => searchEvents(ev.target.value.trim()), 250);
+  });
+  $('buy-ok').addEventListener('click', submitBuy);
+  $('trades-more').addEventListener('click', () => loadTrades('more').then(renderTrades));
+  $('buy-cancel').addEventListener('click', closeBuy);
+  $('avatar').src = '/api/userpic?' + AUTH_QS;
+
+  // ---- live-цены (SSE): одно соединение на все видимые события ----
+  // Потоков SSE на воркер мало (каждый держит поток сервера): на 503 переходим на короткий опрос
+  const PRICE_POLL_MS = 5000;
+  let stream = null;
+  let pollTimer = null;
+  function applyPrices(items) {
+    items.forEach((u) => {
+      const e = state.byUuid[u.e];
+      const m = e && e.markets[u.i];
+      if (!m) return;
+      if (u.p != null) m.yes_price = u.p;
+      if (u.r) { m.resolved = true; m.winner_side = u.w; }
+    });
+    renderEvents();
+  }
+
+  function pollPrices(uuids) {
+    clearInterval(pollTimer);
+    const path = '/api/prices?events=' + encodeURIComponent(uuids.join(','));
+    pollTimer = setInterval(async () => {
+      if (document.hidden) return;
+      const data = await api(path).catch(() => null);
+      if (data && data.success) applyPrices(data.items);
+    }, PRICE_POLL_MS);
+  }
+
+  function subscribePrices() {
+    if (stream) stream.close();
+    stream = null;
+    clearInterval(pollTimer);
+    // последние загруженные страницы ленты — то, что пользователь сейчас листает
+    const uuids = state.events.map((e) => e.event_uuid).slice(-50);
+    if (!uuids.length) return;
+    if (!window.EventSource) { pollPrices(uuids); return; }
+    const es = stream = new EventSource('/api/stream/prices?events=' + encodeURIComponent(uuids.join(',')) + '&' + AUTH_QS);
+    es.addEventListener('prices', (ev) => applyPrices(JSON.parse(ev.data)));
+    // ответ не 200 (too_many_streams) закрывает EventSource насовсем; обрыв — переподключение само
+    es.onerror = () => { if (es.readyState === EventSource.CLOSED && stream === es) pollPrices(uuids); };
+  }
+
+  Promise.all([loadEvents(), loadMe(), loadTrades()]).then(renderAll).then(subscribePrices);
+  loadLeaders('week');
+})();
@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+try:
+    import brotli  # необязательная зависимость: без неё отдаём только gzip
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+MIN_COMPRESS_SIZE = 256
+
+
+class Asset:
+    __slots__ = ("name", "hashed_name", "mimetype", "etag", "variants")
+
+    def __init__(self, name: str, body: bytes):
+        digest = hashlib.sha256(body).hexdigest()[:12]
+        base, ext = os.path.splitext(name)
+        self.name = name
+        self.hashed_name = f"{base}.{digest}{ext}"
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.etag = digest
+        self.variants = {"identity": body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11)
+
+    def negotiate(self, accept_encoding: str):
+        """Возвращает (body, content_encoding|None) под Accept-Encoding клиента."""
+        accepted = {p.split(";")[0].strip().lower() for p in (accept_encoding or "").split(",")}
+        for enc in ("br", "gzip"):
+            if enc in accepted and enc in self.variants:
+                return self.variants[enc], enc
+        return self.variants["identity"], None
+
+
+class StaticBundle:
+    """
+    Статика Mini App с content-hash в имени файла.
+    Файлы читаются и сжимаются один раз (лениво, при первом обращении),
+    дальше отдаются из памяти с immutable-кэшированием.
+    """
+
+    def __init__(self, root: str = STATIC_DIR, prefix: str = "/assets/"):
+        self.root = root
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._by_name = None
+        self._by_hashed = None
+        self._version = ""
+
+    def _load(self):
+        with self._lock:
+            if self._by_name is not None:
+                return
+            by_name, by_hashed = {}, {}
+            for dirpath, _, files in os.walk(self.root):
+                for fn in sorted(files):
+                    path = os.path.join(dirpath, fn)
+                    name = os.path.relpath(path, self.root).replace(os.sep, "/")
+                    with open(path, "rb") as f:
+                        asset = Asset(name, f.read())
+                    by_name[name] = asset
+                    by_hashed[asset.hashed_name] = asset
+            h = hashlib.sha256()
+            for name in sorted(by_name):
+                h.update(by_name[name].hashed_name.encode())
+            self._version = h.hexdigest()[:12]
+            self._by_hashed = by_hashed
+            self._by_name = by_name
+
+    def _ensure(self):
+        if self._by_name is None:
+            self._load()
+
+    @property
+    def version(self) -> str:
+        self._ensure()
+        return self._version
+
+    def url(self, name: str) -> str:
+        self._ensure()
+        asset = self._by_name.get(name)
+        if not asset:
+            raise KeyError(name)
+        return self.prefix + asset.hashed_name
+
+    def lookup(self, hashed_name: str):
+        self._ensure()
+        return self._by_hashed.get(hashed_name)
+
+
+bundle = StaticBundle()
@@ -0,0 +1,35 @@
+import pytest
+
+from amm import PredictionMarketAMM, initial_reserves
+
+
+@pytest.mark.parametrize("side", ["yes", "no"])
+@pytest.mark.parametrize("reserves", [(1000.0, 1000.0), (600.0, 1500.0)])
+def test_buy_then_sell_round_trip(side, reserves):
+    amm = PredictionMarketAMM(*reserves)
+    price0 = amm.calculate_yes_price()
+    shares, _ = amm.buy_shares(side, 100)
+    amount, _ = amm.sell_shares(side, shares)
+    assert amount == pytest.approx(100, rel=1e-9)
+    assert amm.calculate_yes_price() == pytest.approx(price0, rel=1e-9)
+    assert float(amm.yes_reserve) == pytest.approx(reserves[0], rel=1e-9)
+    assert float(amm.no_reserve) == pytest.approx(reserves[1], rel=1e-9)
+
+
+def test_buy_moves_price_towards_bought_side():
+    amm = PredictionMarketAMM()
+    shares, yes_price = amm.buy_shares("yes", 100)
+    # модель rpc_trade_buy / истории: no + a, yes = k / no
+    assert shares == pytest.approx(1000 + 100 - 1e6 / 1100)
+    assert yes_price == pytest.approx(1100 / (1e6 / 1100 + 1100))
+    assert yes_price > 0.5
+    _, no_price = amm.buy_shares("no", 100)
+    assert no_price == pytest.approx(amm.calculate_no_price())
+
+
+def test_initial_reserves_price():
+    y, n = initial_reserves(1000, 0.2)
+    assert n / (y + n) == pytest.approx(0.2)
+    assert y * n == pytest.approx(1e6)
+    with pytest.raises(ValueError):
+        initial_reserves(1000, 1.0)
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+import batching
+from batching import TradeBatcher
+
+
+class FakeExec:
+    def __init__(self, batch_result=None, gate=None):
+        self.single_calls = []
+        self.batch_calls = []
+        self.batch_result = batch_result  # orders -> список результатов
+        self.gate = gate                  # threading.Event: держит execute_batch до сигнала
+
+    def single(self, market_id, payload):
+        self.single_calls.append((market_id, payload))
+        return {"n": payload["n"]}
+
+    def batch(self, market_id, payloads):
+        self.batch_calls.append((market_id, [p["n"] for p in payloads]))
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.batch_result is not None:
+            return self.batch_result(payloads)
+        return [{"n": p["n"]} for p in payloads]
+
+
+def _submit_all(batcher, market_id, ns, wait_open=True):
+    """Первый ордер — лидер; остальные подаются, когда пакет рынка уже открыт."""
+    out, threads = {}, []
+
+    def run(n):
+        try:
+            out[n] = batcher.submit(market_id, {"n": n})
+        except Exception as e:
+            out[n] = e
+
+    for i, n in enumerate(ns):
+        t = threading.Thread(target=run, args=(n,))
+        t.start()
+        threads.append(t)
+        if i == 0 and wait_open:
+            deadline = time.monotonic() + 2
+            while market_id not in batcher._open and time.monotonic() < deadline:
+                time.sleep(0.001)
+    for t in threads:
+        t.join(10)
+    return out
+
+
+def test_single_order_goes_to_execute_single():
+    fx = FakeExec()
+    b = TradeBatcher(fx.single, fx.batch, window_ms=1, max_batch=10)
+    assert b.submit(7, {"n": 1}) == {"n": 1}
+    assert fx.single_calls == [(7, {"n": 1})]
+    assert fx.batch_calls == []
+
+
+def test_orders_in_window_coalesce_into_one_batch():
+    fx = FakeExec()
+    b = TradeBatcher(fx.single, fx.batch, window_ms=300, max_batch=10)
+    out = _submit_all(b, 7, [1, 2, 3])
+    assert fx.batch_calls == [(7, [1, 2, 3])]
+    assert out == {1: {"n": 1}, 2: {"n": 2}, 3: {"n": 3}}
+    assert 7 not in b._open
+
+
+def test_full_batch_runs_without_waiting_for_window():
+    fx = FakeExec()
+    b = TradeBatcher(fx.single, fx.batch, window_ms=10_000, max_batch=2)
+    started = time.monotonic()
+    out = _submit_all(b, 7, [1, 2])
+    assert time.monotonic() - started < 5
+    assert fx.batch_calls == [(7, [1, 2])]
+    assert out == {1: {"n": 1}, 2: {"n": 2}}
+
+
+def test_per_order_errors_reach_only_their_order():
+    def result(payloads):
+        return [RuntimeError("insufficient_balance") if p["n"] == 2 else {"n": p["n"]} for p in payloads]
+
+    fx = FakeExec(batch_result=result)
+    b = TradeBatcher(fx.single, fx.batch, window_ms=300, max_batch=3)
+    out = _submit_all(b, 7, [1, 2, 3])
+    assert out[1] == {"n": 1} and out[3] == {"n": 3}
+    assert isinstance(out[2], RuntimeError) and str(out[2]) == "insufficient_balance"
+
+
+def test_result_count_mismatch_fails_every_order():
+    fx = FakeExec(batch_result=lambda payloads: [{"n": p["n"]} for p in payloads[:-1]])
+    b = TradeBatcher(fx.single, fx.batch, window_ms=300, max_batch=3)
+    out = _submit_all(b, 7, [1, 2, 3])
+    assert all(isinstance(out[n], RuntimeError) for n in (1, 2, 3))
+    assert "batch_result_mismatch" in str(out[1])
+
+
+def test_batch_exception_fails_every_order():
+    def result(payloads):
+        raise ConnectionError("db down")
+
+    fx = FakeExec(batch_result=result)
+    b = TradeBatcher(fx.single, fx.batch, window_ms=300, max_batch=2)
+    out = _submit_all(b, 7, [1, 2])
+    assert all(isinstance(out[n], ConnectionError) for n in (1, 2))
+
+
+def test_follower_times_out_while_leader_still_runs(monkeypatch):
+    monkeypatch.setattr(batching, "WAIT_TIMEOUT", 0.05)
+    gate = threading.Event()
+    fx = FakeExec(gate=gate)
+    b = TradeBatcher(fx.single, fx.batch, window_ms=10_000, max_batch=2)
+
+    out = {}
+    leader = threading.Thread(target=lambda: out.setdefault(1, b.submit(7, {"n": 1})))
+    leader.start()
+    while 7 not in b._open:
+        time.sleep(0.001)
+    with pytest.raises(TimeoutError):
+        b.submit(7, {"n": 2})
+    gate.set()
+    leader.join(5)
+    # лидер всё равно исполнил оба ордера — поэтому таймаут не означает отказ сделки
+    assert out[1] == {"n": 1}
+    assert fx.batch_calls == [(7, [1, 2])]
@@ -0,0 +1,58 @@
+from feed import EventFeed, decode_feed_cursor
+
+
+def _event(uuid, created, end, tags=()):
+    return {"event_uuid": uuid, "name": uuid, "created_at": created, "end_date": end, "tags": list(tags)}
+
+
+EVENTS = [
+    _event("a", "2024-05-01T00:00:00+00:00", "2024-06-03T00:00:00+00:00", ["sport"]),
+    _event("b", "2024-05-02T00:00:00+00:00", "2024-06-01T00:00:00+00:00", ["Politics"]),
+    _event("c", "2024-05-03T00:00:00+00:00", "2024-06-02T00:00:00+00:00", ["sport"]),
+]
+
+
+def _feed(events=EVENTS, buckets=None, by_uuids=None):
+    return EventFeed(lambda: list(events), by_uuids or (lambda uuids: []), lambda uuids: buckets or {})
+
+
+def _uuids(rows):
+    return [r["event_uuid"] for r in rows]
+
+
+def test_orders_and_tags():
+    feed = _feed()
+    assert _uuids(feed.page("new")[0]) == ["c", "b", "a"]
+    assert _uuids(feed.page("ending")[0]) == ["b", "c", "a"]
+    assert _uuids(feed.page("new", tag="sport")[0]) == ["c", "a"]
+    assert _uuids(feed.page("new", tag="politics")[0]) == ["b"]
+    assert feed.tags() == ["sport", "politics"]
+
+
+def test_pages_with_cursor_cover_all_events():
+    feed = _feed()
+    rows, cur = feed.page("new", limit=2)
+    assert _uuids(rows) == ["c", "b"] and cur
+    rows, cur = feed.page("new", limit=2, cursor=decode_feed_cursor(cur, "new"))
+    assert _uuids(rows) == ["a"] and cur is None
+    assert decode_feed_cursor(feed.page("new", limit=1)[1], "ending") is None
+
+
+def test_trades_drive_trending():
+    feed = _feed(buckets={"a": [(1.7e9, 10.0)]})
+    assert _uuids(feed.page("trending")[0])[0] == "a"
+    feed.apply_trade({"event_uuid": "b", "amount": 1e6})
+    assert _uuids(feed.page("trending")[0])[0] == "b"
+    # события без сделок — после всех
+    assert _uuids(feed.page("trending")[0]) == ["b", "a", "c"]
+
+
+def test_created_and_closed_events():
+    new = _event("d", "2024-05-04T00:00:00+00:00", "2024-06-04T00:00:00+00:00", ["sport"])
+    feed = _feed(by_uuids=lambda uuids: [new] if "d" in uuids else [])
+    feed.page("new")
+    feed.apply_created({"event_uuid": "d", "is_published": True})
+    assert _uuids(feed.page("new")[0])[0] == "d"
+    feed.apply_closed({"event_uuid": "c"})
+    assert _uuids(feed.page("new", tag="sport")[0]) == ["d", "a"]
+    assert _uuids(feed.get_many(["c", "a", "zzz"])) == ["a"]
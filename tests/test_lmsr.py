@@ -0,0 +1,49 @@
+import math
+
+import pytest
+
+from lmsr import LmsrBook, share_deltas
+
+
+@pytest.mark.parametrize("q", [(0, 0), (0, 0, 0), (120, -40, 300, 5), (5000, 0, 0)])
+def test_prices_sum_to_one(q):
+    book = LmsrBook(100, q)
+    assert sum(book.prices()) == pytest.approx(1.0)
+    assert all(0 <= p <= 1 for p in book.prices())
+
+
+@pytest.mark.parametrize("side", ["yes", "no"])
+@pytest.mark.parametrize("amount", [0.5, 50, 2000])
+def test_shares_for_inverts_cost(side, amount):
+    book = LmsrBook(300, (10, -20, 40))
+    shares = book.shares_for(1, side, amount)
+    before = book.cost()
+    book.apply_shares(1, side, shares)
+    assert book.cost() - before == pytest.approx(amount, rel=1e-9)
+
+
+def test_sell_returns_buy_amount():
+    book = LmsrBook(100, (0, 0, 0))
+    shares, _ = book.buy(2, "no", 75)
+    amount, _ = book.sell(2, "no", shares)
+    assert amount == pytest.approx(75)
+    assert book.q == pytest.approx((0, 0, 0), abs=1e-9)
+
+
+def test_max_loss_bound():
+    # убыток маркет-мейкера не больше b * ln N: C(0) = b ln N, а C(q) >= max(q)
+    assert LmsrBook(100, (0, 0, 0, 0)).cost() == pytest.approx(100 * math.log(4))
+    assert LmsrBook(100, (1e6, 0, 0, 0)).cost() == pytest.approx(1e6)
+
+
+def test_price_path_matches_step_replay():
+    trades = [(0, True, 10.0), (1, False, 25.0), (2, True, -5.0), (1, True, 40.0)]
+    d = share_deltas(3, *zip(*trades))
+    book = LmsrBook(50, (1, 2, 3))
+    path = book.price_path(1, d)
+    step = LmsrBook(50, (1, 2, 3))
+    for (i, yes, s), p in zip(trades, path):
+        step.apply_shares(i, "yes" if yes else "no", s)
+        assert p == pytest.approx(step.price(1))
+    book.apply_deltas(d)
+    assert book.q == pytest.approx(step.q)
@@ -0,0 +1,24 @@
+import base64
+import json
+
+from pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    ts = "2024-05-01T12:30:00.123456+00:00"
+    assert decode_cursor(encode_cursor(ts, 42)) == (ts, 42)
+
+
+def test_cursor_is_url_safe():
+    cur = encode_cursor("2024-05-01T12:30:00+00:00", 10 ** 12)
+    assert "=" not in cur and "+" not in cur and "/" not in cur
+
+
+def test_bad_cursors():
+    assert decode_cursor("") is None
+    assert decode_cursor(None) is None
+    assert decode_cursor("!!!") is None
+    # символы вне ISO-8601 не должны попасть в фильтр or=(...)
+    assert decode_cursor(encode_cursor("2024-05-01),id.gt.(0", 1)) is None
+    raw = base64.urlsafe_b64encode(json.dumps(["2024-05-01T00:00:00Z", "x"]).encode()).decode()
+    assert decode_cursor(raw) is None
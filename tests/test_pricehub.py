@@ -0,0 +1,29 @@
+from pricehub import PriceHub, SSE_MAX_STREAMS, streams_for_threads
+
+
+def test_streams_leave_threads_for_other_requests():
+    assert streams_for_threads(1) == 0
+    assert streams_for_threads(4) == 1
+    assert streams_for_threads(8) == 2
+    assert streams_for_threads(10_000) == SSE_MAX_STREAMS
+
+
+def test_limit_and_unsubscribe():
+    hub = PriceHub(max_streams=1)
+    sub = hub.subscribe(["ev"])
+    assert sub is not None
+    assert hub.subscribe(["ev"]) is None
+    hub.unsubscribe(sub)
+    assert hub.subscribe(["ev"]) is not None
+
+
+def test_updates_coalesce_per_market():
+    hub = PriceHub()
+    sub = hub.subscribe(["ev"])
+    hub.publish("ev", 1, {"p": 0.4})
+    hub.publish("ev", 1, {"p": 0.6})
+    hub.publish("ev", 2, {"p": 0.1})
+    assert hub.publish("other", 3, {"p": 0.5}) == 0
+    assert sub.wait(0)
+    assert sorted(u["p"] for u in sub.drain()) == [0.1, 0.6]
+    assert not sub.wait(0)
@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from reconcile import INITIAL_BALANCE, ReconcileState, Reconciler
+
+
+class FakeSource:
+    def __init__(self, ledger, balances):
+        self.ledger = ledger        # [{"id", "chat_id", "delta"}] по возрастанию id
+        self.balances = balances    # chat_id -> баланс
+
+    def ledger_page(self, after_id, limit, before_iso=None):
+        return [r for r in self.ledger if r["id"] > after_id][:limit]
+
+    def ledger_rows_for_users(self, chat_ids, after_id):
+        return [r for r in self.ledger if r["id"] > after_id and r["chat_id"] in chat_ids]
+
+    def user_balances(self, chat_ids):
+        return {c: self.balances[c] for c in chat_ids if c in self.balances}
+
+    def users_balance_page(self, after, limit):
+        ids = sorted(c for c in self.balances if after is None or c > after)[:limit]
+        return [{"chat_id": c, "balance": self.balances[c]} for c in ids]
+
+
+def _row(i, chat_id, delta):
+    return {"id": i, "chat_id": chat_id, "delta": delta}
+
+
+def test_incremental_finds_drift_and_tracks_hwm():
+    ledger = [_row(1, 1, -100), _row(2, 2, 50), _row(3, 1, 20)]
+    src = FakeSource(ledger, {1: float(INITIAL_BALANCE) - 80, 2: float(INITIAL_BALANCE) + 49})
+    rec = Reconciler(src, ReconcileState(), page_size=2, lag=0)
+    report = rec.run_incremental()
+    assert [r["chat_id"] for r in report] == [2]
+    assert Decimal(report[0]["drift"]) == Decimal(-1)
+    assert not report[0]["repeated"]
+    assert rec.state.hwm == 3 and rec.ledger_rows == 3
+
+    # второй запуск: новых строк нет, но пользователь с дрейфом проверяется снова
+    rec = Reconciler(src, rec.state, page_size=2, lag=0)
+    report = rec.run_incremental()
+    assert rec.ledger_rows == 0
+    assert report[0]["repeated"]
+
+    src.balances[2] = float(INITIAL_BALANCE) + 50
+    assert Reconciler(src, rec.state, lag=0).run_incremental() == []
+
+
+def test_full_audit_sees_users_without_ledger():
+    src = FakeSource([_row(1, 1, 10)], {1: float(INITIAL_BALANCE) + 10, 7: float(INITIAL_BALANCE) + 5})
+    report = Reconciler(src, ReconcileState(), lag=0).run_full()
+    assert [r["chat_id"] for r in report] == [7]
+
+
+def test_state_round_trip(tmp_path):
+    state = ReconcileState()
+    state.apply([_row(1, 5, "1.5"), _row(4, 5, "-0.25")])
+    path = str(tmp_path / "state.json")
+    state.save(path)
+    loaded = ReconcileState.load(path)
+    assert loaded.hwm == 4
+    assert loaded.expected(5) == INITIAL_BALANCE + Decimal("1.25")
+    assert loaded.rows(5) == 2
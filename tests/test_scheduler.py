@@ -0,0 +1,120 @@
+import threading
+import types
+
+import scheduler
+from scheduler import EXPIRY_RETRY, ExpiryScheduler, parse_ts
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeEvents:
+    """events: event_uuid -> end_ts; close_expired закрывает истёкшие к clock.now, как RPC."""
+
+    def __init__(self, clock, events):
+        self.clock = clock
+        self.events = dict(events)
+        self.closed = set()
+        self.calls = 0
+        self.fail = False
+
+    def load_deadlines(self):
+        return [(u, ts) for u, ts in self.events.items() if u not in self.closed]
+
+    def close_expired(self):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("db down")
+        rows = []
+        for u, ts in sorted(self.events.items(), key=lambda kv: kv[1]):
+            if u not in self.closed and ts <= self.clock.now:
+                self.closed.add(u)
+                rows.append({"event_uuid": u, "name": u, "end_date": ts})
+        return rows
+
+
+def _make(monkeypatch, events, now=0.0):
+    clock = FakeClock(now)
+    monkeypatch.setattr(scheduler, "time", types.SimpleNamespace(time=clock.time, monotonic=clock.time))
+    fake = FakeEvents(clock, events)
+    sched = ExpiryScheduler(fake.load_deadlines, fake.close_expired)
+    sched.reload()
+    return clock, fake, sched
+
+
+def test_parse_ts_treats_naive_as_utc():
+    assert parse_ts("1970-01-01T00:01:40") == 100.0
+    assert parse_ts("1970-01-01 00:01:40Z") == 100.0
+    assert parse_ts("1970-01-01T03:01:40+03:00") == 100.0
+    assert parse_ts("") is None and parse_ts("nope") is None
+
+
+def test_expired_events_close_once(monkeypatch):
+    clock, fake, sched = _make(monkeypatch, {"a": 100.0, "b": 200.0})
+    assert sched.next_deadline() == 100.0
+
+    clock.now = 150.0
+    assert [r["event_uuid"] for r in sched.sweep()] == ["a"]
+    assert sched.sweep() == []
+    assert fake.calls == 1  # нечего закрывать — RPC не дёргаем
+    assert sched.next_deadline() == 200.0
+
+    clock.now = 250.0
+    assert [r["event_uuid"] for r in sched.sweep()] == ["b"]
+    assert sched.sweep() == [] and sched.next_deadline() is None
+
+
+def test_rescheduled_event_closes_at_new_date(monkeypatch):
+    clock, fake, sched = _make(monkeypatch, {"a": 100.0})
+    fake.events["a"] = 300.0
+    sched.schedule("a", 300.0)  # end_date перенесли: старая запись кучи устарела
+    assert sched.next_deadline() == 300.0
+
+    clock.now = 150.0
+    assert sched.sweep() == []
+    assert fake.calls == 0
+
+    clock.now = 300.0
+    assert [r["event_uuid"] for r in sched.sweep()] == ["a"]
+
+
+def test_cancelled_event_is_not_swept(monkeypatch):
+    clock, fake, sched = _make(monkeypatch, {"a": 100.0})
+    sched.cancel("a")
+    clock.now = 150.0
+    assert sched.sweep() == [] and fake.calls == 0
+
+
+def test_close_error_retries_later(monkeypatch):
+    clock, fake, sched = _make(monkeypatch, {"a": 100.0})
+    fake.fail = True
+    clock.now = 150.0
+    assert sched.sweep() == []
+    assert sched.next_deadline() == 150.0 + EXPIRY_RETRY
+
+    fake.fail = False
+    clock.now += EXPIRY_RETRY
+    assert [r["event_uuid"] for r in sched.sweep()] == ["a"]
+
+
+def test_listeners_fire_per_closed_row(monkeypatch):
+    # RPC закрывает и события, запланированные в других процессах, — слушатель получает каждое
+    clock, fake, sched = _make(monkeypatch, {"a": 100.0})
+    fake.events.update(b=90.0, c=500.0)
+    seen = []
+    sched.on_closed(lambda row: seen.append(row["event_uuid"]))
+
+    @sched.on_closed
+    def broken(row):
+        raise RuntimeError("listener failed")
+
+    threading.Thread(target=sched._run_listeners, daemon=True).start()
+    clock.now = 100.0
+    assert len(sched.sweep()) == 2
+    sched._notify.join()
+    assert seen == ["b", "a"]
@@ -0,0 +1,61 @@
+from search import SearchIndex, stem, tokens
+
+
+def _event(uuid, name, created="2024-05-01T00:00:00+00:00", **kw):
+    row = {"event_uuid": uuid, "name": name, "description": "", "tags": [], "options": [],
+           "is_published": True, "is_closed": False, "created_at": created}
+    row.update(kw)
+    return row
+
+
+EVENTS = [
+    _event("11111111-aaaa", "Выборы президента США", tags=["политика"]),
+    _event("22222222-bbbb", "Финал Лиги чемпионов", description="кто выиграет финал",
+           options=[{"text": "Реал"}, {"text": "Боруссия"}], created="2024-05-02T00:00:00+00:00"),
+    _event("33333333-cccc", "Курс биткоина выше 100k", tags=["крипта"]),
+    _event("44444444-dddd", "Выборы в Европарламент", is_published=False),
+    _event("55555555-eeee", "Финал чемпионата мира", is_closed=True),
+]
+
+
+def _index(events=EVENTS, by_uuids=None):
+    return SearchIndex(lambda: iter([list(events)]), by_uuids or (lambda uuids: []))
+
+
+def test_tokens_normalize():
+    assert tokens("Выборы, ВЫБОРОВ и ёлка") == [stem("выборы"), stem("выборов"), stem("елка")]
+    assert stem("выборы") == stem("выборов")
+
+
+def test_prefix_and_all_words_required():
+    idx = _index()
+    assert idx.search("выбор") == ["11111111-aaaa"]
+    assert idx.search("выборы сша") == ["11111111-aaaa"]
+    assert idx.search("выборы биткоин") == []
+    assert idx.search("реал") == ["22222222-bbbb"]
+    assert idx.search("   ") == []
+
+
+def test_filters_and_ranking():
+    idx = _index()
+    assert idx.search("финал") == ["22222222-bbbb"]
+    assert set(idx.search("финал", open_only=False)) == {"22222222-bbbb", "55555555-eeee"}
+    assert set(idx.search("выборы", published_only=False)) == {"11111111-aaaa", "44444444-dddd"}
+    # слово в названии весит больше, чем в описании, даже у более старого события
+    ranked = _index([
+        _event("new", "Дождь в Москве", created="2024-05-09T00:00:00+00:00", description="погода"),
+        _event("old", "Погода в Москве"),
+    ])
+    assert ranked.search("погода") == ["old", "new"]
+    # поиск по идентификатору (для админки)
+    assert idx.search("33333333", published_only=False) == ["33333333-cccc"]
+
+
+def test_bus_updates():
+    new = _event("66666666-ffff", "Курс эфира")
+    idx = _index(by_uuids=lambda uuids: [new] if new["event_uuid"] in uuids else [])
+    assert idx.search("курс") == ["33333333-cccc"]
+    idx.apply_created({"event_uuid": new["event_uuid"]})
+    assert set(idx.search("курс")) == {"33333333-cccc", "66666666-ffff"}
+    idx.apply_closed({"event_uuid": "33333333-cccc"})
+    assert idx.search("биткоин") == []
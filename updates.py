@@ -0,0 +1,119 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "4"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+SUBMIT_TIMEOUT = float(os.getenv("UPDATE_SUBMIT_TIMEOUT", "2"))  # сколько ждать места в очереди, с
+DEDUP_WINDOW = 10_000
+
+
+def update_chat_id(update: dict) -> int:
+    """chat_id апдейта — ключ упорядочивания (0, если чата нет)."""
+    for key in ("message", "edited_message", "callback_query", "my_chat_member"):
+        obj = update.get(key)
+        if not obj:
+            continue
+        if key == "callback_query":
+            obj = obj.get("message") or {}
+        chat = obj.get("chat") or {}
+        if "id" in chat:
+            return int(chat["id"])
+    return 0
+
+
+class UpdateDeduper:
+    """
+    Окно последних update_id: Telegram повторяет доставку, если мы ответили медленно.
+    Окно своё у каждого процесса: повтор, попавший в другой воркер gunicorn, обработается ещё раз.
+    Поэтому обработчики апдейтов должны переживать дубль: регистрация упирается в первичный
+    ключ users.chat_id, остальное — ответы в чат, которые пользователь увидит дважды.
+    """
+
+    def __init__(self, window: int = DEDUP_WINDOW):
+        self.window = window
+        self._order = deque()
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, update_id) -> bool:
+        if update_id is None:
+            return False
+        with self._lock:
+            if update_id in self._seen:
+                return True
+            self._seen.add(update_id)
+            self._order.append(update_id)
+            if len(self._order) > self.window:
+                self._seen.discard(self._order.popleft())
+            return False
+
+    def forget(self, update_id):
+        """Апдейт не принят (ответили не 2xx) — повторная доставка не должна считаться дублем."""
+        if update_id is None:
+            return
+        with self._lock:
+            self._seen.discard(update_id)
+
+
+class ChatOrderedExecutor:
+    """
+    Пул потоков с сохранением порядка внутри чата: апдейты одного chat_id
+    всегда попадают в одну и ту же очередь (chat_id % workers) и исполняются по очереди.
+    Потоки стартуют лениво и пересоздаются после fork. Порядок держится только внутри процесса:
+    между воркерами gunicorn он не согласован (см. README, «Приём апдейтов Telegram»).
+    """
+
+    def __init__(self, workers: int = UPDATE_WORKERS, queue_size: int = UPDATE_QUEUE_SIZE, name: str = "updates"):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.name = name
+        self._queues = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queues = [queue.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+            for i, q in enumerate(self._queues):
+                threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}", daemon=True).start()
+            self._pid = os.getpid()
+            atexit.register(self.drain)
+
+    def submit(self, chat_id: int, fn, *args, timeout: float | None = SUBMIT_TIMEOUT) -> bool:
+        """
+        Ждёт места в очереди чата не дольше timeout (None — сколько угодно). False — очередь так и
+        не освободилась; выполнять задачу в обход очереди нельзя — нарушится порядок чата.
+        """
+        self._ensure_started()
+        try:
+            self._queues[abs(int(chat_id)) % self.workers].put((fn, args), timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def _run(self, q):
+        while True:
+            fn, args = q.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[{self.name}] task error: {e}")
+            finally:
+                q.task_done()
+
+    def pending(self) -> int:
+        return sum(q.unfinished_tasks for q in self._queues)
+
+    def drain(self, timeout: float = 10.0):
+        """Дожидается разбора очередей (при остановке воркера), но не дольше timeout."""
+        deadline = time.monotonic() + timeout
+        while self._pid == os.getpid() and self.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
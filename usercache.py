@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("USER_CACHE_NEGATIVE_TTL", "10"))
+USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", "50000"))
+
+_MISS = object()
+
+
+class UserCache:
+    """
+    Кэш записей users по chat_id (LRU + TTL). Неизвестные пользователи тоже
+    кэшируются (значение None) с более коротким TTL — повторный /start от
+    незарегистрированного не ходит в БД. Инвалидация — по событиям шины.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, negative_ttl: float = USER_CACHE_NEGATIVE_TTL,
+                 max_items: int = USER_CACHE_MAX):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, chat_id: int):
+        """Возвращает запись, None (известно, что пользователя нет) или _MISS."""
+        with self._lock:
+            item = self._items.get(chat_id)
+            if item is None:
+                return _MISS
+            expires, user = item
+            if expires < time.monotonic():
+                del self._items[chat_id]
+                return _MISS
+            self._items.move_to_end(chat_id)
+            return dict(user) if user is not None else None
+
+    def put(self, chat_id: int, user):
+        ttl = self.ttl if user is not None else self.negative_ttl
+        with self._lock:
+            self._items[chat_id] = (time.monotonic() + ttl, dict(user) if user is not None else None)
+            self._items.move_to_end(chat_id)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def update_fields(self, chat_id: int, **fields):
+        """Точечно обновляет закэшированную запись (например, баланс после сделки)."""
+        with self._lock:
+            item = self._items.get(chat_id)
+            if item is None or item[1] is None:
+                return
+            item[1].update(fields)
+
+    def invalidate(self, chat_id: int):
+        with self._lock:
+            self._items.pop(chat_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def is_miss(value) -> bool:
+    return value is _MISS